@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+#
+# benchmark.py -- timings of the pairing and storage hot paths
+#
+# Two suites are available:
+#
+#   tournament   -- plays a tournament up to its total number of rounds
+#                   through the tournament.py functions, timing
+#                   swissPairings() end to end, Draw.getPairings(),
+#                   playerStandings(), matchesHistory(), pairingSnapshot()
+#                   and reportMatch()
+#                   at each round, on each requested storage backend.
+#   adversarial  -- draws rounds over synthetic histories where every
+#                   player has already met his or her neighbours in the
+#                   standings, forcing Draw through its swap and
+#                   backtracking paths.
+#
+# Results are written as JSON, so that runs can be compared.  A size
+# that fails is recorded as an 'error' entry and the run goes on with
+# the next one, so that a single crash doesn't lose every result.
+#
+# Usage:
+#
+#   python benchmark.py --sizes 8,64,512 --backends memory,sqlite \
+#       --output results.json
+
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import sys
+import time
+import traceback
+from timeit import default_timer as timer
+
+import tournament
+from swisspairings import ENGINES, InfeasibleRoundError
+
+
+DEFAULT_SIZES = '8,64,512,4096,10000,100000'
+DEFAULT_BACKENDS = 'memory,sqlite'
+
+
+def timed(function, *args):
+    """Call function(*args).
+
+    Returns:
+      A tuple (seconds, result).
+    """
+    start = timer()
+    result = function(*args)
+    return timer() - start, result
+
+
+def benchmarkTournament(backend, n_of_players, engine, sample, options):
+    """Play a tournament through tournament.py and time each round.
+
+    Args:
+      backend: the name of the storage backend.
+      n_of_players: number of enrolled players.
+      engine: the name of the pairing engine.
+      sample: how many games of each round are reported one by one with
+        reportMatch(); the rest of the round goes through reportRound().
+      options: options passed to storage.configureBackend().
+
+    Returns:
+      A list of dictionaries, one per timed operation.
+    """
+    tournament.configureBackend(backend, **options)
+    tournament.deleteMatches()
+    tournament.deletePlayers()
+
+    records = []
+
+    def record(round_number, operation, seconds, calls=1, **extra):
+        entry = {
+            'suite': 'tournament',
+            'backend': backend,
+            'engine': engine,
+            'players': n_of_players,
+            'round': round_number,
+            'operation': operation,
+            'seconds': seconds,
+            'calls': calls,
+        }
+        entry.update(extra)
+        records.append(entry)
+
+    seconds, result = timed(tournament.registerPlayers,
+                            ["Player %d" % i for i in range(n_of_players)])
+    record(0, 'registerPlayers', seconds, n_of_players)
+
+    round_number = 0
+    while True:
+        round_number += 1
+
+        seconds, pairings = timed(tournament.swissPairings, engine)
+        record(round_number, 'swissPairings', seconds)
+        if not pairings:
+            break
+
+        seconds, standings = timed(tournament.playerStandings)
+        record(round_number, 'playerStandings', seconds)
+
+        seconds, history = timed(tournament.matchesHistory)
+        record(round_number, 'matchesHistory', seconds)
+
+        seconds, (standings, opponents) = timed(tournament.pairingSnapshot)
+        record(round_number, 'pairingSnapshot', seconds)
+
+        draw = ENGINES[engine](standings, opponents=opponents)
+        seconds, result = timed(draw.getPairings)
+        record(round_number, 'getPairings', seconds, **draw.counters())
+
+        # Results are deterministic: the first player always wins,
+        # so that every run goes through the same draws.
+        results = [(id_1, id_2 or 0, 1, 0)
+                   for (id_1, name_1, id_2, name_2) in pairings]
+
+        one_by_one = results[:sample]
+        start = timer()
+        for result in one_by_one:
+            tournament.reportMatch(*result)
+        if one_by_one:
+            record(round_number, 'reportMatch', timer() - start,
+                   len(one_by_one))
+
+        if results[sample:]:
+            seconds, result = timed(tournament.reportRound, results[sample:])
+            record(round_number, 'reportRound', seconds,
+                   len(results) - len(one_by_one))
+
+    tournament.closeBackend()
+    return records
+
+
+def adversarialHistory(n_of_players, depth):
+    """Build standings and a history where every player has already
+    played against the *depth* players that follow him or her in the
+    standings (wrapping around), and, with an odd number of players,
+    everybody but the leader has already had the Bye-round.
+
+    Every player is given zero matches played, so that Draw doesn't
+    stop at the total number of rounds of the tournament.
+
+    Returns:
+      A tuple (standings, history).
+    """
+    standings = [(i, "Player %d" % i, 0, 0, 0)
+                 for i in range(1, n_of_players + 1)]
+    history = []
+    met = set()
+    for i in range(n_of_players):
+        for d in range(1, depth + 1):
+            j = (i + d) % n_of_players
+            if i != j and frozenset((i, j)) not in met:
+                met.add(frozenset((i, j)))
+                history.append((standings[i][0], standings[j][0]))
+    if n_of_players % 2 != 0:
+        history.extend((row[0], 0) for row in standings[1:])
+    return standings, history
+
+
+def benchmarkAdversarial(n_of_players, engine, depth):
+    """Time Draw.getPairings() over an adversarial history.
+
+    Returns:
+      A list with one dictionary describing the draw.
+    """
+    standings, history = adversarialHistory(n_of_players, depth)
+    draw = ENGINES[engine](standings, history)
+
+    infeasible = False
+    start = timer()
+    try:
+        draw.getPairings()
+    except InfeasibleRoundError:
+        infeasible = True
+    seconds = timer() - start
+
+    entry = {
+        'suite': 'adversarial',
+        'engine': engine,
+        'players': n_of_players,
+        'depth': depth,
+        'history': len(history),
+        'operation': 'getPairings',
+        'seconds': seconds,
+        'calls': 1,
+        'infeasible': infeasible,
+    }
+    entry.update(draw.counters())
+    return [entry]
+
+
+def failure(suite, n_of_players, engine, **extra):
+    """Describe the exception being handled as a result entry.
+
+    Returns:
+      A list with one dictionary whose 'error' holds the exception and
+      whose 'traceback' holds its formatted traceback.
+    """
+    entry = {
+        'suite': suite,
+        'engine': engine,
+        'players': n_of_players,
+        'error': repr(sys.exc_info()[1]),
+        'traceback': traceback.format_exc(),
+    }
+    entry.update(extra)
+    return [entry]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pairing and storage hot paths.")
+    parser.add_argument('--suites', default='tournament,adversarial',
+                        help="comma separated: tournament, adversarial")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help="comma separated numbers of players")
+    parser.add_argument('--backends', default=DEFAULT_BACKENDS,
+                        help="comma separated storage backends")
+    parser.add_argument('--engines', default='greedy',
+                        help="comma separated pairing engines")
+    parser.add_argument('--database', default=None,
+                        help="database passed to every backend, e.g. a DSN")
+    parser.add_argument('--sample', type=int, default=100,
+                        help="games per round reported with reportMatch()")
+    parser.add_argument('--depth', default='1,2,4',
+                        help="comma separated adversarial history depths")
+    parser.add_argument('--output', default=None,
+                        help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    suites = args.suites.split(',')
+    sizes = [int(size) for size in args.sizes.split(',')]
+    engines = args.engines.split(',')
+    options = {}
+    if args.database:
+        options['database'] = args.database
+
+    records = []
+    for engine in engines:
+        for n_of_players in sizes:
+            if 'tournament' in suites:
+                for backend in args.backends.split(','):
+                    try:
+                        records.extend(benchmarkTournament(
+                            backend, n_of_players, engine, args.sample,
+                            options
+                        ))
+                    except Exception:
+                        records.extend(failure('tournament', n_of_players,
+                                               engine, backend=backend))
+                        tournament.closeBackend()
+            if 'adversarial' in suites:
+                for depth in args.depth.split(','):
+                    try:
+                        records.extend(benchmarkAdversarial(
+                            n_of_players, engine, int(depth)
+                        ))
+                    except Exception:
+                        records.extend(failure('adversarial', n_of_players,
+                                               engine, depth=int(depth)))
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'arguments': vars(args),
+        },
+        'results': records,
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
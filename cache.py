@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+#
+# cache.py -- versioned cache of the tournament reads
+#
+# Every write through tournament.py (registerPlayer(), reportMatch(), ...)
+# bumps a revision counter, and reads are cached under the revision they
+# were computed at: between two writes, playerStandings() and
+# swissPairings() are served from the cache, and repeated pairing
+# requests return the very same draw.
+#
+# The counter and the entries live in a store:
+#
+#   MemoryStore -- inside the current process.
+#   FileStore   -- in a local directory, shared by every process of the
+#                  machine: a write in one process invalidates the
+#                  entries cached by the others.
+#
+# Only writes going through tournament.py bump the revision: the cache
+# must not be used when the database is also written by other means.
+
+import collections
+import fcntl
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+
+_store = None
+
+
+class MemoryStore(object):
+
+    """Keep the cache inside the current process,
+    evicting the least recently used entries."""
+
+    def __init__(self, maxsize=128):
+        """
+        Args:
+          maxsize: maximum number of entries kept.
+        """
+        self.maxsize = maxsize
+        self.__revision = 0
+        self.__entries = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def revision(self):
+        """Returns the current revision."""
+        return self.__revision
+
+    def bump(self):
+        """Increment the revision, dropping every entry."""
+        with self.__lock:
+            self.__revision += 1
+            self.__entries.clear()
+            return self.__revision
+
+    def get(self, revision, key):
+        """Returns a tuple (found, value)."""
+        with self.__lock:
+            if revision != self.__revision or key not in self.__entries:
+                return False, None
+            value = self.__entries.pop(key)
+            self.__entries[key] = value
+            return True, value
+
+    def set(self, revision, key, value):
+        with self.__lock:
+            if revision != self.__revision:
+                return
+            self.__entries.pop(key, None)
+            self.__entries[key] = value
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+
+class FileStore(object):
+
+    """Keep the cache inside a local directory, shared between processes.
+
+    The revision lives in a file updated under an exclusive lock, and
+    each entry is a pickle file named after its revision and key.
+    Entries of older revisions are deleted as soon as a newer entry is
+    written, and the oldest ones beyond *maxsize* are evicted.
+    """
+
+    def __init__(self, directory, maxsize=128):
+        """
+        Args:
+          directory: the directory holding the cache, created if needed.
+          maxsize: maximum number of entries kept.
+        """
+        self.directory = directory
+        self.maxsize = maxsize
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.__revisionPath = os.path.join(directory, 'revision')
+        self.__lockPath = os.path.join(directory, 'revision.lock')
+
+    def revision(self):
+        """Returns the current revision."""
+        try:
+            with open(self.__revisionPath) as f:
+                return int(f.read() or 0)
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def bump(self):
+        """Increment the revision. Entries of older revisions are left
+        to be removed by later writes, see set()."""
+        with open(self.__lockPath, 'a') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                revision = self.revision() + 1
+                self.__write(self.__revisionPath, str(revision).encode())
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+        return revision
+
+    def __write(self, path, data):
+        """Replace a file atomically."""
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def __path(self, revision, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory,
+                            'r%d-%s.entry' % (revision, digest))
+
+    def get(self, revision, key):
+        """Returns a tuple (found, value)."""
+        path = self.__path(revision, key)
+        try:
+            with open(path, 'rb') as f:
+                stored_key, value = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.PickleError):
+            return False, None
+        if stored_key != key:
+            return False, None
+        try:
+            # Keep track of the use, for eviction.
+            os.utime(path, None)
+        except OSError:
+            pass
+        return True, value
+
+    def set(self, revision, key, value):
+        self.__write(self.__path(revision, key),
+                     pickle.dumps((key, value), pickle.HIGHEST_PROTOCOL))
+        self.__evict(revision)
+
+    def __entries(self):
+        """Returns a list of tuples (mtime, revision, path)."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.entry'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            entries.append((mtime, int(name[1:name.index('-')]), path))
+        return entries
+
+    def __evict(self, revision):
+        entries = self.__entries()
+        stale = [e for e in entries if e[1] < revision]
+        current = sorted(e for e in entries if e[1] >= revision)
+        stale.extend(current[:max(0, len(current) - self.maxsize)])
+        for (mtime, entry_revision, path) in stale:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for (mtime, revision, path) in self.__entries():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def configureCache(store=None):
+    """Select the store caching the reads of tournament.py.
+
+    Args:
+      store: a MemoryStore or a FileStore, None to disable the cache.
+
+    Returns:
+      The store.
+    """
+    global _store
+    _store = store
+    return store
+
+
+def getCache():
+    """Returns the configured store, or None."""
+    return _store
+
+
+def invalidate():
+    """Bump the revision of the configured store, if any."""
+    if _store is not None:
+        _store.bump()
+
+
+def cached(key=None, scope=None):
+    """Decorator serving the calls of a read from the configured store,
+    as long as the revision doesn't change. Returned lists are copied,
+    so that callers can't alter the cached value.
+
+    Args:
+      key: optional callable receiving the call arguments, returning
+        what identifies the result. All the arguments by default.
+      scope: optional callable returning what the result depends on
+        besides the arguments, e.g. the selected tournament.
+    """
+    def decorator(function):
+        name = function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            store = _store
+            if store is None:
+                return function(*args, **kwargs)
+
+            if key is None:
+                identity = (args, tuple(sorted(kwargs.items())))
+            else:
+                identity = key(*args, **kwargs)
+            if scope is not None:
+                identity = (scope(), identity)
+            revision = store.revision()
+            found, value = store.get(revision, (name, identity))
+            if not found:
+                value = function(*args, **kwargs)
+                store.set(revision, (name, identity), value)
+            if isinstance(value, list):
+                value = list(value)
+            return value
+
+        return wrapper
+    return decorator
+
+
+def invalidates(function):
+    """Decorator bumping the revision once a write has been done."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        finally:
+            invalidate()
+
+    return wrapper
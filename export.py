@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+#
+# export.py -- streaming exporters of the tournament data
+#
+# Rows are written as soon as they are read, so that exporting
+# a history of millions of matches runs in constant memory.
+#
+# Usage:
+#
+#   python export.py matches --format jsonl --output matches.jsonl
+
+from __future__ import print_function
+
+import argparse
+import csv
+import datetime
+import io
+import json
+import sys
+
+import tournament
+
+
+MATCH_COLUMNS = ('id', 'time', 'player_1', 'player_2',
+                 'player_1_result', 'player_2_result')
+STANDING_COLUMNS = ('id', 'name', 'wins', 'ties', 'matches')
+
+
+def _value(value):
+    """Turn dates and times into ISO 8601 strings."""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def writeCSV(rows, columns, output):
+    """Write rows as CSV, with a header line.
+
+    Args:
+      rows: an iterable of tuples.
+      columns: the names of the columns.
+      output: a file object.
+
+    Returns:
+      The number of rows written.
+    """
+    writer = csv.writer(output)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow([_value(value) for value in row])
+        count += 1
+    return count
+
+
+def writeJSONLines(rows, columns, output):
+    """Write rows as JSON Lines, one object per row.
+
+    Args:
+      rows: an iterable of tuples.
+      columns: the names of the columns.
+      output: a file object.
+
+    Returns:
+      The number of rows written.
+    """
+    count = 0
+    for row in rows:
+        record = dict(zip(columns, [_value(value) for value in row]))
+        output.write(json.dumps(record, sort_keys=True) + '\n')
+        count += 1
+    return count
+
+
+WRITERS = {
+    'csv': writeCSV,
+    'jsonl': writeJSONLines,
+}
+
+
+def exportMatches(output, format='csv', fetch_size=None):
+    """Stream every match, with its outcomes, to a file.
+
+    Args:
+      output: a file object.
+      format: 'csv' or 'jsonl'.
+      fetch_size: rows fetched from the database at a time.
+
+    Returns:
+      The number of matches written.
+    """
+    return WRITERS[format](tournament.streamMatches(fetch_size),
+                           MATCH_COLUMNS, output)
+
+
+def exportStandings(output, format='csv', fetch_size=None):
+    """Stream the standings to a file.
+
+    Args:
+      output: a file object.
+      format: 'csv' or 'jsonl'.
+      fetch_size: rows fetched from the database at a time.
+
+    Returns:
+      The number of players written.
+    """
+    return WRITERS[format](tournament.streamStandings(fetch_size),
+                           STANDING_COLUMNS, output)
+
+
+def openOutput(path):
+    """Open an output file the way the csv module expects it: in binary
+    mode on Python 2, as text with newline='' on Python 3, so that rows
+    don't end with a doubled carriage return on Windows."""
+    if sys.version_info[0] < 3:
+        return open(path, 'wb')
+    return io.open(path, 'w', newline='')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the tournament matches or standings.")
+    parser.add_argument('table', choices=['matches', 'standings'])
+    parser.add_argument('--format', choices=sorted(WRITERS), default='csv')
+    parser.add_argument('--fetch-size', type=int, default=None)
+    parser.add_argument('--output', default=None,
+                        help="write to this file instead of stdout")
+    parser.add_argument('--tournament', type=int,
+                        default=tournament.DEFAULT_TOURNAMENT,
+                        help="ID of the tournament to export")
+    args = parser.parse_args()
+
+    export = exportMatches if args.table == 'matches' else exportStandings
+    with tournament.Tournament(args.tournament):
+        if args.output:
+            with openOutput(args.output) as output:
+                count = export(output, args.format, args.fetch_size)
+        else:
+            count = export(sys.stdout, args.format, args.fetch_size)
+
+    print("%d rows exported" % count, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
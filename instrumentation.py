@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+#
+# instrumentation.py -- opt-in timings and counters for the hot paths
+#
+# Instrumentation is disabled until a hook is registered with addHook().
+# A hook is any callable taking one event, a dictionary like:
+#
+#   {'name': 'playerStandings', 'seconds': 0.0012, 'statements': 1,
+#    'error': None}
+#
+# Events of Draw.getPairings() also carry the counters of the pairing
+# search (passes, steps, backtracks, swapAttempts, maxDelta).
+# While no hook is registered, instrumented functions cost a single
+# truthiness check.
+
+import functools
+import threading
+from timeit import default_timer as timer
+
+
+_hooks = []
+_local = threading.local()
+
+
+def addHook(hook):
+    """Register a callable receiving every instrumentation event."""
+    _hooks.append(hook)
+    return hook
+
+
+def removeHook(hook):
+    """Unregister a hook previously added with addHook()."""
+    _hooks.remove(hook)
+
+
+def enabled():
+    """Returns True if at least one hook is registered."""
+    return bool(_hooks)
+
+
+def emit(event):
+    """Send an event to every registered hook."""
+    for hook in list(_hooks):
+        hook(event)
+
+
+def countStatements(count=1):
+    """Record SQL statements executed by the current thread."""
+    _local.statements = getattr(_local, 'statements', 0) + count
+
+
+def statementsCount():
+    """Returns the number of SQL statements executed so far
+    by the current thread, while instrumentation was enabled."""
+    return getattr(_local, 'statements', 0)
+
+
+class CountingCursor(object):
+
+    """Wrap a DB-API cursor, counting the statements it executes.
+    Backends only wrap their cursors while instrumentation is enabled."""
+
+    def __init__(self, cursor):
+        self.__cursor = cursor
+
+    def execute(self, *args, **kwargs):
+        countStatements()
+        return self.__cursor.execute(*args, **kwargs)
+
+    def executemany(self, query, params):
+        params = list(params)
+        countStatements(len(params))
+        return self.__cursor.executemany(query, params)
+
+    def __iter__(self):
+        return iter(self.__cursor)
+
+    def __getattr__(self, name):
+        return getattr(self.__cursor, name)
+
+
+def instrumented(name=None, counters=None):
+    """Decorator sending an event for each call of the function,
+    with its latency and the SQL statements it executed.
+
+    Args:
+      name: the name of the event, the function name by default.
+      counters: optional callable receiving the call arguments once the
+        call is over, returning a dictionary of extra event fields.
+    """
+    def decorator(function):
+        label = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _hooks:
+                return function(*args, **kwargs)
+
+            statements = statementsCount()
+            error = None
+            start = timer()
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                event = {
+                    'name': label,
+                    'seconds': timer() - start,
+                    'statements': statementsCount() - statements,
+                    'error': error,
+                }
+                if counters is not None:
+                    event.update(counters(*args, **kwargs))
+                emit(event)
+
+        return wrapper
+    return decorator
+
+
+class Stats(object):
+
+    """A hook aggregating events by name.
+
+    Example:
+
+        stats = instrumentation.addHook(instrumentation.Stats())
+        swissPairings()
+        print stats.summary()
+    """
+
+    # Event fields which are summed up, and those keeping their maximum.
+    SUMMED = ('seconds', 'statements', 'passes', 'steps', 'backtracks',
+              'swapAttempts')
+    MAXIMUM = ('maxDelta',)
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.entries = {}
+
+    def __call__(self, event):
+        with self.__lock:
+            entry = self.entries.setdefault(event['name'], {
+                'calls': 0,
+                'errors': 0,
+                'maxSeconds': 0,
+            })
+            entry['calls'] += 1
+            if event.get('error'):
+                entry['errors'] += 1
+            entry['maxSeconds'] = max(entry['maxSeconds'], event['seconds'])
+            for key in self.SUMMED:
+                if key in event:
+                    entry[key] = entry.get(key, 0) + event[key]
+            for key in self.MAXIMUM:
+                if key in event:
+                    entry[key] = max(entry.get(key, 0), event[key])
+
+    def reset(self):
+        with self.__lock:
+            self.entries = {}
+
+    def summary(self):
+        """Returns a copy of the aggregated entries, keyed by event name."""
+        with self.__lock:
+            return dict((name, dict(entry))
+                        for name, entry in self.entries.items())
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+#
+# leaderboard.py -- live ranking of the players, for display boards
+#
+# Players are kept sorted like playerStandings() (wins, then ties, then
+# ID) inside an indexable skip list: every node knows how many players
+# each of its links skips, so that a rank can be counted while walking
+# down to a player. Each operation costs O(log n):
+#
+#   adding a player or recording an outcome (the player is taken out
+#   and put back at his or her new place),
+#   rankOf(player_id), player(rank), and finding where a page starts.
+#
+# topK(k) and page() then walk k players from there. Like PairingState,
+# a Leaderboard is brought up to date with the players and matches added
+# since its previous update, see tournament.updateLeaderboard().
+
+import random
+
+
+# Levels of the skip list: enough for 2 ** 24 players.
+LEVELS = 24
+
+# Key of the tail sentinel, after every (-wins, -ties, id) key.
+_END = (float('inf'),)
+
+
+def standingsKey(row):
+    """Sort key of a standings row (id, name, wins, ties, matches),
+    following the order of playerStandings()."""
+    return (-row[2], -row[3], row[0])
+
+
+class _Node(object):
+
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        # The next node at each level, and the number of players
+        # the link skips, the next node included.
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class Leaderboard(object):
+
+    """Players ranked by wins and ties, updated one outcome at a time.
+
+    Example:
+
+        board = tournament.updateLeaderboard(Leaderboard())
+        top = board.topK(20)
+        rank = board.rankOf(player_id)
+    """
+
+    def __init__(self, seed=None):
+        """
+        Args:
+          seed: optional seed of the random levels of the nodes.
+        """
+        self.__random = random.Random(seed)
+        self.clear()
+
+    def clear(self):
+        """Forget everything, e.g. after matches or players
+        were deleted."""
+        self.__head = _Node(None, LEVELS)
+        self.__tail = _Node(_END, 0)
+        self.__head.next = [self.__tail] * LEVELS
+        # Levels holding at least one node: walks start from the top one.
+        self.__used = 1
+        # Player ID -> [name, won, tied, played]
+        self.players = {}
+        self.lastPlayerId = 0
+        self.lastMatchId = 0
+        self.matches = 0
+
+    def __len__(self):
+        return len(self.players)
+
+    def __key(self, player_id):
+        record = self.players[player_id]
+        return (-record[1], -record[2], player_id)
+
+    def __row(self, key):
+        record = self.players[key[2]]
+        return (key[2], record[0], record[1], record[2], record[3])
+
+    def __levels(self):
+        """Returns the number of levels of a new node: each level is
+        reached by half the nodes of the level below."""
+        levels = 1
+        while levels < LEVELS and self.__random.random() < 0.5:
+            levels += 1
+        return levels
+
+    def __insert(self, key):
+        levels = self.__levels()
+        self.__used = max(self.__used, levels)
+        chain = [self.__head] * LEVELS
+        steps = [0] * LEVELS
+        node = self.__head
+        for level in range(self.__used - 1, -1, -1):
+            following = node.next[level]
+            while following.key < key:
+                steps[level] += node.width[level]
+                node = following
+                following = node.next[level]
+            chain[level] = node
+
+        new = _Node(key, levels)
+        skipped = 0
+        for level in range(levels):
+            previous = chain[level]
+            new.next[level] = previous.next[level]
+            new.width[level] = previous.width[level] - skipped
+            previous.next[level] = new
+            previous.width[level] = skipped + 1
+            skipped += steps[level]
+        for level in range(levels, LEVELS):
+            chain[level].width[level] += 1
+
+    def __remove(self, key):
+        chain = [self.__head] * LEVELS
+        node = self.__head
+        for level in range(self.__used - 1, -1, -1):
+            following = node.next[level]
+            while following.key < key:
+                node = following
+                following = node.next[level]
+            chain[level] = node
+
+        removed = chain[0].next[0]
+        for level in range(len(removed.next)):
+            previous = chain[level]
+            previous.width[level] += removed.width[level] - 1
+            previous.next[level] = removed.next[level]
+        for level in range(len(removed.next), LEVELS):
+            chain[level].width[level] -= 1
+
+    def __rebuild(self):
+        """Link every player again, in one pass over the sorted keys."""
+        head = self.__head = _Node(None, LEVELS)
+        last = [head] * LEVELS
+        positions = [0] * LEVELS
+        self.__used = 1
+        keys = sorted((-r[1], -r[2], i) for i, r in self.players.items())
+        for position, key in enumerate(keys, 1):
+            levels = self.__levels()
+            self.__used = max(self.__used, levels)
+            node = _Node(key, levels)
+            for level in range(levels):
+                last[level].next[level] = node
+                last[level].width[level] = position - positions[level]
+                last[level] = node
+                positions[level] = position
+        end = len(keys) + 1
+        for level in range(LEVELS):
+            last[level].next[level] = self.__tail
+            last[level].width[level] = end - positions[level]
+
+    def __record(self, player, result):
+        """Add an outcome to the record of a player."""
+        record = self.players[player]
+        if result == 1:
+            record[1] += 1
+        elif result == 0.5:
+            record[2] += 1
+        record[3] += 1
+
+    def __seek(self, key):
+        """Returns a tuple (node, count): the last node with a key lower
+        than *key* (the head if none), and the number of such nodes."""
+        node = self.__head
+        count = 0
+        for level in range(self.__used - 1, -1, -1):
+            following = node.next[level]
+            while following.key < key:
+                count += node.width[level]
+                node = following
+                following = node.next[level]
+        return node, count
+
+    def addPlayer(self, player_id, name):
+        if player_id in self.players:
+            return
+        self.players[player_id] = [name, 0, 0, 0]
+        self.__insert((0, 0, player_id))
+        self.lastPlayerId = max(self.lastPlayerId, player_id)
+
+    def addMatch(self, match_id, player_1, player_2, player_1_result,
+                 player_2_result):
+        """Record a reported match, see PairingState.addMatch()."""
+        for player, result in ((player_1, player_1_result),
+                               (player_2, player_2_result)):
+            if player not in self.players:
+                continue
+            self.__remove(self.__key(player))
+            self.__record(player, result)
+            self.__insert(self.__key(player))
+
+        self.lastMatchId = max(self.lastMatchId, match_id)
+        self.matches += 1
+
+    def apply(self, players, matches, counts):
+        """Apply the changes returned by the changesSince() method of
+        the storage backends, see PairingState.apply().
+
+        Returns:
+          False if the leaderboard must be cleared and rebuilt.
+        """
+        if len(players) + len(matches) < len(self.players) // 4:
+            for (player_id, name) in players:
+                self.addPlayer(player_id, name)
+            for match in matches:
+                self.addMatch(*match)
+        else:
+            # A large batch, e.g. the first update: sorting everyone
+            # at once beats moving players one outcome at a time.
+            for (player_id, name) in players:
+                self.players.setdefault(player_id, [name, 0, 0, 0])
+                self.lastPlayerId = max(self.lastPlayerId, player_id)
+            for (match_id, player_1, player_2, player_1_result,
+                 player_2_result) in matches:
+                for player, result in ((player_1, player_1_result),
+                                       (player_2, player_2_result)):
+                    if player in self.players:
+                        self.__record(player, result)
+                self.lastMatchId = max(self.lastMatchId, match_id)
+                self.matches += 1
+            self.__rebuild()
+
+        return (len(self.players), self.matches) == tuple(counts)
+
+    def rankOf(self, player_id):
+        """Returns the position of a player in the standings, from 1,
+        or None if the player is unknown."""
+        if player_id not in self.players:
+            return None
+        return self.__seek(self.__key(player_id))[1] + 1
+
+    def player(self, rank):
+        """Returns the standings row (id, name, wins, ties, matches)
+        of the player at a position, from 1.
+
+        Raises:
+          IndexError: if there is no such position.
+        """
+        if not 1 <= rank <= len(self.players):
+            raise IndexError("No player ranked %r" % rank)
+        node = self.__head
+        for level in range(self.__used - 1, -1, -1):
+            while node.width[level] <= rank:
+                rank -= node.width[level]
+                node = node.next[level]
+        return self.__row(node.key)
+
+    def page(self, after=None, limit=20):
+        """Returns the standings rows following a row, a page at a time:
+        pages are found by key, so that a player moving meanwhile
+        doesn't shift the next page by one.
+
+        Args:
+          after: the last row of the previous page, None for the first
+            page.
+          limit: the number of rows of the page.
+
+        Returns:
+          A list of tuples (id, name, wins, ties, matches).
+        """
+        if after is None:
+            node = self.__head
+        else:
+            # The first node with a key greater than the row's.
+            key = standingsKey(after)
+            node = self.__seek(key)[0]
+            if node.next[0].key == key:
+                node = node.next[0]
+
+        rows = []
+        node = node.next[0]
+        while len(rows) < limit and node is not self.__tail:
+            rows.append(self.__row(node.key))
+            node = node.next[0]
+        return rows
+
+    def topK(self, k=20):
+        """Returns the standings rows of the first k players."""
+        return self.page(None, k)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+#
+# pair.py -- draw a round offline, out of standings and history files
+#
+# Reads the standings and the matches history from CSV or JSON Lines
+# files (as written by export.py), or from stdin, and writes the pairings
+# of the next round to stdout. No database is involved: arbiters can run
+# re-pairings and what-if scenarios on offline machines.
+#
+# The history is streamed straight into the opponents index, one match
+# at a time, so that a history of millions of matches is never held as
+# a list. Files ending in .gz are decompressed on the fly.
+#
+# Usage:
+#
+#   python export.py standings --output standings.csv
+#   python export.py matches --format jsonl --output matches.jsonl
+#   python pair.py standings.csv --history matches.jsonl --engine weighted
+#
+# Standings need the columns id, name, wins, ties and matches; the
+# history needs player_1 and player_2 (empty, 0 or null for a Bye-round).
+
+from __future__ import print_function
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import sys
+
+from swisspairings import ENGINES, InfeasibleRoundError, indexOpponents
+
+
+FORMATS = ('csv', 'jsonl')
+PAIRING_COLUMNS = ('id_1', 'name_1', 'id_2', 'name_2')
+
+
+def inputFormat(path, stdin_format='csv'):
+    """Returns the format of an input file, guessed from its name.
+
+    Args:
+      path: the file path, '-' for stdin.
+      stdin_format: the format of stdin, 'csv' or 'jsonl'.
+    """
+    if path == '-':
+        return stdin_format
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.jsonl') or name.endswith('.json'):
+        return 'jsonl'
+    return 'csv'
+
+
+def openInput(path):
+    """Open an input file as text, '-' being stdin."""
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        if sys.version_info[0] < 3:
+            return gzip.open(path, 'rb')
+        return gzip.open(path, 'rt')
+    if sys.version_info[0] < 3:
+        return open(path, 'rb')
+    return io.open(path, 'r', newline='')
+
+
+def readRows(source, format='csv'):
+    """Yield each record of a CSV or JSON Lines file as a dictionary.
+
+    Args:
+      source: a file object.
+      format: 'csv' (with a header line) or 'jsonl'.
+    """
+    if format == 'csv':
+        for row in csv.DictReader(source):
+            yield row
+        return
+
+    for line in source:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def _number(value, default=0):
+    """Parse an integer column, empty values giving default."""
+    if value is None or value == '':
+        return default
+    return int(float(value))
+
+
+def readStandings(rows):
+    """Build the standings out of records.
+
+    Args:
+      rows: an iterable of dictionaries with the keys
+        id, name, wins, ties and matches.
+
+    Returns:
+      A list of tuples (id, name, wins, ties, matches), sorted by wins
+      then ties. Players with the same score keep the order of the
+      input, so that standings ranked by tiebreaks stay as they are.
+
+    Raises:
+      ValueError: if a record misses a column or has an invalid value.
+    """
+    standings = []
+    for number, row in enumerate(rows, 1):
+        try:
+            standings.append((
+                _number(row['id']), row['name'], _number(row['wins']),
+                _number(row['ties']), _number(row['matches'])
+            ))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError("Invalid standings record %d: %r (%s)"
+                             % (number, row, e))
+    standings.sort(key=lambda row: (-row[2], -row[3]))
+    return standings
+
+
+def readHistory(rows):
+    """Yield the tuples (id_1, id_2) of the matches, 0 for a Bye-round.
+
+    Args:
+      rows: an iterable of dictionaries with the keys player_1 and
+        player_2.
+
+    Raises:
+      ValueError: if a record misses a column or has an invalid value.
+    """
+    for number, row in enumerate(rows, 1):
+        try:
+            yield _number(row['player_1']), _number(row.get('player_2'))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError("Invalid history record %d: %r (%s)"
+                             % (number, row, e))
+
+
+def drawRound(standings, history=(), engine='greedy'):
+    """Draw the next round.
+
+    Args:
+      standings: a list of tuples (id, name, wins, ties, matches).
+      history: an iterable of tuples (id_1, id_2), consumed once.
+      engine: a key of swisspairings.ENGINES.
+
+    Returns:
+      A list of tuples (id1, name1, id2, name2), see
+      tournament.swissPairings().
+    """
+    if not standings:
+        return []
+    opponents = indexOpponents(history)
+    return ENGINES[engine](standings, opponents=opponents).getPairings()
+
+
+def writePairings(pairings, output, format='csv'):
+    """Write the pairings as CSV, with a header line, or JSON Lines.
+    The second player of a Bye-round is left empty.
+
+    Args:
+      pairings: a list of tuples (id1, name1, id2, name2).
+      output: a file object.
+      format: 'csv' or 'jsonl'.
+    """
+    rows = [(id1, name1, id2 or None, name2)
+            for (id1, name1, id2, name2) in pairings]
+    if format == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(PAIRING_COLUMNS)
+        writer.writerows(rows)
+        return
+
+    for row in rows:
+        output.write(json.dumps(dict(zip(PAIRING_COLUMNS, row)),
+                                sort_keys=True) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Draw the next round out of standings and history "
+                    "files, without any database.")
+    parser.add_argument('standings',
+                        help="the standings file, '-' for stdin")
+    parser.add_argument('--history', default=None,
+                        help="the matches history file, '-' for stdin")
+    parser.add_argument('--stdin-format', choices=FORMATS, default='csv',
+                        help="format of the input read from stdin; files "
+                             "are recognized by their extension")
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help="format of the pairings written to stdout")
+    parser.add_argument('--engine', choices=sorted(ENGINES),
+                        default='greedy')
+    args = parser.parse_args(argv)
+
+    if args.standings == '-' and args.history == '-':
+        parser.error("only one of the inputs can be read from stdin")
+
+    try:
+        source = openInput(args.standings)
+        try:
+            standings = readStandings(readRows(
+                source, inputFormat(args.standings, args.stdin_format)))
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+        history = ()
+        source = None
+        if args.history:
+            source = openInput(args.history)
+            history = readHistory(readRows(
+                source, inputFormat(args.history, args.stdin_format)))
+        try:
+            pairings = drawRound(standings, history, args.engine)
+        finally:
+            if source is not None and source is not sys.stdin:
+                source.close()
+    except InfeasibleRoundError as e:
+        print("pair.py: %s, players left out: %s"
+              % (e, sorted(e.unpaired)), file=sys.stderr)
+        return 1
+    except (IOError, OSError, ValueError) as e:
+        print("pair.py: %s" % e, file=sys.stderr)
+        return 1
+
+    writePairings(pairings, sys.stdout, args.format)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+#
+# ratings.py -- Elo and Glicko ratings of the players
+#
+# Ratings are updated one rating period at a time, a period being a
+# round: every game of the round is rated against the ratings the
+# players had before the round, so the order in which the results of a
+# round are reported doesn't matter. As nobody plays twice in a round,
+# rating the games one by one, in the order they were reported, gives
+# the same ratings as rating each round at once. computeRatings() rates
+# a round at a time: the expected scores of every game of the round are
+# gathered first, then the ratings are updated in one pass.
+#
+#   Elo    -- a single number per player, moved by K times the
+#             difference between the result and the expected result.
+#   Glicko -- Glicko-1: a rating and a rating deviation (RD) measuring
+#             how reliable it is. The RD grows by *c* at each round the
+#             player takes part in, then shrinks with the game played.
+#
+# A Bye-round brings no opponent and is not rated.
+#
+# tournament.py rates each round as it is reported, once a system is
+# selected by configureRatings(): rating costs a read and a write of the
+# ratings per round, so it is off by default. computeRatings() recomputes every
+# rating out of a whole history, on compact arrays indexed by player
+# position, with a single pass over the matches.
+
+import math
+from array import array
+from itertools import compress
+
+
+DEFAULT_RATING = 1500.0
+DEFAULT_DEVIATION = 350.0
+
+# Glicko-1 scale factor, ln(10) / 400, and 3 q^2 / pi^2
+# of the weight g(RD) = 1 / sqrt(1 + 3 q^2 RD^2 / pi^2).
+Q = math.log(10) / 400
+G = 3 * Q * Q / (math.pi * math.pi)
+
+
+class Elo(object):
+
+    """The Elo rating system. Rating deviations are left untouched."""
+
+    def __init__(self, k=32):
+        """
+        Args:
+          k: the K-factor, the most a rating can move in one game.
+        """
+        self.k = k
+
+    def rateRound(self, rating, deviation, i, j, result_i, result_j):
+        """Rate the games of a round against the ratings the players had
+        before it, updating the arrays in place.
+
+        Args:
+          rating, deviation: arrays indexed by player position.
+          i, j: parallel sequences, the positions of the players
+            of each game.
+          result_i, result_j: parallel sequences of their outcomes.
+        """
+        expected = [1 / (1 + 10 ** ((rating[b] - rating[a]) / 400.0))
+                    for a, b in zip(i, j)]
+        k = self.k
+        for a, b, e, r_a, r_b in zip(i, j, expected, result_i, result_j):
+            rating[a] += k * (r_a - e)
+            rating[b] += k * (r_b - (1 - e))
+
+
+class Glicko(object):
+
+    """The Glicko-1 rating system, each round being a rating period."""
+
+    def __init__(self, c=15.0, minimum=30.0, maximum=DEFAULT_DEVIATION):
+        """
+        Args:
+          c: growth of the rating deviation at each round, standing for
+            the uncertainty added since the previous one.
+          minimum: the lowest rating deviation, so that ratings of
+            regular players keep moving.
+          maximum: the highest rating deviation, the one of a new player.
+        """
+        self.c = c
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def __variance(self, deviation):
+        """Returns the squared deviation of a player at the start of a
+        round, grown by c."""
+        return min(deviation ** 2 + self.c ** 2, self.maximum ** 2)
+
+    def rateRound(self, rating, deviation, i, j, result_i, result_j):
+        """Rate the games of a round against the ratings the players had
+        before it, updating the arrays in place, see Elo.rateRound()."""
+        # Variances at the start of the round, and the weight of each
+        # game for each player, g(RD of the opponent).
+        v_i = [self.__variance(deviation[a]) for a in i]
+        v_j = [self.__variance(deviation[b]) for b in j]
+        g_i = [1 / math.sqrt(1 + G * v) for v in v_j]
+        g_j = [1 / math.sqrt(1 + G * v) for v in v_i]
+        gap = [rating[b] - rating[a] for a, b in zip(i, j)]
+        e_i = [1 / (1 + 10 ** (g * d / 400.0)) for g, d in zip(g_i, gap)]
+        e_j = [1 / (1 + 10 ** (-g * d / 400.0)) for g, d in zip(g_j, gap)]
+
+        games = zip(i, j, v_i, v_j, g_i, g_j, e_i, e_j, result_i, result_j)
+        minimum = self.minimum
+        for a, b, va, vb, ga, gb, ea, eb, r_a, r_b in games:
+            precision_a = 1 / va + Q * Q * ga * ga * ea * (1 - ea)
+            precision_b = 1 / vb + Q * Q * gb * gb * eb * (1 - eb)
+            rating[a] += Q / precision_a * ga * (r_a - ea)
+            rating[b] += Q / precision_b * gb * (r_b - eb)
+            deviation[a] = max(math.sqrt(1 / precision_a), minimum)
+            deviation[b] = max(math.sqrt(1 / precision_b), minimum)
+
+
+# Rating systems that can be selected by name.
+SYSTEMS = {
+    'elo': Elo,
+    'glicko': Glicko,
+}
+
+_system = None
+
+
+def configureRatings(system=None):
+    """Select the rating system used when results are reported.
+
+    Args:
+      system: an Elo or Glicko instance, or the name of one of SYSTEMS.
+        None stops updating the ratings.
+
+    Returns:
+      The rating system.
+    """
+    global _system
+    if isinstance(system, str):
+        system = SYSTEMS[system]()
+    _system = system
+    return system
+
+
+def getRatingSystem():
+    """Returns the configured rating system, or None."""
+    return _system
+
+
+def computeRatings(player_ids, player1, player2, result1, result2,
+                   system=None, initial=None):
+    """Rate a sequence of games, in the order they were played.
+
+    Args:
+      player_ids: the IDs of the players.
+      player1, player2, result1, result2: parallel sequences describing
+        the matches in the order they were played; player2 is 0 for a
+        Bye-round. Players not in player_ids are ignored.
+      system: the rating system, the configured one if None.
+      initial: optional dictionary mapping player IDs to tuples
+        (rating, deviation) before the first game, to continue from
+        stored ratings. Other players start from the defaults.
+
+    Returns:
+      A dictionary mapping each player ID to a tuple
+      (rating, deviation).
+    """
+    if system is None:
+        system = _system or Elo()
+    initial = initial or {}
+
+    position = {}
+    rating = array('d')
+    deviation = array('d')
+    for player_id in player_ids:
+        position[player_id] = len(rating)
+        start = initial.get(player_id, (DEFAULT_RATING, DEFAULT_DEVIATION))
+        rating.append(start[0])
+        deviation.append(start[1])
+
+    # Games between rated players, as positions.
+    i = [position.get(player_id, -1) for player_id in player1]
+    j = [position.get(player_id, -1) for player_id in player2]
+    rated = [a >= 0 and b >= 0 for a, b in zip(i, j)]
+    i = list(compress(i, rated))
+    j = list(compress(j, rated))
+    result1 = list(compress(result1, rated))
+    result2 = list(compress(result2, rated))
+
+    # A round is over as soon as one of its players shows up again:
+    # each round is then rated at once.
+    rate = system.rateRound
+    start = 0
+    playing = set()
+    for k in range(len(i)):
+        if i[k] in playing or j[k] in playing:
+            rate(rating, deviation, i[start:k], j[start:k],
+                 result1[start:k], result2[start:k])
+            start = k
+            playing.clear()
+        playing.add(i[k])
+        playing.add(j[k])
+    rate(rating, deviation, i[start:], j[start:],
+         result1[start:], result2[start:])
+
+    return dict((player_id, (rating[i], deviation[i]))
+                for player_id, i in position.items())
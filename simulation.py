@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+#
+# simulation.py -- Monte Carlo simulation of Swiss-system tournaments
+#
+# Thousands of independent tournaments are played entirely in memory,
+# spread over a pool of processes, to validate pairing changes before
+# an event. Each tournament uses its own MemoryBackend, and the results
+# of each match are drawn from a pluggable result model.
+#
+# Usage:
+#
+#   python simulation.py --tournaments 1000 --players 64 --model elo
+
+from __future__ import division, print_function
+
+import argparse
+import json
+import multiprocessing
+import random
+import time
+from collections import Counter
+
+from storage.memory import MemoryBackend
+from swisspairings import ENGINES, InfeasibleRoundError
+
+
+class RandomResults(object):
+
+    """Result model where a win, a tie and a loss are equally likely,
+    as in the tournament_test.py simulation."""
+
+    possibleOutcomes = [
+        (1, 0),
+        (0.5, 0.5),
+        (0, 1)
+    ]
+
+    def ratings(self, n_of_players, rng):
+        """Returns the strength of each player (unused by this model)."""
+        return [0] * n_of_players
+
+    def __call__(self, rating_1, rating_2, rng):
+        """Returns the outcomes (player_1_result, player_2_result)."""
+        return rng.choice(self.possibleOutcomes)
+
+
+class EloResults(object):
+
+    """Result model based on Elo win probabilities.
+
+    Each player gets a rating drawn from a normal distribution.
+    A game is tied with probability *draw_rate*, otherwise the first
+    player wins with probability 1 / (1 + 10 ** ((r2 - r1) / 400)).
+    """
+
+    def __init__(self, mean=1500, deviation=200, draw_rate=0.1):
+        self.mean = mean
+        self.deviation = deviation
+        self.draw_rate = draw_rate
+
+    def ratings(self, n_of_players, rng):
+        """Returns the rating of each player."""
+        return [rng.gauss(self.mean, self.deviation)
+                for i in range(n_of_players)]
+
+    def __call__(self, rating_1, rating_2, rng):
+        """Returns the outcomes (player_1_result, player_2_result)."""
+        if rng.random() < self.draw_rate:
+            return (0.5, 0.5)
+        expected = 1 / (1 + 10 ** ((rating_2 - rating_1) / 400))
+        if rng.random() < expected:
+            return (1, 0)
+        return (0, 1)
+
+
+# Result models that can be selected by name.
+MODELS = {
+    'random': RandomResults,
+    'elo': EloResults,
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list.
+
+    Args:
+      values: sorted list of numbers.
+      fraction: between 0 and 1, e.g. 0.9 for the 90th percentile.
+    """
+    if not values:
+        return None
+    rank = int(round(fraction * (len(values) - 1)))
+    return values[rank]
+
+
+def playTournament(n_of_players, engine='greedy', model=None, seed=None):
+    """Play a whole tournament in memory.
+
+    Args:
+      n_of_players: number of enrolled players.
+      engine: the name of the pairing engine, see swisspairings.ENGINES.
+      model: the result model, RandomResults() if None.
+      seed: seed of the random generator, for reproducible runs.
+
+    Returns:
+      A dictionary describing the tournament:
+        rounds: number of rounds played.
+        rematches: number of repeated pairings, including repeated byes.
+        infeasible: True if a round couldn't be drawn.
+        gaps: Counter of the aggregate score gap of each pairing.
+        pairingTimes: seconds spent drawing each round.
+    """
+    rng = random.Random(seed)
+    model = model if model is not None else RandomResults()
+
+    backend = MemoryBackend()
+    for i in range(n_of_players):
+        backend.registerPlayer("Player %d" % i)
+    ratings = dict(zip(
+        [row[0] for row in backend.playerStandings()],
+        model.ratings(n_of_players, rng)
+    ))
+
+    rounds = 0
+    infeasible = False
+    gaps = Counter()
+    pairing_times = []
+
+    while True:
+        standings, opponents = backend.pairingSnapshot()
+        scores = dict((i, (w * 3) + t) for (i, n, w, t, m) in standings)
+
+        start = time.time()
+        try:
+            pairings = ENGINES[engine](
+                standings, opponents=opponents
+            ).getPairings()
+        except InfeasibleRoundError:
+            infeasible = True
+            break
+        elapsed = time.time() - start
+
+        if not pairings:
+            break
+        pairing_times.append(elapsed)
+
+        results = []
+        for (id_1, name_1, id_2, name_2) in pairings:
+            if not id_2:
+                results.append((id_1, 0, 1, 0))
+                continue
+            gaps[abs(scores[id_1] - scores[id_2])] += 1
+            outcome = model(ratings[id_1], ratings[id_2], rng)
+            results.append((id_1, id_2) + tuple(outcome))
+        backend.reportRound(results)
+        rounds += 1
+
+    history = [frozenset(match) for match in backend.matchesHistory()]
+
+    return {
+        'rounds': rounds,
+        'rematches': len(history) - len(set(history)),
+        'infeasible': infeasible,
+        'gaps': gaps,
+        'pairingTimes': pairing_times,
+    }
+
+
+def _playTournament(args):
+    """Unpack the arguments of playTournament() inside a worker process."""
+    return playTournament(*args)
+
+
+class Statistics(object):
+
+    """Aggregate statistics over many simulated tournaments."""
+
+    def __init__(self):
+        self.tournaments = 0
+        self.rounds = Counter()
+        self.rematches = 0
+        self.tournamentsWithRematches = 0
+        self.infeasible = 0
+        self.gaps = Counter()
+        self.pairingTimes = []
+
+    def add(self, result):
+        """Add the result of playTournament() to the statistics."""
+        self.tournaments += 1
+        self.rounds[result['rounds']] += 1
+        self.rematches += result['rematches']
+        if result['rematches']:
+            self.tournamentsWithRematches += 1
+        if result['infeasible']:
+            self.infeasible += 1
+        self.gaps.update(result['gaps'])
+        self.pairingTimes.extend(result['pairingTimes'])
+
+    def summary(self):
+        """Returns the statistics as a JSON-serializable dictionary."""
+        times = sorted(self.pairingTimes)
+        return {
+            'tournaments': self.tournaments,
+            'rounds': dict((str(k), v) for k, v in self.rounds.items()),
+            'rematches': self.rematches,
+            'tournamentsWithRematches': self.tournamentsWithRematches,
+            'infeasible': self.infeasible,
+            'scoreGaps': dict((str(k), v) for k, v in self.gaps.items()),
+            'pairingTime': {
+                'p50': percentile(times, 0.5),
+                'p90': percentile(times, 0.9),
+                'p99': percentile(times, 0.99),
+                'max': times[-1] if times else None,
+            },
+        }
+
+
+def simulate(tournaments, n_of_players, engine='greedy', model=None,
+             seed=0, processes=None):
+    """Play many independent tournaments on a process pool.
+
+    Tournament i is played with seed (seed + i), so a run can be
+    reproduced whatever the number of processes.
+
+    Args:
+      tournaments: number of tournaments to play.
+      n_of_players: number of players enrolled in each tournament.
+      engine: the name of the pairing engine.
+      model: the result model, RandomResults() if None.
+      seed: base seed of the random generators.
+      processes: size of the pool, the number of CPUs if None.
+        With 1, tournaments are played in the current process.
+
+    Yields:
+      The Statistics aggregated so far, after each tournament completes.
+    """
+    jobs = [(n_of_players, engine, model, seed + i)
+            for i in range(tournaments)]
+    statistics = Statistics()
+
+    if processes == 1:
+        for job in jobs:
+            statistics.add(_playTournament(job))
+            yield statistics
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(_playTournament, jobs):
+            statistics.add(result)
+            yield statistics
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Simulate Swiss-system tournaments in memory.")
+    parser.add_argument('--tournaments', type=int, default=100)
+    parser.add_argument('--players', type=int, default=16)
+    parser.add_argument('--engine', choices=sorted(ENGINES),
+                        default='greedy')
+    parser.add_argument('--model', choices=sorted(MODELS), default='random')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--progress', type=int, default=0,
+                        help="print the statistics every N tournaments")
+    args = parser.parse_args()
+
+    statistics = Statistics()
+    for statistics in simulate(args.tournaments, args.players, args.engine,
+                               MODELS[args.model](), args.seed,
+                               args.processes):
+        if args.progress and statistics.tournaments % args.progress == 0:
+            print(json.dumps(statistics.summary(), sort_keys=True))
+
+    print(json.dumps(statistics.summary(), sort_keys=True, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+#
+# Pluggable storage backends for the tournament.
+#
+# tournament.py doesn't talk to a database by itself: every function
+# delegates to the backend returned by getBackend(). The backend is chosen
+# with configureBackend(), or through the TOURNAMENT_BACKEND and
+# TOURNAMENT_DATABASE environment variables:
+#
+#   postgres -- PostgreSQL through psycopg2 (the default).
+#   sqlite   -- a SQLite database file.
+#   memory   -- plain Python arrays, nothing is persisted.
+#   journal  -- the same arrays, every write appended to a journal file
+#               replayed at start-up.
+#
+# A database holds many tournaments. A backend works on one of them,
+# the default tournament unless another one is selected through
+# Backend.forTournament().
+
+from __future__ import absolute_import
+
+import copy
+import importlib
+import os
+import threading
+
+
+# Name of each backend, mapped to the module and class implementing it.
+# Modules are imported lazily, so that e.g. psycopg2 is only needed
+# when the PostgreSQL backend is actually used.
+BACKENDS = {
+    'postgres': ('storage.postgres', 'PostgresBackend'),
+    'sqlite': ('storage.sqlite', 'SQLiteBackend'),
+    'memory': ('storage.memory', 'MemoryBackend'),
+    'journal': ('storage.journal', 'JournalBackend'),
+}
+
+DEFAULT_BACKEND = 'postgres'
+
+# Rows fetched at once by the streaming methods.
+FETCH_SIZE = 2000
+
+# ID of the tournament created along with the database.
+DEFAULT_TOURNAMENT = 1
+
+_backend = None
+_backendLock = threading.Lock()
+
+
+class Backend(object):
+
+    """Interface implemented by every storage backend.
+
+    Methods mirror the functions of tournament.py, which take care
+    of validating their arguments before calling the backend.
+    Every method applies to the tournament of *tournamentId*.
+    """
+
+    tournamentId = DEFAULT_TOURNAMENT
+
+    def forTournament(self, tournament_id):
+        """Returns a view of the backend working on another tournament.
+        Views share the connections and the sessions of the backend,
+        and must not be closed.
+        """
+        if tournament_id == self.tournamentId:
+            return self
+        view = copy.copy(self)
+        view.tournamentId = tournament_id
+        return view
+
+    def createTournament(self, name):
+        """Adds a tournament and returns its ID."""
+        raise NotImplementedError
+
+    def listTournaments(self):
+        """Returns a list of tuples (id, name) of the tournaments,
+        sorted by ID."""
+        raise NotImplementedError
+
+    def dropTournament(self, tournament_id):
+        """Throw a tournament away, with its players and matches."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release every resource held by the backend."""
+        pass
+
+    def session(self):
+        """Returns a context manager running every operation issued
+        inside its with-block in one transaction: committed when the
+        block exits normally, rolled back if an exception is raised.
+        Sessions can be nested, the inner ones simply join the outer one.
+        """
+        raise NotImplementedError
+
+    def deleteMatches(self):
+        """Remove all the match records, resetting the ratings."""
+        raise NotImplementedError
+
+    def deletePlayers(self):
+        """Remove all the player records."""
+        raise NotImplementedError
+
+    def countPlayers(self):
+        """Returns the number of players currently registered."""
+        raise NotImplementedError
+
+    def registerPlayer(self, name):
+        """Adds a player and returns the ID assigned to him or her."""
+        raise NotImplementedError
+
+    def registerPlayers(self, players):
+        """Adds many players in one transaction.
+
+        Args:
+          players: an iterable of tuples (name, registration_date),
+            registration_date being None for the current date.
+
+        Returns:
+          The list of IDs assigned to the players, in the same order.
+        """
+        raise NotImplementedError
+
+    def getPlayerID(self, name):
+        """Returns a tuple (id,) for the player with the given name,
+        or None."""
+        raise NotImplementedError
+
+    def playerStandings(self):
+        """Returns a list of tuples (id, name, wins, ties, matches),
+        sorted by wins, then ties, then id."""
+        raise NotImplementedError
+
+    def standingsPage(self, after=None, limit=20):
+        """Returns a page of the playerStandings() rows, reading only
+        the rows of the page: it starts right after a given row (keyset
+        pagination) instead of skipping an offset.
+
+        Args:
+          after: the last row (id, name, wins, ties, matches) of the
+            previous page, None for the first page.
+          limit: the number of rows of the page.
+        """
+        raise NotImplementedError
+
+    def rebuildStandings(self):
+        """Recompute the stored standings from the recorded outcomes."""
+        raise NotImplementedError
+
+    def verifyStandings(self):
+        """Returns the list of IDs of the players whose stored standings
+        differ from the recorded outcomes."""
+        raise NotImplementedError
+
+    def reportMatch(self, player_1, player_2, player_1_result,
+                    player_2_result):
+        """Records a single match. player_2 is 0 for a Bye round.
+        Returns the ID of the new match.
+
+        Raises ValueError if a player is on both sides of the match,
+        isn't registered in the tournament, or if the players have
+        already met, see matchError(). The PostgreSQL backends check
+        the result on the server."""
+        raise NotImplementedError
+
+    def reportRound(self, results):
+        """Records a list of (player_1, player_2, player_1_result,
+        player_2_result) tuples in one transaction.
+        Returns the list of the new match IDs, in the same order."""
+        raise NotImplementedError
+
+    def playerRatings(self, player_ids=None):
+        """Returns a list of tuples (id, name, rating, deviation),
+        sorted by rating, highest first, then by ID.
+
+        Args:
+          player_ids: if given, only these players are returned.
+            With PostgreSQL their rows stay locked until the end of
+            the transaction, so that concurrent reports of the same
+            players can't lose an update.
+        """
+        raise NotImplementedError
+
+    def updateRatings(self, ratings):
+        """Store the ratings of a dictionary mapping player IDs to
+        tuples (rating, deviation), in one transaction."""
+        raise NotImplementedError
+
+    def matchesHistory(self):
+        """Returns a list of tuples (id1, id2) of the matches played."""
+        raise NotImplementedError
+
+    def streamStandings(self, fetch_size=FETCH_SIZE):
+        """Generate the rows of playerStandings() without holding them
+        all in memory: *fetch_size* rows are fetched at a time."""
+        raise NotImplementedError
+
+    def streamMatches(self, fetch_size=FETCH_SIZE):
+        """Generate every match, sorted by ID, with its outcomes joined in:
+        tuples (id, time, player_1, player_2, player_1_result,
+        player_2_result). player_2 and player_2_result are 0 and None
+        for a Bye round, time is None when the backend doesn't record it.
+        *fetch_size* rows are fetched at a time."""
+        raise NotImplementedError
+
+    def changesSince(self, player_id, match_id):
+        """Read what changed since a previous call, to keep
+        a swisspairings.PairingState up to date.
+
+        Args:
+          player_id: the highest player ID already known.
+          match_id: the highest match ID already known.
+
+        Returns:
+          A tuple (players, matches, counts):
+            players: list of tuples (id, name) of the players with a
+              higher ID, sorted by ID.
+            matches: list of tuples (id, player_1, player_2,
+              player_1_result, player_2_result) of the matches with
+              a higher ID, sorted by ID.
+            counts: tuple (number of players, number of matches),
+              read from the same snapshot as the changes.
+        """
+        raise NotImplementedError
+
+    def pairingSnapshot(self):
+        """Read everything the pairing engines need in one consistent
+        snapshot, so that a match reported meanwhile can't show up
+        in the history but not in the standings.
+
+        Returns:
+          A tuple (standings, opponents): the playerStandings() list, and
+          a dictionary mapping each player ID to the set of IDs of his or
+          her past opponents, 0 standing for a Bye-round.
+        """
+        raise NotImplementedError
+
+    def drawnPairings(self, options):
+        """Look for the pairings already drawn for the next round.
+
+        A draw is identified by the number of players and matches
+        recorded when it was made, and by the options of the pairing
+        engine: once a result is reported or a player registered, the
+        next draw is a new one.
+
+        Args:
+          options: a string describing the engine options.
+
+        Returns:
+          A tuple (key, pairings): the key of the current draw, to be
+          passed to saveDraw(), and the list of tuples
+          (id1, name1, id2, name2) drawn for it, or None.
+        """
+        raise NotImplementedError
+
+    def drawLock(self):
+        """Returns a context manager keeping other callers from drawing
+        the pairings of the tournament until its with-block ends: they
+        wait at the with-statement, then find the pairings stored
+        meanwhile with drawnPairings(). Results can still be reported
+        while the block runs."""
+        raise NotImplementedError
+
+    def saveDraw(self, key, options, pairings):
+        """Store the pairings drawn for the key returned by
+        drawnPairings()."""
+        raise NotImplementedError
+
+    def deleteDraws(self):
+        """Forget every draw of the tournament, e.g. after its ratings
+        were rebuilt. deleteMatches() and deletePlayers() do it too."""
+        raise NotImplementedError
+
+
+def pageArguments(tournament_id, after, limit):
+    """Returns the named parameters of the queries reading a page of
+    the standings after a row, see Backend.standingsPage()."""
+    return {
+        'tournament': tournament_id,
+        'player': after[0],
+        'won': after[2],
+        'tied': after[3],
+        'limit': limit,
+    }
+
+
+def matchError(tournament_id, player_1, player_2, registered, met):
+    """Returns the ValueError rejecting a result, with the messages of
+    report_match() in tournament.sql, or None if it can be recorded.
+
+    Args:
+      tournament_id: the ID of the tournament.
+      player_1, player_2: the players, player_2 being 0 for a Bye.
+      registered: whether both players (player_1 alone for a Bye) are
+        registered in the tournament.
+      met: whether the players have already met (player_1 already had
+        a Bye-round, for a Bye).
+    """
+    if player_1 == player_2:
+        return ValueError(
+            "Player %s is on both sides of the match" % player_1)
+    if not registered:
+        return ValueError(
+            "Players %s and %s aren't both registered in tournament %s"
+            % (player_1, player_2, tournament_id))
+    if met and player_2 == 0:
+        return ValueError("Player %s already had a Bye-round" % player_1)
+    if met:
+        return ValueError(
+            "Players %s and %s have already met" % (player_1, player_2))
+    return None
+
+
+def drawFromRows(rows):
+    """Split the rows of the query reading a draw, (players, matches,
+    id1, name1, id2, name2) with NULL pairing columns when nothing was
+    drawn, into the (key, pairings) tuple of Backend.drawnPairings()."""
+    key = (rows[0][0], rows[0][1])
+    if rows[0][2] is None:
+        return key, None
+    return key, [tuple(row[2:]) for row in rows]
+
+
+def drawRows(tournament_id, key, options, pairings):
+    """Returns the rows of the draws table storing a draw."""
+    return [(tournament_id, key[0], key[1], options, position,
+             id1, name1, id2 or 0, name2)
+            for position, (id1, name1, id2, name2) in enumerate(pairings)]
+
+
+def createBackend(name=None, **options):
+    """Build a new storage backend, without making it the configured one.
+
+    Args:
+      name: one of the keys of BACKENDS. When None, the TOURNAMENT_BACKEND
+        environment variable is used, falling back to DEFAULT_BACKEND.
+      **options: passed to the backend constructor. When no option is
+        given, the TOURNAMENT_DATABASE environment variable (if set) is
+        passed as the backend database (a DSN for PostgreSQL,
+        a file path for SQLite).
+
+    Returns:
+      The new backend.
+    """
+    if name is None:
+        name = os.environ.get('TOURNAMENT_BACKEND', DEFAULT_BACKEND)
+    if name not in BACKENDS:
+        raise ValueError("Unknown storage backend %r" % name)
+    if not options and os.environ.get('TOURNAMENT_DATABASE'):
+        options['database'] = os.environ['TOURNAMENT_DATABASE']
+
+    module_name, class_name = BACKENDS[name]
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    return backend_class(**options)
+
+
+def configureBackend(name=None, **options):
+    """Select the storage backend used by tournament.py.
+    Any previously configured backend is closed.
+
+    Args:
+      name, **options: see createBackend(). name can also be a backend
+        built earlier, e.g. one returned by getBackend(), to select it
+        again.
+
+    Returns:
+      The new backend.
+    """
+    global _backend
+
+    if isinstance(name, Backend):
+        backend = name
+    else:
+        backend = createBackend(name, **options)
+
+    with _backendLock:
+        if _backend is not None and _backend is not backend:
+            _backend.close()
+        _backend = backend
+
+    return backend
+
+
+def getBackend():
+    """Returns the configured backend, configuring one
+    from the environment if needed."""
+    if _backend is None:
+        configureBackend()
+    return _backend
+
+
+def closeBackend():
+    """Close the configured backend, if any."""
+    global _backend
+    with _backendLock:
+        if _backend is not None:
+            _backend.close()
+            _backend = None
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+#
+# Asyncio PostgreSQL storage backend, see tournament_async.py.
+#
+# psycopg2 connections opened in asynchronous mode never block: each query
+# is sent at once, and the event loop is told to wake us up when the socket
+# of the connection is ready. Asynchronous connections are always in
+# autocommit mode, so every operation is a single statement, unless it
+# goes through transaction().
+#
+# Requires Python 3.7 or later.
+
+import asyncio
+import contextlib
+import copy
+
+import psycopg2
+import psycopg2.errorcodes
+import psycopg2.extensions
+
+from storage.postgres import (
+    DSN, PLAYER_STANDINGS, REPORT_MATCH, REPORT_ROUND, REPORT_ROUND_TEMPLATE,
+    CHANGED_MATCHES, CHANGED_PLAYERS, COUNTS, SNAPSHOT, PLAYER_RATINGS,
+    LOCK_PLAYER_RATINGS, UPDATE_RATINGS, UPDATE_RATINGS_TEMPLATE,
+    RESET_RATINGS, DRAW_LOCK, DRAWN_PAIRINGS, SAVE_DRAW, TOP_STANDINGS,
+    STANDINGS_PAGE, snapshotFromRows
+)
+from storage import DEFAULT_TOURNAMENT, drawFromRows, drawRows, pageArguments
+
+
+async def wait(connection):
+    """Wait until the pending operation of an asynchronous connection
+    is complete, without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+
+    while True:
+        state = connection.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+
+        ready = loop.create_future()
+
+        def wakeUp():
+            if not ready.done():
+                ready.set_result(None)
+
+        fd = connection.fileno()
+        if state == psycopg2.extensions.POLL_READ:
+            loop.add_reader(fd, wakeUp)
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            loop.add_writer(fd, wakeUp)
+            try:
+                await ready
+            finally:
+                loop.remove_writer(fd)
+        else:
+            raise psycopg2.OperationalError("Bad poll state %r" % state)
+
+
+class AsyncConnectionPool(object):
+
+    """A pool of asynchronous psycopg2 connections.
+
+    At most *maxconn* connections are handed out at the same time:
+    further callers wait for one of them to be given back.
+    """
+
+    def __init__(self, dsn=DSN, maxconn=10):
+        self.dsn = dsn
+        self.maxconn = maxconn
+        self.__idle = []
+        self.__slots = None
+
+    def __getSlots(self):
+        # Created on first use, so that it belongs to the running loop.
+        if self.__slots is None:
+            self.__slots = asyncio.Semaphore(self.maxconn)
+        return self.__slots
+
+    async def getconn(self):
+        """Returns an idle connection, opening a new one if needed."""
+        slots = self.__getSlots()
+        await slots.acquire()
+        try:
+            while self.__idle:
+                connection = self.__idle.pop()
+                if not connection.closed:
+                    return connection
+            connection = psycopg2.connect(self.dsn, async_=True)
+            await wait(connection)
+            return connection
+        except BaseException:
+            slots.release()
+            raise
+
+    def putconn(self, connection):
+        """Give a connection back to the pool. A connection still running
+        a query (e.g. because the caller was cancelled) is closed."""
+        if connection.closed or connection.isexecuting():
+            connection.close()
+        else:
+            self.__idle.append(connection)
+        self.__getSlots().release()
+
+    def closeall(self):
+        """Close every idle connection."""
+        while self.__idle:
+            self.__idle.pop().close()
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        """Async context manager lending a connection of the pool."""
+        connection = await self.getconn()
+        try:
+            yield connection
+        finally:
+            self.putconn(connection)
+
+
+class AsyncPostgresBackend(object):
+
+    """Store the tournament inside PostgreSQL without blocking
+    the event loop. Methods mirror storage.Backend, as coroutines."""
+
+    tournamentId = DEFAULT_TOURNAMENT
+    # The connection every statement runs on, if the backend is bound to
+    # one, see drawLock() and transaction(). Each statement takes a pooled
+    # one otherwise.
+    bound = None
+
+    def __init__(self, database=DSN, maxconn=10):
+        """
+        Args:
+          database: the libpq connection string.
+          maxconn: maximum number of connections kept by the pool.
+        """
+        self.pool = AsyncConnectionPool(database, maxconn)
+
+    async def close(self):
+        self.pool.closeall()
+
+    def forTournament(self, tournament_id):
+        """Returns a view of the backend working on another tournament,
+        sharing its pool, see storage.Backend.forTournament()."""
+        if tournament_id == self.tournamentId:
+            return self
+        view = copy.copy(self)
+        view.tournamentId = tournament_id
+        return view
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        """Async context manager lending the connection the backend is
+        bound to, or else a connection of the pool."""
+        if self.bound is not None:
+            yield self.bound
+            return
+        async with self.pool.connection() as connection:
+            yield connection
+
+    @contextlib.asynccontextmanager
+    async def transaction(self, snapshot=False):
+        """Async context manager running the statements of the view it
+        yields in one transaction, on one connection: committed when the
+        with-block ends, rolled back if it raises.
+
+        Args:
+          snapshot: run a read-only REPEATABLE READ transaction, whose
+            statements all read the same snapshot.
+        """
+        async with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("BEGIN")
+                await wait(connection)
+                if snapshot:
+                    cursor.execute(SNAPSHOT)
+                    await wait(connection)
+                view = copy.copy(self)
+                view.bound = connection
+                try:
+                    yield view
+                except BaseException:
+                    if connection is self.bound:
+                        cursor.execute("ROLLBACK")
+                        await wait(connection)
+                    else:
+                        # Closing the connection rolls the transaction
+                        # back, even if a statement is still running.
+                        connection.close()
+                    raise
+                cursor.execute("COMMIT")
+                await wait(connection)
+            finally:
+                cursor.close()
+
+    async def execute(self, query, args=None, fetch=None):
+        """Run one statement on a pooled connection.
+
+        Args:
+          query: the SQL statement.
+          args: its parameters.
+          fetch: None, 'one' or 'all'.
+
+        Returns:
+          The fetched row or rows, if requested.
+        """
+        async with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(query, args)
+                await wait(connection)
+                if fetch == 'one':
+                    return cursor.fetchone()
+                if fetch == 'all':
+                    return cursor.fetchall()
+            finally:
+                cursor.close()
+
+    async def createTournament(self, name):
+        row = await self.execute("SELECT create_tournament(%s)", (name,),
+                                 fetch='one')
+        return row[0]
+
+    async def listTournaments(self):
+        return await self.execute(
+            "SELECT id, name FROM tournaments ORDER BY id", fetch='all'
+        )
+
+    async def dropTournament(self, tournament_id):
+        await self.execute("SELECT drop_tournament(%s)", (tournament_id,))
+
+    async def deleteMatches(self):
+        await self.execute("DELETE FROM matches WHERE tournament_id = %s",
+                           (self.tournamentId,))
+        await self.execute(RESET_RATINGS, (self.tournamentId,))
+        await self.deleteDraws()
+
+    async def deletePlayers(self):
+        await self.execute("DELETE FROM players WHERE tournament_id = %s",
+                           (self.tournamentId,))
+        await self.deleteDraws()
+
+    async def countPlayers(self):
+        row = await self.execute(
+            "SELECT COUNT(*) FROM players WHERE tournament_id = %s",
+            (self.tournamentId,), fetch='one'
+        )
+        return row[0]
+
+    async def registerPlayer(self, name):
+        row = await self.execute(
+            "INSERT INTO players (tournament_id, name) VALUES (%s, %s) "
+            "RETURNING id", (self.tournamentId, name), fetch='one'
+        )
+        return row[0]
+
+    async def getPlayerID(self, name):
+        return await self.execute(
+            "SELECT id FROM players WHERE tournament_id = %s AND name = %s",
+            (self.tournamentId, name), fetch='one'
+        )
+
+    async def playerStandings(self):
+        return await self.execute(PLAYER_STANDINGS, (self.tournamentId,),
+                                  fetch='all')
+
+    async def standingsPage(self, after=None, limit=20):
+        if after is None:
+            return await self.execute(TOP_STANDINGS,
+                                      (self.tournamentId, limit),
+                                      fetch='all')
+        return await self.execute(
+            STANDINGS_PAGE, pageArguments(self.tournamentId, after, limit),
+            fetch='all'
+        )
+
+    async def reportMatch(self, player_1, player_2, player_1_result,
+                          player_2_result):
+        try:
+            row = await self.execute(REPORT_MATCH, (
+                self.tournamentId, player_1, player_2, player_1_result,
+                player_2_result,
+            ), fetch='one')
+        except psycopg2.DataError as e:
+            if e.pgcode != psycopg2.errorcodes.INVALID_PARAMETER_VALUE:
+                raise
+            raise ValueError(e.diag.message_primary)
+        return row[0]
+
+    async def reportRound(self, results):
+        if not results:
+            return []
+
+        # execute_values() can't wait on an asynchronous connection,
+        # so the VALUES list is rendered here and run as one statement.
+        async with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                values = b",".join(
+                    cursor.mogrify(REPORT_ROUND_TEMPLATE,
+                                   (order, self.tournamentId) + tuple(result))
+                    for order, result in enumerate(results)
+                )
+                cursor.execute(
+                    REPORT_ROUND,
+                    (psycopg2.extensions.AsIs(values.decode('utf-8')),)
+                )
+                await wait(connection)
+                game_ids = cursor.fetchall()
+            finally:
+                cursor.close()
+
+        return [game_id for (game_id,) in game_ids]
+
+    async def playerRatings(self, player_ids=None):
+        # The rows stay locked until the ratings are written back only
+        # inside transaction().
+        if player_ids is None:
+            return await self.execute(PLAYER_RATINGS, (self.tournamentId,),
+                                      fetch='all')
+        return await self.execute(LOCK_PLAYER_RATINGS,
+                                  (self.tournamentId, list(player_ids)),
+                                  fetch='all')
+
+    async def updateRatings(self, ratings):
+        if not ratings:
+            return
+
+        async with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                values = b",".join(
+                    cursor.mogrify(UPDATE_RATINGS_TEMPLATE,
+                                   (player_id, rating, deviation))
+                    for player_id, (rating, deviation) in ratings.items()
+                )
+                cursor.execute(
+                    UPDATE_RATINGS,
+                    (psycopg2.extensions.AsIs(values.decode('utf-8')),)
+                )
+                await wait(connection)
+            finally:
+                cursor.close()
+
+    async def matchesHistory(self):
+        return await self.execute(
+            "SELECT player_1, player_2 FROM matches WHERE tournament_id = %s",
+            (self.tournamentId,), fetch='all'
+        )
+
+    async def pairingSnapshot(self):
+        rows = await self.execute(
+            "SELECT * FROM pairing_snapshot(%s)", (self.tournamentId,),
+            fetch='all'
+        )
+        return snapshotFromRows(rows)
+
+    async def changesSince(self, player_id, match_id):
+        # One snapshot, as in PostgresBackend.changesSince().
+        async with self.transaction(snapshot=True) as view:
+            matches = await view.execute(
+                CHANGED_MATCHES, (self.tournamentId, match_id), fetch='all'
+            )
+            players = await view.execute(
+                CHANGED_PLAYERS, (self.tournamentId, player_id), fetch='all'
+            )
+            counts = await view.execute(
+                COUNTS, (self.tournamentId, self.tournamentId), fetch='one'
+            )
+        return players, matches, counts
+
+    async def drawnPairings(self, options):
+        rows = await self.execute(
+            DRAWN_PAIRINGS,
+            {'tournament': self.tournamentId, 'options': options},
+            fetch='all'
+        )
+        return drawFromRows(rows)
+
+    @contextlib.asynccontextmanager
+    async def drawLock(self):
+        """Async context manager holding the advisory lock on the draws
+        of the tournament, see storage.Backend.drawLock(). Asynchronous
+        connections have no transaction to release it: the lock is
+        taken at session level, on a connection of its own.
+
+        Yields a view of the backend bound to that connection: queries
+        of the lock holder must go through it, as the callers waiting
+        for the lock may hold every other connection of the pool.
+        """
+        async with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT pg_advisory_lock(%s, %s)",
+                               (DRAW_LOCK, self.tournamentId))
+                await wait(connection)
+                try:
+                    view = copy.copy(self)
+                    view.bound = connection
+                    yield view
+                finally:
+                    cursor.execute("SELECT pg_advisory_unlock(%s, %s)",
+                                   (DRAW_LOCK, self.tournamentId))
+                    await wait(connection)
+            finally:
+                cursor.close()
+
+    async def saveDraw(self, key, options, pairings):
+        rows = drawRows(self.tournamentId, key, options, pairings)
+        if not rows:
+            return
+
+        async with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                values = b",".join(cursor.mogrify(
+                    "(%s, %s, %s, %s, %s, %s, %s, %s, %s)", row
+                ) for row in rows)
+                cursor.execute(
+                    SAVE_DRAW,
+                    (psycopg2.extensions.AsIs(values.decode('utf-8')),)
+                )
+                await wait(connection)
+            finally:
+                cursor.close()
+
+    async def deleteDraws(self):
+        await self.execute("DELETE FROM draws WHERE tournament_id = %s",
+                           (self.tournamentId,))
@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+#
+# Journal storage backend: the tournament is kept in memory, and every
+# write is appended to a journal file replayed at start-up.
+#
+# The journal is a sequence of fixed-size little-endian records:
+#
+#   kind        1 byte, followed by 3 bytes of padding
+#   tournament  4 bytes
+#   a, b        8 bytes each
+#   x, y        8 bytes each, floats
+#
+#   M  match            a, b: the players (b = 0 for a Bye-round),
+#                       x, y: their outcomes.
+#   P  player           a: length of the name, in UTF-8 bytes.
+#   R  rating           a: the player, x: rating, y: rating deviation.
+#   T  new tournament   a: length of the name.
+#   X  dropped tournament.
+#   m  deleteMatches().
+#   p  deletePlayers().
+#   F  first IDs        a: first player ID, b: first match ID.
+#
+# Names follow their P or T record, padded to whole records. Records are
+# only appended, so a crash can at worst leave a torn record at the end,
+# which is cut off when the journal is opened again.
+#
+# Replaying maps the file and unpacks the records in place: matches go
+# straight into the arrays of MemoryBackend, and the standings are
+# computed once at the end. compact() rewrites the journal as a snapshot
+# of the current state, see JournalBackend.compact().
+
+from __future__ import absolute_import
+
+import contextlib
+import io
+import mmap
+import os
+import struct
+import threading
+
+from ratings import DEFAULT_RATING, DEFAULT_DEVIATION
+from storage.memory import MemoryBackend
+
+
+RECORD = struct.Struct('<c3xiqqdd')
+
+MATCH = b'M'
+PLAYER = b'P'
+RATING = b'R'
+TOURNAMENT = b'T'
+DROP_TOURNAMENT = b'X'
+DELETE_MATCHES = b'm'
+DELETE_PLAYERS = b'p'
+FIRST_IDS = b'F'
+
+
+def record(kind, tournament_id, a=0, b=0, x=0.0, y=0.0):
+    """Returns the bytes of a record."""
+    return RECORD.pack(kind, tournament_id, a, b, x, y)
+
+
+def nameRecord(kind, tournament_id, name):
+    """Returns the bytes of a P or T record, followed by the name."""
+    data = name.encode('utf-8')
+    padding = -len(data) % RECORD.size
+    return (RECORD.pack(kind, tournament_id, len(data), 0, 0.0, 0.0) +
+            data + b'\0' * padding)
+
+
+def matchRecord(tournament_id, player_1, player_2, player_1_result,
+                player_2_result):
+    """Returns the bytes of a match record."""
+    if player_2 == 0:
+        player_2_result = 0
+    return RECORD.pack(MATCH, tournament_id, player_1, player_2,
+                       player_1_result, player_2_result)
+
+
+def _records(buffer, size):
+    """Yield the records held by the first *size* bytes of a buffer,
+    as tuples (kind, tournament_id, a, b, x, y), without copying it.
+    Names come out as records too, to be skipped by the caller."""
+    if not hasattr(RECORD, 'iter_unpack'):
+        # Python 2
+        for offset in range(0, size, RECORD.size):
+            yield RECORD.unpack_from(buffer, offset)
+        return
+
+    view = memoryview(buffer)[:size]
+    records = RECORD.iter_unpack(view)
+    try:
+        for values in records:
+            yield values
+    finally:
+        # The map can't be closed while it is still viewed.
+        del records
+        view.release()
+
+
+def _load(buffer, backend):
+    """Apply the records of a buffer to a MemoryBackend.
+
+    Returns:
+      The length of the complete records: a name running past the end
+      of the buffer, torn by a crash, is left out with its record.
+    """
+    step = RECORD.size
+    size = len(buffer) - len(buffer) % step
+    views = {}
+    touched = set()
+    offset = 0
+    skip = 0
+
+    # Appending to the match log of the latest match record.
+    log = None
+    log_tournament = None
+
+    for (kind, tournament_id, a, b, x, y) in _records(buffer, size):
+        if skip:
+            skip -= 1
+            continue
+
+        if kind == MATCH and log is not None \
+                and tournament_id == log_tournament:
+            log[0](a)
+            log[1](b)
+            log[2](x)
+            log[3](y)
+            offset += step
+            continue
+        # Other records may replace the arrays.
+        log = None
+
+        if kind == TOURNAMENT or kind == PLAYER:
+            skip = -(-a // step)
+            if offset + (1 + skip) * step > size:
+                break
+            name = buffer[offset + step:offset + step + a].decode('utf-8')
+            if kind == TOURNAMENT:
+                MemoryBackend.createTournament(backend, name, tournament_id)
+                offset += (1 + skip) * step
+                continue
+        elif kind == DROP_TOURNAMENT:
+            MemoryBackend.dropTournament(backend, tournament_id)
+            views.pop(tournament_id, None)
+            offset += step
+            continue
+
+        view = views.get(tournament_id)
+        if view is None:
+            view = views[tournament_id] = \
+                backend.forTournament(tournament_id)
+
+        if kind == MATCH:
+            log = (view.player1.append, view.player2.append,
+                   view.result1.append, view.result2.append)
+            log_tournament = tournament_id
+            log[0](a)
+            log[1](b)
+            log[2](x)
+            log[3](y)
+            touched.add(view)
+        elif kind == PLAYER:
+            MemoryBackend.registerPlayer(view, name)
+        elif kind == RATING:
+            MemoryBackend.updateRatings(view, {a: (x, y)})
+        elif kind == DELETE_MATCHES:
+            MemoryBackend.deleteMatches(view)
+        elif kind == DELETE_PLAYERS:
+            MemoryBackend.deletePlayers(view)
+        elif kind == FIRST_IDS:
+            view.firstPlayerId = a
+            view.firstMatchId = b
+        else:
+            raise ValueError("Unknown journal record %r at byte %d"
+                             % (kind, offset))
+        offset += (1 + skip) * step
+
+    # Matches were appended to the log alone: add up the standings.
+    for view in touched:
+        MemoryBackend.rebuildStandings(view)
+    return offset
+
+
+def replay(path, backend=None):
+    """Load a journal file into a MemoryBackend, e.g. to draw a round
+    out of its pairingSnapshot() without any database.
+
+    Args:
+      path: the journal file. A missing file is an empty journal.
+      backend: the MemoryBackend to load, a new one if None.
+
+    Returns:
+      A tuple (backend, size), size being the length of the complete
+      records of the journal.
+    """
+    if backend is None:
+        backend = MemoryBackend()
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return backend, 0
+
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return backend, _load(buffer, backend)
+        finally:
+            buffer.close()
+
+
+class Journal(object):
+
+    """An append-only journal file.
+
+    Records are written as soon as they are appended, unless a
+    transaction is open: they are then held back until the outermost
+    transaction exits normally, and dropped if it fails.
+    """
+
+    def __init__(self, path, sync=False):
+        """
+        Args:
+          path: the journal file.
+          sync: whether to fsync() the file after each write, so that
+            written records survive a power loss, not only a crash.
+        """
+        self.path = path
+        self.sync = sync
+        # Held by whoever writes, so that the records follow the order
+        # in which the writes were applied.
+        self.lock = threading.RLock()
+        self.__file = None
+        self.__depth = 0
+        self.__pending = []
+
+    def open(self, size=None):
+        """Open the journal for appending.
+
+        Args:
+          size: the length of its complete records, see replay(). Any
+            bytes after them, torn by a crash, are cut off.
+        """
+        with self.lock:
+            journal = io.open(self.path, 'ab')
+            if size is not None and journal.tell() > size:
+                journal.truncate(size)
+            self.__file = journal
+
+    def close(self):
+        """Close the file. It is opened again by the next write, like
+        the other backends connect again after close()."""
+        with self.lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+    def __write(self, data):
+        if self.__file is None:
+            self.open()
+        self.__file.write(data)
+        self.__file.flush()
+        if self.sync:
+            os.fsync(self.__file.fileno())
+
+    def append(self, data):
+        """Append the bytes of one or more records."""
+        with self.lock:
+            if self.__depth:
+                self.__pending.append(data)
+            else:
+                self.__write(data)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Returns a context manager holding back the records appended
+        inside its with-block, until the outermost one exits normally.
+        """
+        with self.lock:
+            self.__depth += 1
+            try:
+                yield self
+                if self.__depth == 1:
+                    self.__write(b''.join(self.__pending))
+            finally:
+                self.__depth -= 1
+                if self.__depth == 0:
+                    self.__pending = []
+
+    def rewrite(self, chunks):
+        """Replace the journal atomically.
+
+        Args:
+          chunks: an iterable of the bytes of the new records.
+
+        Returns:
+          The size of the new journal.
+        """
+        with self.lock:
+            if self.__depth:
+                raise RuntimeError("The journal can't be rewritten "
+                                   "inside a transaction")
+            temporary = self.path + '.tmp'
+            with io.open(temporary, 'wb') as f:
+                for data in chunks:
+                    f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            self.close()
+            os.rename(temporary, self.path)
+            self.open()
+            return size
+
+
+class JournalBackend(MemoryBackend):
+
+    """Keep the tournament in memory like MemoryBackend, appending every
+    write to a journal file replayed at start-up.
+
+    Writes of every tournament are appended under the lock of the
+    journal, in the order they are applied. Inside a session they are
+    held back until the outermost session exits normally, so that a
+    session rolled back leaves nothing in the journal.
+
+    The file is meant for a single process: two processes appending to
+    the same journal would mix their IDs.
+    """
+
+    def __init__(self, database='tournament.journal', sync=False):
+        """
+        Args:
+          database: path of the journal file.
+          sync: whether to fsync() the journal after each write.
+        """
+        MemoryBackend.__init__(self)
+        self.journal = Journal(database, sync)
+        with self.journal.lock:
+            size = replay(database, self)[1]
+            self.journal.open(size)
+
+    def _spawn(self):
+        backend = JournalBackend.__new__(JournalBackend)
+        MemoryBackend.__init__(backend)
+        backend.journal = self.journal
+        return backend
+
+    def close(self):
+        self.journal.close()
+
+    @contextlib.contextmanager
+    def session(self):
+        # The journal lock first, like every write.
+        with self.journal.lock:
+            with MemoryBackend.session(self):
+                with self.journal.transaction():
+                    yield self
+
+    def createTournament(self, name, tournament_id=None):
+        with self.journal.lock:
+            tournament_id = MemoryBackend.createTournament(
+                self, name, tournament_id)
+            self.journal.append(nameRecord(TOURNAMENT, tournament_id, name))
+        return tournament_id
+
+    def dropTournament(self, tournament_id):
+        with self.journal.lock:
+            MemoryBackend.dropTournament(self, tournament_id)
+            self.journal.append(record(DROP_TOURNAMENT, tournament_id))
+
+    def deleteMatches(self):
+        with self.journal.lock:
+            MemoryBackend.deleteMatches(self)
+            self.journal.append(record(DELETE_MATCHES, self.tournamentId))
+
+    def deletePlayers(self):
+        with self.journal.lock:
+            MemoryBackend.deletePlayers(self)
+            self.journal.append(record(DELETE_PLAYERS, self.tournamentId))
+
+    def registerPlayer(self, name):
+        with self.journal.lock:
+            player_id = MemoryBackend.registerPlayer(self, name)
+            self.journal.append(nameRecord(PLAYER, self.tournamentId, name))
+        return player_id
+
+    def registerPlayers(self, players):
+        # Walked twice: players may be a generator.
+        players = list(players)
+        with self.journal.lock:
+            player_ids = MemoryBackend.registerPlayers(self, players)
+            self.journal.append(b''.join(
+                nameRecord(PLAYER, self.tournamentId, name)
+                for (name, date) in players))
+        return player_ids
+
+    def reportMatch(self, player_1, player_2, player_1_result,
+                    player_2_result):
+        with self.journal.lock:
+            match_id = MemoryBackend.reportMatch(
+                self, player_1, player_2, player_1_result, player_2_result)
+            self.journal.append(matchRecord(
+                self.tournamentId, player_1, player_2, player_1_result,
+                player_2_result))
+        return match_id
+
+    def reportRound(self, results):
+        # A single write for the whole round.
+        with self.journal.transaction():
+            return MemoryBackend.reportRound(self, results)
+
+    def updateRatings(self, ratings):
+        with self.journal.lock:
+            MemoryBackend.updateRatings(self, ratings)
+            self.journal.append(b''.join(
+                record(RATING, self.tournamentId, player_id, 0, rating,
+                       deviation)
+                for player_id, (rating, deviation) in ratings.items()))
+
+    def __snapshot(self):
+        """Yield the records rebuilding the current state."""
+        for tournament_id, name in self.listTournaments():
+            backend = self.forTournament(tournament_id)
+            yield nameRecord(TOURNAMENT, tournament_id, name)
+            yield record(FIRST_IDS, tournament_id, backend.firstPlayerId,
+                         backend.firstMatchId)
+            for name in backend.names:
+                yield nameRecord(PLAYER, tournament_id, name)
+            for match in zip(backend.player1, backend.player2,
+                             backend.result1, backend.result2):
+                yield matchRecord(tournament_id, *match)
+            first = backend.firstPlayerId
+            ratings = zip(backend.rating, backend.deviation)
+            for i, (rating, deviation) in enumerate(ratings):
+                if (rating, deviation) != (DEFAULT_RATING,
+                                           DEFAULT_DEVIATION):
+                    yield record(RATING, tournament_id, first + i, 0,
+                                 rating, deviation)
+
+    def compact(self):
+        """Rewrite the journal as a snapshot of the current state:
+        deleted players and matches, dropped tournaments and former
+        ratings are left out. The matches still in play are kept, one
+        record each, as the history of the pairings and the tiebreaks
+        are computed out of them.
+
+        Returns:
+          The size of the new journal, in bytes.
+
+        Raises:
+          RuntimeError: if called inside a session.
+        """
+        with self.journal.lock:
+            return self.journal.rewrite(self.__snapshot())
@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+#
+# In-memory storage backend: nothing is persisted, no database is needed.
+
+from __future__ import absolute_import
+
+import collections
+import contextlib
+import heapq
+import itertools
+import threading
+from array import array
+
+from leaderboard import standingsKey
+from ratings import DEFAULT_RATING, DEFAULT_DEVIATION
+from storage import Backend, FETCH_SIZE, DEFAULT_TOURNAMENT, matchError
+
+
+class MemoryBackend(Backend):
+
+    """Store the tournament inside the Python process.
+
+    Players are kept in compact per-player arrays indexed by
+    (id - firstPlayerId), and matches in an append-only log made of
+    parallel arrays indexed by (match id - firstMatchId).
+    IDs keep growing after a delete, like a SERIAL column does.
+
+    Sessions hold a lock, so they are serialized. To roll back if the
+    with-block fails, they copy the per-player counters and ratings,
+    and only record the length of the names and of the match log, which
+    are appended to until a delete replaces them. drawLock() is a lock
+    of its own, which doesn't keep results from being reported.
+
+    Each tournament has arrays of its own, inside a MemoryBackend
+    returned by forTournament(): player and match IDs are only unique
+    within a tournament.
+    """
+
+    # Per-player arrays updated in place.
+    COUNTERS = ('won', 'tied', 'played', 'score', 'rating', 'deviation')
+    # Sequences only appended to, until a delete replaces them.
+    LOGS = ('names', 'player1', 'player2', 'result1', 'result2')
+
+    def __init__(self, database=None):
+        """
+        Args:
+          database: ignored, accepted for compatibility
+            with the other backends.
+        """
+        self.__lock = threading.RLock()
+        self.__drawLock = threading.Lock()
+        self.__local = threading.local()
+
+        # Shared by the backends of every tournament: the name of each
+        # tournament and its backend, once used, and the next free ID.
+        self.__tournaments = {
+            'lock': threading.Lock(),
+            'names': {DEFAULT_TOURNAMENT: 'Default tournament'},
+            'backends': {DEFAULT_TOURNAMENT: self},
+            'next': DEFAULT_TOURNAMENT + 1,
+        }
+
+        self.firstPlayerId = 1
+        self.firstMatchId = 1
+        self.__clearPlayers()
+        self.__clearMatches()
+
+        # Pairings by (players, matches, options), see drawnPairings().
+        self.draws = {}
+
+    def __clearPlayers(self):
+        self.names = []
+        self.won = array('l')
+        self.tied = array('l')
+        self.played = array('l')
+        self.score = array('d')
+        self.rating = array('d')
+        self.deviation = array('d')
+
+    def __clearMatches(self):
+        self.player1 = array('l')
+        self.player2 = array('l')
+        self.result1 = array('d')
+        self.result2 = array('d')
+        self.__opponents = None
+
+    def __opponentsIndex(self):
+        """Returns the opponents of each player, 0 standing for a Bye,
+        indexed out of the match log on first use, then kept up to
+        date by reportMatch()."""
+        if self.__opponents is None:
+            opponents = {}
+            for (player_1, player_2) in zip(self.player1, self.player2):
+                opponents.setdefault(player_1, set()).add(player_2)
+                if player_2 != 0:
+                    opponents.setdefault(player_2, set()).add(player_1)
+            self.__opponents = opponents
+        return self.__opponents
+
+    def __snapshot(self):
+        """Returns what is needed to roll the state back: a copy of the
+        counters, and each log along with its length."""
+        state = {
+            'firstPlayerId': self.firstPlayerId,
+            'firstMatchId': self.firstMatchId,
+        }
+        for key in self.COUNTERS:
+            state[key] = getattr(self, key)[:]
+        for key in self.LOGS:
+            log = getattr(self, key)
+            state[key] = (log, len(log))
+        return state
+
+    def __restore(self, state):
+        for key, value in state.items():
+            if key in self.LOGS:
+                value, length = value
+                del value[length:]
+            setattr(self, key, value)
+        # Indexed again out of the log when needed.
+        self.__opponents = None
+
+    @contextlib.contextmanager
+    def session(self):
+        with self.__lock:
+            depth = getattr(self.__local, 'depth', 0)
+            snapshot = self.__snapshot() if depth == 0 else None
+            self.__local.depth = depth + 1
+            try:
+                yield self
+            except BaseException:
+                if snapshot is not None:
+                    self.__restore(snapshot)
+                raise
+            finally:
+                self.__local.depth = depth
+
+    def forTournament(self, tournament_id):
+        tournaments = self.__tournaments
+        with tournaments['lock']:
+            if tournament_id not in tournaments['names']:
+                raise ValueError("Unknown tournament %r" % tournament_id)
+            backend = tournaments['backends'].get(tournament_id)
+            if backend is None:
+                backend = self._spawn()
+                backend.tournamentId = tournament_id
+                backend.__tournaments = tournaments
+                tournaments['backends'][tournament_id] = backend
+        return backend
+
+    def _spawn(self):
+        """Returns an empty backend of the same kind, for another
+        tournament, see forTournament()."""
+        return MemoryBackend()
+
+    def createTournament(self, name, tournament_id=None):
+        """Adds a tournament and returns its ID.
+
+        Args:
+          name: the name of the tournament.
+          tournament_id: the ID to give it, when replaying a journal.
+            The next free ID if None.
+        """
+        tournaments = self.__tournaments
+        with tournaments['lock']:
+            if tournament_id is None:
+                tournament_id = tournaments['next']
+            tournaments['next'] = max(tournaments['next'], tournament_id + 1)
+            tournaments['names'][tournament_id] = name
+        return tournament_id
+
+    def listTournaments(self):
+        tournaments = self.__tournaments
+        with tournaments['lock']:
+            return sorted(tournaments['names'].items())
+
+    def dropTournament(self, tournament_id):
+        tournaments = self.__tournaments
+        with tournaments['lock']:
+            tournaments['names'].pop(tournament_id, None)
+            backend = tournaments['backends'].pop(tournament_id, None)
+        if backend is not None:
+            with backend.__lock:
+                backend.__clearMatches()
+                backend.__clearPlayers()
+                backend.draws = {}
+
+    def __index(self, player):
+        """Returns the position of a player inside the arrays,
+        or None if the player isn't registered."""
+        i = player - self.firstPlayerId
+        if 0 <= i < len(self.names):
+            return i
+        return None
+
+    def __apply(self, player, result):
+        """Add an outcome to the player's standings."""
+        i = self.__index(player)
+        if i is None:
+            return
+        if result == 1:
+            self.won[i] += 1
+        elif result == 0.5:
+            self.tied[i] += 1
+        self.played[i] += 1
+        self.score[i] += result
+
+    def __computeStandings(self):
+        """Compute the standings from scratch out of the match log.
+
+        Returns:
+          A tuple of arrays (won, tied, played, score).
+        """
+        n = len(self.names)
+        won = array('l', [0]) * n
+        tied = array('l', [0]) * n
+        played = array('l', [0]) * n
+        score = array('d', [0.0]) * n
+
+        # Outcomes are counted per player ID by Counter, without a Python
+        # loop over the matches: the log can hold millions of them.
+        counts = []
+        for outcome in (1.0, 0.5, None):
+            counter = collections.Counter()
+            for players, results in ((self.player1, self.result1),
+                                     (self.player2, self.result2)):
+                if outcome is None:
+                    counter.update(players)
+                else:
+                    counter.update(itertools.compress(
+                        players, map(outcome.__eq__, results)))
+            counts.append(counter)
+
+        for (column, counter) in zip((won, tied, played), counts):
+            for (player, count) in counter.items():
+                i = self.__index(player)
+                if i is not None:
+                    column[i] = count
+        # Outcomes are 0, 0.5 or 1.
+        for i in range(n):
+            score[i] = won[i] + tied[i] * 0.5
+
+        return won, tied, played, score
+
+    def deleteMatches(self):
+        with self.__lock:
+            self.firstMatchId += len(self.player1)
+            self.__clearMatches()
+            n = len(self.names)
+            self.won = array('l', [0]) * n
+            self.tied = array('l', [0]) * n
+            self.played = array('l', [0]) * n
+            self.score = array('d', [0.0]) * n
+            self.rating = array('d', [DEFAULT_RATING]) * n
+            self.deviation = array('d', [DEFAULT_DEVIATION]) * n
+            self.draws = {}
+
+    def deletePlayers(self):
+        with self.__lock:
+            self.firstPlayerId += len(self.names)
+            self.__clearPlayers()
+            self.draws = {}
+
+    def countPlayers(self):
+        return len(self.names)
+
+    def registerPlayer(self, name):
+        with self.__lock:
+            self.names.append(name)
+            self.won.append(0)
+            self.tied.append(0)
+            self.played.append(0)
+            self.score.append(0.0)
+            self.rating.append(DEFAULT_RATING)
+            self.deviation.append(DEFAULT_DEVIATION)
+            return self.firstPlayerId + len(self.names) - 1
+
+    def registerPlayers(self, players):
+        # Registration dates aren't kept in memory.
+        names = [name for (name, date) in players]
+        with self.__lock:
+            first = self.firstPlayerId + len(self.names)
+            self.names.extend(names)
+            self.won.extend(array('l', [0]) * len(names))
+            self.tied.extend(array('l', [0]) * len(names))
+            self.played.extend(array('l', [0]) * len(names))
+            self.score.extend(array('d', [0.0]) * len(names))
+            self.rating.extend(array('d', [DEFAULT_RATING]) * len(names))
+            self.deviation.extend(
+                array('d', [DEFAULT_DEVIATION]) * len(names))
+        return list(range(first, first + len(names)))
+
+    def getPlayerID(self, name):
+        with self.__lock:
+            try:
+                return (self.firstPlayerId + self.names.index(name),)
+            except ValueError:
+                return None
+
+    def playerStandings(self):
+        with self.__lock:
+            first = self.firstPlayerId
+            standings = [
+                (first + i, self.names[i], self.won[i], self.tied[i],
+                 self.played[i])
+                for i in range(len(self.names))
+            ]
+        standings.sort(key=lambda row: (-row[2], -row[3], row[0]))
+        return standings
+
+    def standingsPage(self, after=None, limit=20):
+        # Nothing is sorted ahead: the page is picked out of a pass
+        # over the players, in O(n log(limit)).
+        with self.__lock:
+            first = self.firstPlayerId
+            rows = [
+                (first + i, self.names[i], self.won[i], self.tied[i],
+                 self.played[i])
+                for i in range(len(self.names))
+            ]
+        if after is not None:
+            start = standingsKey(after)
+            rows = [row for row in rows if standingsKey(row) > start]
+        return heapq.nsmallest(limit, rows, key=standingsKey)
+
+    def rebuildStandings(self):
+        # Also called once matches were appended to the log directly,
+        # see storage.journal.
+        with self.__lock:
+            self.won, self.tied, self.played, self.score = \
+                self.__computeStandings()
+            self.__opponents = None
+
+    def verifyStandings(self):
+        with self.__lock:
+            won, tied, played, score = self.__computeStandings()
+            return [
+                self.firstPlayerId + i for i in range(len(self.names))
+                if (won[i], tied[i], played[i], score[i]) !=
+                (self.won[i], self.tied[i], self.played[i], self.score[i])
+            ]
+
+    def reportMatch(self, player_1, player_2, player_1_result,
+                    player_2_result):
+        with self.__lock:
+            opponents = self.__opponentsIndex()
+            error = matchError(
+                self.tournamentId, player_1, player_2,
+                self.__index(player_1) is not None and
+                (player_2 == 0 or self.__index(player_2) is not None),
+                player_2 in opponents.get(player_1, ())
+            )
+            if error is not None:
+                raise error
+
+            self.player1.append(player_1)
+            self.player2.append(player_2)
+            self.result1.append(player_1_result)
+            self.result2.append(player_2_result if player_2 != 0 else 0)
+            opponents.setdefault(player_1, set()).add(player_2)
+            if player_2 != 0:
+                opponents.setdefault(player_2, set()).add(player_1)
+
+            self.__apply(player_1, player_1_result)
+            if player_2 != 0:
+                self.__apply(player_2, player_2_result)
+
+            return self.firstMatchId + len(self.player1) - 1
+
+    def reportRound(self, results):
+        with self.__lock:
+            return [self.reportMatch(*result) for result in results]
+
+    def playerRatings(self, player_ids=None):
+        with self.__lock:
+            if player_ids is None:
+                positions = range(len(self.names))
+            else:
+                positions = [i for i in map(self.__index, set(player_ids))
+                             if i is not None]
+            first = self.firstPlayerId
+            ratings = [(first + i, self.names[i], self.rating[i],
+                        self.deviation[i]) for i in positions]
+        ratings.sort(key=lambda row: (-row[2], row[0]))
+        return ratings
+
+    def updateRatings(self, ratings):
+        with self.__lock:
+            for player_id, (rating, deviation) in ratings.items():
+                i = self.__index(player_id)
+                if i is not None:
+                    self.rating[i] = rating
+                    self.deviation[i] = deviation
+
+    def matchesHistory(self):
+        with self.__lock:
+            return list(zip(self.player1, self.player2))
+
+    def streamStandings(self, fetch_size=FETCH_SIZE):
+        # Sorting needs every row: the standings are as big
+        # as the per-player arrays already in memory.
+        return iter(self.playerStandings())
+
+    def streamMatches(self, fetch_size=FETCH_SIZE):
+        with self.__lock:
+            first = self.firstMatchId
+            # Arrays are only appended to, or replaced by deleteMatches():
+            # the ones taken here stay valid while they are walked.
+            log = (self.player1, self.player2, self.result1, self.result2)
+            count = len(self.player1)
+
+        player1, player2, result1, result2 = log
+        for i in range(count):
+            if player2[i] == 0:
+                yield (first + i, None, player1[i], 0, result1[i], None)
+            else:
+                yield (first + i, None, player1[i], player2[i],
+                       result1[i], result2[i])
+
+    def changesSince(self, player_id, match_id):
+        with self.__lock:
+            first = self.firstPlayerId
+            start = max(0, player_id + 1 - first)
+            players = [(first + i, self.names[i])
+                       for i in range(start, len(self.names))]
+
+            first = self.firstMatchId
+            start = max(0, match_id + 1 - first)
+            matches = [(first + i, self.player1[i], self.player2[i],
+                        self.result1[i], self.result2[i])
+                       for i in range(start, len(self.player1))]
+
+            return players, matches, (len(self.names), len(self.player1))
+
+    def pairingSnapshot(self):
+        with self.__lock:
+            standings = self.playerStandings()
+            opponents = dict((player, set(players)) for player, players
+                             in self.__opponentsIndex().items())
+        return standings, opponents
+
+    def drawnPairings(self, options):
+        with self.__lock:
+            key = (len(self.names), len(self.player1))
+            pairings = self.draws.get(key + (options,))
+        if pairings is not None:
+            pairings = list(pairings)
+        return key, pairings
+
+    @contextlib.contextmanager
+    def drawLock(self):
+        # Drawing only reads the arrays: results can still be reported
+        # meanwhile, and the draw is then stored under a stale key.
+        with self.__drawLock:
+            yield self
+
+    def saveDraw(self, key, options, pairings):
+        with self.__lock:
+            self.draws.setdefault(key + (options,), list(pairings))
+
+    def deleteDraws(self):
+        with self.__lock:
+            self.draws = {}
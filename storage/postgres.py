@@ -0,0 +1,675 @@
+#!/usr/bin/env python
+#
+# PostgreSQL storage backend, see tournament.sql for the schema.
+
+from __future__ import absolute_import
+
+import contextlib
+import csv
+import io
+import itertools
+import sys
+import threading
+
+import psycopg2
+import psycopg2.errorcodes
+import psycopg2.extras
+import psycopg2.pool
+
+import instrumentation
+from storage import Backend, FETCH_SIZE, drawFromRows, drawRows
+from storage import pageArguments
+
+
+DSN = "dbname=tournament"
+
+PLAYER_STANDINGS = """SELECT
+    players.id,
+    players.name,
+    standings.won,
+    standings.tied,
+    standings.played
+    FROM standings
+    JOIN players ON players.id = standings.player_id
+    WHERE standings.tournament_id = %s
+    ORDER BY
+    standings.won DESC,
+    standings.tied DESC,
+    standings.player_id"""
+
+# The first rows of the standings.
+TOP_STANDINGS = PLAYER_STANDINGS + """
+    LIMIT %s"""
+
+# The rows of the standings following a player's (keyset pagination):
+# the players tied with him or her and ranked after, then those with
+# fewer wins or ties, both read in order from the standings_ranking
+# index.
+STANDINGS_PAGE = """SELECT
+    players.id,
+    players.name,
+    page.won,
+    page.tied,
+    page.played
+    FROM (
+        (SELECT player_id, won, tied, played FROM standings
+        WHERE tournament_id = %(tournament)s
+        AND won = %(won)s AND tied = %(tied)s AND player_id > %(player)s
+        ORDER BY player_id
+        LIMIT %(limit)s)
+        UNION ALL
+        (SELECT player_id, won, tied, played FROM standings
+        WHERE tournament_id = %(tournament)s
+        AND (won, tied) < (%(won)s, %(tied)s)
+        ORDER BY won DESC, tied DESC, player_id
+        LIMIT %(limit)s)
+    ) AS page
+    JOIN players ON players.id = page.player_id
+    ORDER BY page.won DESC, page.tied DESC, page.player_id
+    LIMIT %(limit)s"""
+
+# Records one result in one statement, see report_match() in
+# tournament.sql. Rejected results raise INVALID_PARAMETER_VALUE.
+REPORT_MATCH = "SELECT report_match(%s, %s, %s, %s, %s)"
+
+# Records a whole round in one statement: the VALUES placeholder
+# receives one (ord, tournament_id, player_1, player_2, result_1,
+# result_2) row per match, and the new match IDs are returned in the
+# same order.
+REPORT_ROUND = """WITH results (ord, tournament_id, player_1, player_2,
+                 result_1, result_2) AS (
+    VALUES %s
+),
+inserted AS (
+    INSERT INTO matches (tournament_id, player_1, player_2)
+    SELECT tournament_id, player_1, player_2 FROM results ORDER BY ord
+    RETURNING id, player_1, player_2
+),
+paired AS (
+    SELECT results.*, inserted.id
+    FROM results
+    JOIN inserted USING (player_1, player_2)
+),
+recorded AS (
+    INSERT INTO outcomes (tournament_id, match_id, player, player_outcome)
+    SELECT tournament_id, id, player_1, result_1 FROM paired
+    UNION ALL
+    SELECT tournament_id, id, player_2, result_2 FROM paired
+    WHERE player_2 <> 0
+)
+SELECT id FROM paired ORDER BY ord"""  # noqa
+
+REPORT_ROUND_TEMPLATE = "(%s, %s, %s, %s, %s::REAL, %s::REAL)"
+
+# Players sent by registerPlayers() with each COPY.
+COPY_SIZE = 10000
+
+# The csv module writes bytes on Python 2, text on Python 3.
+CopyBuffer = io.StringIO if sys.version_info[0] >= 3 else io.BytesIO
+
+# Reserves IDs for the players of a COPY, which can't return them.
+RESERVE_PLAYER_IDS = """SELECT
+    nextval(pg_get_serial_sequence('players', 'id')),
+    CURRENT_DATE
+    FROM generate_series(1, %s)"""
+
+STREAM_MATCHES = """SELECT
+    m.id,
+    m.time,
+    m.player_1,
+    m.player_2,
+    o1.player_outcome,
+    o2.player_outcome
+    FROM matches AS m
+    LEFT JOIN outcomes AS o1
+    ON o1.tournament_id = m.tournament_id
+    AND o1.match_id = m.id AND o1.player = m.player_1
+    LEFT JOIN outcomes AS o2
+    ON o2.tournament_id = m.tournament_id
+    AND o2.match_id = m.id AND o2.player = m.player_2
+    WHERE m.tournament_id = %s
+    ORDER BY m.id"""
+
+# Queries of changesSince().
+CHANGED_MATCHES = """SELECT
+    m.id,
+    m.player_1,
+    m.player_2,
+    COALESCE(o1.player_outcome, 0),
+    COALESCE(o2.player_outcome, 0)
+    FROM matches AS m
+    LEFT JOIN outcomes AS o1
+    ON o1.tournament_id = m.tournament_id
+    AND o1.match_id = m.id AND o1.player = m.player_1
+    LEFT JOIN outcomes AS o2
+    ON o2.tournament_id = m.tournament_id
+    AND o2.match_id = m.id AND o2.player = m.player_2
+    WHERE m.tournament_id = %s AND m.id > %s
+    ORDER BY m.id"""
+
+CHANGED_PLAYERS = """SELECT id, name FROM players
+    WHERE tournament_id = %s AND id > %s
+    ORDER BY id"""
+
+# Makes the queries of a transaction read a single snapshot.
+SNAPSHOT = "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY"
+
+# Ratings, highest first.
+PLAYER_RATINGS = """SELECT id, name, rating, rating_deviation
+    FROM players
+    WHERE tournament_id = %s
+    ORDER BY rating DESC, id"""
+
+# The same for some players, locking their rows until the end of the
+# transaction, so that concurrent reports can't lose an update.
+LOCK_PLAYER_RATINGS = """SELECT id, name, rating, rating_deviation
+    FROM players
+    WHERE tournament_id = %s AND id = ANY(%s)
+    ORDER BY id
+    FOR UPDATE"""
+
+UPDATE_RATINGS = """UPDATE players SET
+    rating = ratings.rating,
+    rating_deviation = ratings.deviation
+    FROM (VALUES %s) AS ratings (id, rating, deviation)
+    WHERE players.id = ratings.id"""
+
+UPDATE_RATINGS_TEMPLATE = "(%s, %s::DOUBLE PRECISION, %s::DOUBLE PRECISION)"
+
+# Players whose ratings are sent with each UPDATE.
+UPDATE_SIZE = 1000
+
+RESET_RATINGS = """UPDATE players SET
+    rating = DEFAULT,
+    rating_deviation = DEFAULT
+    WHERE tournament_id = %s"""
+
+COUNTS = """SELECT
+    (SELECT COUNT(*) FROM players WHERE tournament_id = %s),
+    (SELECT COUNT(*) FROM matches WHERE tournament_id = %s)"""
+
+VERIFY_STANDINGS = """SELECT COALESCE(s.player_id, c.player_id)
+    FROM (SELECT * FROM standings WHERE tournament_id = %s) AS s
+    FULL JOIN (SELECT * FROM computed_standings WHERE tournament_id = %s) AS c
+    ON s.player_id = c.player_id
+    WHERE (s.won, s.tied, s.played, s.score)
+    IS DISTINCT FROM (c.won, c.tied, c.played, c.score)
+    ORDER BY 1"""
+
+
+# First key of the advisory lock taken by drawLock(), the second one
+# being the tournament ID.
+DRAW_LOCK = 1
+
+# The counts identifying the next draw of a tournament, with the
+# pairings already drawn for them, if any.
+DRAWN_PAIRINGS = """WITH counts (players, matches) AS (
+    SELECT
+    (SELECT COUNT(*) FROM players WHERE tournament_id = %(tournament)s),
+    (SELECT COUNT(*) FROM matches WHERE tournament_id = %(tournament)s)
+)
+SELECT
+    counts.players,
+    counts.matches,
+    draws.player_1,
+    draws.name_1,
+    draws.player_2,
+    draws.name_2
+    FROM counts
+    LEFT JOIN draws
+    ON draws.tournament_id = %(tournament)s
+    AND draws.players = counts.players
+    AND draws.matches = counts.matches
+    AND draws.options = %(options)s
+    ORDER BY draws.position"""
+
+SAVE_DRAW = """INSERT INTO draws (tournament_id, players, matches, options,
+                   position, player_1, name_1, player_2, name_2)
+    VALUES %s
+    ON CONFLICT DO NOTHING"""
+
+
+def snapshotFromRows(rows):
+    """Split the rows returned by the pairing_snapshot() SQL function
+    into the (standings, opponents) tuple of Backend.pairingSnapshot()."""
+    standings = []
+    opponents = {}
+    for row in rows:
+        standings.append(tuple(row[:5]))
+        if row[5]:
+            opponents[row[0]] = set(row[5])
+    return standings, opponents
+
+
+class PostgresSession(object):
+
+    """Run several operations on one pooled connection
+    and inside one transaction.
+
+    Every operation of the backend issued inside the with-block uses
+    the session's connection. The transaction is committed when the
+    block exits normally and rolled back if an exception is raised.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.connection = None
+        self.__outer = None
+
+    def cursor(self):
+        """Returns a new cursor on the session's connection."""
+        return self.connection.cursor()
+
+    def __enter__(self):
+        # A nested Session simply joins the outer one.
+        self.__outer = self.backend.currentSession()
+        if self.__outer is not None:
+            self.connection = self.__outer.connection
+            return self
+
+        self.connection = self.backend.getPool().getconn()
+        self.backend.local.session = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.__outer is not None:
+            self.__outer = None
+            self.connection = None
+            return False
+
+        try:
+            if exc_type is None:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        finally:
+            self.backend.local.session = None
+            self.backend.getPool().putconn(self.connection)
+            self.connection = None
+
+        return False
+
+
+class PostgresBackend(Backend):
+
+    """Store the tournament inside PostgreSQL.
+
+    Connections are drawn from a ThreadedConnectionPool,
+    created lazily on first use.
+    """
+
+    def __init__(self, database=DSN, minconn=1, maxconn=10):
+        """
+        Args:
+          database: the libpq connection string.
+          minconn: number of connections opened straight away.
+          maxconn: maximum number of connections kept by the pool.
+        """
+        self.dsn = database
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.pool = None
+        self.__poolLock = threading.Lock()
+
+        # Per-thread holder of the currently open session, if any.
+        self.local = threading.local()
+        # Names of the server-side cursors.
+        self.__cursorNames = itertools.count()
+
+    def getPool(self):
+        """Returns the connection pool, creating it if needed."""
+        if self.pool is None:
+            with self.__poolLock:
+                if self.pool is None:
+                    self.pool = psycopg2.pool.ThreadedConnectionPool(
+                        self.minconn, self.maxconn, self.dsn
+                    )
+        return self.pool
+
+    def close(self):
+        """Close every connection held by the pool."""
+        with self.__poolLock:
+            if self.pool is not None:
+                self.pool.closeall()
+                self.pool = None
+
+    def currentSession(self):
+        """Returns the session open in the current thread, or None."""
+        return getattr(self.local, 'session', None)
+
+    def session(self):
+        return PostgresSession(self)
+
+    def __ownedBySession(self, connection):
+        """Find if a connection belongs to the session open
+        in this thread."""
+        session = self.currentSession()
+        return session is not None and session.connection is connection
+
+    def connect(self, name=None):
+        """Get a connection from the pool, or the one held by the
+        session open in the current thread.
+
+        Args:
+          name: if given, the cursor is a server-side cursor
+            with that name.
+
+        Returns:
+          A database connection and a cursor.
+        """
+        session = self.currentSession()
+        if session is not None:
+            connection = session.connection
+        else:
+            connection = self.getPool().getconn()
+        cursor = connection.cursor(name)
+        return [connection, cursor]
+
+    def commit(self, connection):
+        """Commit the current transaction, unless the connection belongs to
+        a session: in that case the session commits when it exits."""
+        if not self.__ownedBySession(connection):
+            connection.commit()
+
+    def closeConnection(self, connection, cursor):
+        """Close the cursor and give the connection back to the pool.
+        Connections held by a session are left open."""
+        cursor.close()
+        if not self.__ownedBySession(connection):
+            # The pool rolls back whatever transaction was left open.
+            self.getPool().putconn(connection)
+
+    @contextlib.contextmanager
+    def cursor(self, commit_on_exit=False, autocommit=False):
+        """Context manager yielding a cursor on a pooled connection.
+        The connection is always handed back, even if a query fails.
+
+        Args:
+          commit_on_exit: commit the transaction when the block succeeds.
+          autocommit: for a block running a single statement: outside a
+            session, the statement commits by itself, saving the round
+            trips of BEGIN and COMMIT.
+        """
+        connection, cursor = self.connect()
+        autocommit = autocommit and not self.__ownedBySession(connection)
+        if autocommit:
+            connection.autocommit = True
+        try:
+            if instrumentation.enabled():
+                yield instrumentation.CountingCursor(cursor)
+            else:
+                yield cursor
+            if commit_on_exit and not autocommit:
+                self.commit(connection)
+        finally:
+            if autocommit:
+                connection.autocommit = False
+            self.closeConnection(connection, cursor)
+
+    def stream(self, query, args=None, fetch_size=FETCH_SIZE):
+        """Generate the rows of a query through a server-side cursor,
+        fetching *fetch_size* rows per round trip. The connection is
+        held until the generator is exhausted or closed."""
+        name = 'tournament_stream_%d' % next(self.__cursorNames)
+        connection, cursor = self.connect(name)
+        try:
+            cursor.itersize = fetch_size
+            cursor.execute(query, args)
+            for row in cursor:
+                yield row
+        finally:
+            self.closeConnection(connection, cursor)
+
+    def createTournament(self, name):
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute("SELECT create_tournament(%s)", (name,))
+            tournament_id = cursor.fetchone()[0]
+        return tournament_id
+
+    def listTournaments(self):
+        with self.cursor() as cursor:
+            cursor.execute("SELECT id, name FROM tournaments ORDER BY id")
+            tournaments = cursor.fetchall()
+        return tournaments
+
+    def dropTournament(self, tournament_id):
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute("SELECT drop_tournament(%s)", (tournament_id,))
+
+    def deleteMatches(self):
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute("DELETE FROM matches WHERE tournament_id = %s",
+                           (self.tournamentId,))
+            cursor.execute(RESET_RATINGS, (self.tournamentId,))
+            cursor.execute("DELETE FROM draws WHERE tournament_id = %s",
+                           (self.tournamentId,))
+
+    def deletePlayers(self):
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute("DELETE FROM players WHERE tournament_id = %s",
+                           (self.tournamentId,))
+            cursor.execute("DELETE FROM draws WHERE tournament_id = %s",
+                           (self.tournamentId,))
+
+    def countPlayers(self):
+        with self.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM players WHERE tournament_id = %s",
+                (self.tournamentId,)
+            )
+            count = cursor.fetchone()[0]
+        return count
+
+    def registerPlayer(self, name):
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute(
+                "INSERT INTO players (tournament_id, name) VALUES (%s, %s) "
+                "RETURNING id", (self.tournamentId, name)
+            )
+            player_id = cursor.fetchone()[0]
+        return player_id
+
+    def registerPlayers(self, players):
+        player_ids = []
+        players = iter(players)
+        with self.cursor(commit_on_exit=True) as cursor:
+            while True:
+                chunk = list(itertools.islice(players, COPY_SIZE))
+                if not chunk:
+                    break
+
+                # Give the IDs out in input order, so that they are
+                # known without the COPY having to return anything.
+                cursor.execute(RESERVE_PLAYER_IDS, (len(chunk),))
+                reserved = sorted(cursor.fetchall())
+
+                buffer = CopyBuffer()
+                writer = csv.writer(buffer)
+                for (name, date), (player_id, today) in zip(chunk, reserved):
+                    writer.writerow([player_id, self.tournamentId, name,
+                                     date or today])
+                buffer.seek(0)
+                cursor.copy_expert(
+                    "COPY players "
+                    "(id, tournament_id, name, registration_date) "
+                    "FROM STDIN WITH (FORMAT csv)",
+                    buffer
+                )
+                player_ids.extend(player_id for (player_id, today) in reserved)
+
+        return player_ids
+
+    def getPlayerID(self, name):
+        with self.cursor() as cursor:
+            cursor.execute(
+                "SELECT id FROM players "
+                "WHERE tournament_id = %s AND name = %s",
+                (self.tournamentId, name)
+            )
+            player_id = cursor.fetchone()
+        return player_id
+
+    def playerStandings(self):
+        with self.cursor() as cursor:
+            cursor.execute(PLAYER_STANDINGS, (self.tournamentId,))
+            standings = cursor.fetchall()
+
+        return standings
+
+    def standingsPage(self, after=None, limit=20):
+        with self.cursor() as cursor:
+            if after is None:
+                cursor.execute(TOP_STANDINGS, (self.tournamentId, limit))
+            else:
+                cursor.execute(STANDINGS_PAGE, pageArguments(
+                    self.tournamentId, after, limit))
+            page = cursor.fetchall()
+
+        return page
+
+    def rebuildStandings(self):
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute("SELECT rebuild_standings(%s)",
+                           (self.tournamentId,))
+
+    def verifyStandings(self):
+        with self.cursor() as cursor:
+            cursor.execute(VERIFY_STANDINGS,
+                           (self.tournamentId, self.tournamentId))
+            drifted = [player_id for (player_id,) in cursor.fetchall()]
+
+        return drifted
+
+    def reportMatch(self, player_1, player_2, player_1_result,
+                    player_2_result):
+        try:
+            with self.cursor(commit_on_exit=True, autocommit=True) as cursor:
+                cursor.execute(REPORT_MATCH, (
+                    self.tournamentId, player_1, player_2, player_1_result,
+                    player_2_result,
+                ))
+                game_id = cursor.fetchone()[0]
+        except psycopg2.DataError as e:
+            if e.pgcode != psycopg2.errorcodes.INVALID_PARAMETER_VALUE:
+                raise
+            raise ValueError(e.diag.message_primary)
+
+        return game_id
+
+    def reportRound(self, results):
+        if not results:
+            return []
+
+        rows = [(order, self.tournamentId) + tuple(result)
+                for order, result in enumerate(results)]
+
+        with self.cursor(commit_on_exit=True) as cursor:
+            game_ids = psycopg2.extras.execute_values(
+                cursor,
+                REPORT_ROUND,
+                rows,
+                template=REPORT_ROUND_TEMPLATE,
+                page_size=len(rows),
+                fetch=True
+            )
+
+        return [game_id for (game_id,) in game_ids]
+
+    def playerRatings(self, player_ids=None):
+        with self.cursor() as cursor:
+            if player_ids is None:
+                cursor.execute(PLAYER_RATINGS, (self.tournamentId,))
+            else:
+                cursor.execute(LOCK_PLAYER_RATINGS,
+                               (self.tournamentId, list(player_ids)))
+            ratings = cursor.fetchall()
+
+        return ratings
+
+    def updateRatings(self, ratings):
+        rows = [(player_id, rating, deviation)
+                for player_id, (rating, deviation) in ratings.items()]
+        if not rows:
+            return
+
+        with self.cursor(commit_on_exit=True) as cursor:
+            psycopg2.extras.execute_values(
+                cursor,
+                UPDATE_RATINGS,
+                rows,
+                template=UPDATE_RATINGS_TEMPLATE,
+                page_size=UPDATE_SIZE
+            )
+
+    def matchesHistory(self):
+        with self.cursor() as cursor:
+            cursor.execute(
+                "SELECT player_1, player_2 FROM matches "
+                "WHERE tournament_id = %s", (self.tournamentId,)
+            )
+            history = cursor.fetchall()
+
+        return history
+
+    def streamStandings(self, fetch_size=FETCH_SIZE):
+        return self.stream(PLAYER_STANDINGS, (self.tournamentId,),
+                           fetch_size)
+
+    def streamMatches(self, fetch_size=FETCH_SIZE):
+        return self.stream(STREAM_MATCHES, (self.tournamentId,), fetch_size)
+
+    def changesSince(self, player_id, match_id):
+        # The three queries read the same snapshot, so that the counts
+        # only disagree with the changes when something was deleted.
+        # Inside a session, they read the snapshots of its transaction.
+        with self.cursor() as cursor:
+            if self.currentSession() is None:
+                cursor.execute(SNAPSHOT)
+            cursor.execute(CHANGED_MATCHES, (self.tournamentId, match_id))
+            matches = cursor.fetchall()
+            cursor.execute(CHANGED_PLAYERS, (self.tournamentId, player_id))
+            players = cursor.fetchall()
+            cursor.execute(COUNTS, (self.tournamentId, self.tournamentId))
+            counts = cursor.fetchone()
+
+        return players, matches, counts
+
+    def pairingSnapshot(self):
+        with self.cursor() as cursor:
+            cursor.execute("SELECT * FROM pairing_snapshot(%s)",
+                           (self.tournamentId,))
+            rows = cursor.fetchall()
+
+        return snapshotFromRows(rows)
+
+    def drawnPairings(self, options):
+        with self.cursor() as cursor:
+            cursor.execute(DRAWN_PAIRINGS, {'tournament': self.tournamentId,
+                                            'options': options})
+            rows = cursor.fetchall()
+
+        return drawFromRows(rows)
+
+    @contextlib.contextmanager
+    def drawLock(self):
+        # The advisory lock is released when the session's transaction
+        # ends, whether it is committed or rolled back.
+        with self.session():
+            with self.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)",
+                               (DRAW_LOCK, self.tournamentId))
+            yield self
+
+    def saveDraw(self, key, options, pairings):
+        rows = drawRows(self.tournamentId, key, options, pairings)
+        if not rows:
+            return
+
+        with self.cursor(commit_on_exit=True) as cursor:
+            psycopg2.extras.execute_values(cursor, SAVE_DRAW, rows,
+                                           page_size=UPDATE_SIZE)
+
+    def deleteDraws(self):
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute("DELETE FROM draws WHERE tournament_id = %s",
+                           (self.tournamentId,))
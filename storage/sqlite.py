@@ -0,0 +1,703 @@
+#!/usr/bin/env python
+#
+# SQLite storage backend: the whole tournament lives in a single file.
+
+from __future__ import absolute_import
+
+import contextlib
+import sqlite3
+import threading
+
+import instrumentation
+from ratings import DEFAULT_RATING, DEFAULT_DEVIATION
+from storage import Backend, FETCH_SIZE, drawFromRows, drawRows
+from storage import matchError, pageArguments
+
+
+# Same model as tournament.sql, with row-level triggers
+# keeping the standings table up to date. SQLite has no partitions:
+# tournaments are told apart by indexed tournament_id columns.
+SCHEMA = """
+PRAGMA foreign_keys = ON;
+
+CREATE TABLE IF NOT EXISTS tournaments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+INSERT OR IGNORE INTO tournaments (id, name) VALUES (1, 'Default tournament');
+
+CREATE TABLE IF NOT EXISTS players (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tournament_id INTEGER NOT NULL DEFAULT 1
+        REFERENCES tournaments(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    registration_date DATE DEFAULT CURRENT_DATE,
+    rating REAL NOT NULL DEFAULT 1500,
+    rating_deviation REAL NOT NULL DEFAULT 350
+    );
+
+CREATE INDEX IF NOT EXISTS players_tournament ON players (tournament_id, id);
+CREATE INDEX IF NOT EXISTS players_rating
+    ON players (tournament_id, rating DESC, id);
+
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tournament_id INTEGER NOT NULL DEFAULT 1,
+    time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    player_1 INTEGER,
+    -- If player_2 has id = 0, means that it's been a skipped round
+    player_2 INTEGER DEFAULT 0
+    );
+
+CREATE INDEX IF NOT EXISTS matches_tournament ON matches (tournament_id, id);
+CREATE INDEX IF NOT EXISTS matches_players ON matches (player_1, player_2);
+
+CREATE TABLE IF NOT EXISTS outcomes (
+    match_id INTEGER REFERENCES matches(id) ON DELETE CASCADE,
+    player INTEGER NOT NULL,
+    player_outcome REAL,
+    PRIMARY KEY (match_id, player),
+    CHECK (player_outcome IN (0, 0.5, 1))
+    );
+
+CREATE INDEX IF NOT EXISTS outcomes_player ON outcomes (player);
+
+CREATE TABLE IF NOT EXISTS standings (
+    player_id INTEGER PRIMARY KEY REFERENCES players(id) ON DELETE CASCADE,
+    tournament_id INTEGER NOT NULL,
+    won INTEGER NOT NULL DEFAULT 0,
+    tied INTEGER NOT NULL DEFAULT 0,
+    played INTEGER NOT NULL DEFAULT 0,
+    score REAL NOT NULL DEFAULT 0
+    );
+
+CREATE INDEX IF NOT EXISTS standings_ranking
+    ON standings (tournament_id, won DESC, tied DESC, player_id);
+
+CREATE VIEW IF NOT EXISTS computed_standings AS
+    SELECT
+    p.id AS player_id,
+    p.tournament_id,
+    SUM(CASE WHEN o.player_outcome = 1 THEN 1 ELSE 0 END) AS won,
+    SUM(CASE WHEN o.player_outcome = 0.5 THEN 1 ELSE 0 END) AS tied,
+    COUNT(o.player) AS played,
+    COALESCE(SUM(o.player_outcome), 0) AS score
+    FROM players AS p
+    LEFT JOIN outcomes AS o ON p.id = o.player
+    GROUP BY p.id;
+
+CREATE TABLE IF NOT EXISTS draws (
+    tournament_id INTEGER NOT NULL
+        REFERENCES tournaments(id) ON DELETE CASCADE,
+    players INTEGER NOT NULL,
+    matches INTEGER NOT NULL,
+    options TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    player_1 INTEGER NOT NULL,
+    name_1 TEXT NOT NULL,
+    player_2 INTEGER NOT NULL DEFAULT 0,
+    name_2 TEXT,
+    PRIMARY KEY (tournament_id, players, matches, options, position)
+    );
+
+CREATE TRIGGER IF NOT EXISTS players_standings
+    AFTER INSERT ON players
+    BEGIN
+        INSERT INTO standings (player_id, tournament_id)
+        VALUES (NEW.id, NEW.tournament_id);
+    END;
+
+CREATE TRIGGER IF NOT EXISTS outcomes_inserted_standings
+    AFTER INSERT ON outcomes
+    BEGIN
+        UPDATE standings SET
+        won = won + (NEW.player_outcome = 1),
+        tied = tied + (NEW.player_outcome = 0.5),
+        played = played + 1,
+        score = score + NEW.player_outcome
+        WHERE player_id = NEW.player;
+    END;
+
+CREATE TRIGGER IF NOT EXISTS outcomes_deleted_standings
+    AFTER DELETE ON outcomes
+    BEGIN
+        UPDATE standings SET
+        won = won - (OLD.player_outcome = 1),
+        tied = tied - (OLD.player_outcome = 0.5),
+        played = played - 1,
+        score = score - OLD.player_outcome
+        WHERE player_id = OLD.player;
+    END;
+"""
+
+
+PLAYER_STANDINGS = """SELECT
+    players.id,
+    players.name,
+    standings.won,
+    standings.tied,
+    standings.played
+    FROM standings
+    JOIN players ON players.id = standings.player_id
+    WHERE standings.tournament_id = ?
+    ORDER BY
+    standings.won DESC,
+    standings.tied DESC,
+    standings.player_id"""
+
+TOP_STANDINGS = PLAYER_STANDINGS + """
+    LIMIT ?"""
+
+# See storage.postgres.STANDINGS_PAGE.
+STANDINGS_PAGE = """SELECT
+    players.id,
+    players.name,
+    page.won,
+    page.tied,
+    page.played
+    FROM (
+        SELECT * FROM (
+            SELECT player_id, won, tied, played FROM standings
+            WHERE tournament_id = :tournament
+            AND won = :won AND tied = :tied AND player_id > :player
+            ORDER BY player_id
+            LIMIT :limit)
+        UNION ALL
+        SELECT * FROM (
+            SELECT player_id, won, tied, played FROM standings
+            WHERE tournament_id = :tournament
+            AND (won < :won OR (won = :won AND tied < :tied))
+            ORDER BY won DESC, tied DESC, player_id
+            LIMIT :limit)
+    ) AS page
+    JOIN players ON players.id = page.player_id
+    ORDER BY page.won DESC, page.tied DESC, page.player_id
+    LIMIT :limit"""
+
+# See storage.postgres.DRAWN_PAIRINGS.
+DRAWN_PAIRINGS = """SELECT
+    counts.players,
+    counts.matches,
+    draws.player_1,
+    draws.name_1,
+    draws.player_2,
+    draws.name_2
+    FROM (
+        SELECT
+        (SELECT COUNT(*) FROM players WHERE tournament_id = :tournament)
+            AS players,
+        (SELECT COUNT(*) FROM matches WHERE tournament_id = :tournament)
+            AS matches
+    ) AS counts
+    LEFT JOIN draws
+    ON draws.tournament_id = :tournament
+    AND draws.players = counts.players
+    AND draws.matches = counts.matches
+    AND draws.options = :options
+    ORDER BY draws.position"""
+
+# Records a match unless a player isn't registered in the tournament
+# or the players have already met, see report_match() in tournament.sql.
+# Checks and insert are one statement, under the write lock of the file,
+# so that two scorers entering the same board can't both get through.
+INSERT_MATCH = """INSERT INTO matches (tournament_id, player_1, player_2)
+    SELECT :tournament, :player_1, :player_2
+    WHERE (SELECT COUNT(*) FROM players
+           WHERE tournament_id = :tournament
+           AND id IN (:player_1, :player_2))
+        = CASE WHEN :player_2 = 0 THEN 1 ELSE 2 END
+    AND NOT EXISTS (
+        SELECT 1 FROM matches
+        WHERE tournament_id = :tournament
+        AND ((player_1 = :player_1 AND player_2 = :player_2)
+        OR (player_1 = :player_2 AND player_2 = :player_1)))"""
+
+# Player IDs sent with each query by playerRatings().
+PARAMETERS_SIZE = 500
+
+# Seconds drawLock() waits for the draw of another caller.
+DRAW_TIMEOUT = 600.0
+
+
+class SQLiteBackend(Backend):
+
+    """Store the tournament inside a SQLite database file.
+
+    Each thread gets its own connection to the file. With the special
+    ':memory:' name every thread would see a different database, so it
+    is only suitable for single-threaded use.
+    """
+
+    def __init__(self, database='tournament.db'):
+        """
+        Args:
+          database: path of the SQLite database file.
+        """
+        self.database = database
+        self.__local = threading.local()
+        self.__connections = []
+        self.__connectionsLock = threading.Lock()
+        # drawLock() of a ':memory:' database, which has no file to put
+        # the lock next to.
+        self.__drawLock = threading.Lock()
+
+        self.__connection().executescript(SCHEMA)
+
+    def __connection(self):
+        """Returns the connection of the current thread,
+        opening it if needed."""
+        connection = getattr(self.__local, 'connection', None)
+        if connection is None:
+            # Each connection is only used by its own thread,
+            # but close() may be called from any of them.
+            connection = sqlite3.connect(self.database,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA foreign_keys = ON")
+            self.__local.connection = connection
+            with self.__connectionsLock:
+                self.__connections.append(connection)
+        return connection
+
+    def close(self):
+        with self.__connectionsLock:
+            for connection in self.__connections:
+                connection.close()
+            self.__connections = []
+        self.__local = threading.local()
+
+    def __inSession(self):
+        return getattr(self.__local, 'depth', 0) > 0
+
+    @contextlib.contextmanager
+    def session(self):
+        connection = self.__connection()
+        depth = getattr(self.__local, 'depth', 0)
+        self.__local.depth = depth + 1
+        try:
+            yield self
+            if depth == 0:
+                connection.commit()
+        except BaseException:
+            if depth == 0:
+                connection.rollback()
+            raise
+        finally:
+            self.__local.depth = depth
+
+    @contextlib.contextmanager
+    def cursor(self, commit_on_exit=False):
+        """Context manager yielding a cursor on the thread's connection.
+        Outside of a session, a failure rolls the transaction back.
+
+        Args:
+          commit_on_exit: commit the transaction when the block succeeds,
+            unless a session is open.
+        """
+        connection = self.__connection()
+        cursor = connection.cursor()
+        try:
+            if instrumentation.enabled():
+                yield instrumentation.CountingCursor(cursor)
+            else:
+                yield cursor
+            if commit_on_exit and not self.__inSession():
+                connection.commit()
+        except BaseException:
+            if not self.__inSession():
+                connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def createTournament(self, name):
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute("INSERT INTO tournaments (name) VALUES (?)",
+                           (name,))
+            tournament_id = cursor.lastrowid
+        return tournament_id
+
+    def listTournaments(self):
+        with self.cursor() as cursor:
+            cursor.execute("SELECT id, name FROM tournaments ORDER BY id")
+            tournaments = cursor.fetchall()
+        return tournaments
+
+    def dropTournament(self, tournament_id):
+        # Players go first, so that deleting the outcomes
+        # has no standings left to update.
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute("DELETE FROM tournaments WHERE id = ?",
+                           (tournament_id,))
+            cursor.execute("DELETE FROM matches WHERE tournament_id = ?",
+                           (tournament_id,))
+
+    def deleteMatches(self):
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute("DELETE FROM matches WHERE tournament_id = ?",
+                           (self.tournamentId,))
+            cursor.execute(
+                "UPDATE players SET rating = ?, rating_deviation = ? "
+                "WHERE tournament_id = ?",
+                (DEFAULT_RATING, DEFAULT_DEVIATION, self.tournamentId)
+            )
+            cursor.execute("DELETE FROM draws WHERE tournament_id = ?",
+                           (self.tournamentId,))
+
+    def deletePlayers(self):
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute("DELETE FROM players WHERE tournament_id = ?",
+                           (self.tournamentId,))
+            cursor.execute("DELETE FROM draws WHERE tournament_id = ?",
+                           (self.tournamentId,))
+
+    def countPlayers(self):
+        with self.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM players WHERE tournament_id = ?",
+                (self.tournamentId,)
+            )
+            count = cursor.fetchone()[0]
+        return count
+
+    def registerPlayer(self, name):
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute(
+                "INSERT INTO players (tournament_id, name) VALUES (?, ?)",
+                (self.tournamentId, name)
+            )
+            player_id = cursor.lastrowid
+        return player_id
+
+    def registerPlayers(self, players):
+        player_ids = []
+        with self.cursor(commit_on_exit=True) as cursor:
+            for (name, date) in players:
+                cursor.execute(
+                    "INSERT INTO players "
+                    "(tournament_id, name, registration_date) "
+                    "VALUES (?, ?, COALESCE(?, CURRENT_DATE))",
+                    (self.tournamentId, name, date)
+                )
+                player_ids.append(cursor.lastrowid)
+        return player_ids
+
+    def getPlayerID(self, name):
+        with self.cursor() as cursor:
+            cursor.execute(
+                "SELECT id FROM players WHERE tournament_id = ? AND name = ?",
+                (self.tournamentId, name)
+            )
+            player_id = cursor.fetchone()
+        return player_id
+
+    def playerStandings(self):
+        with self.cursor() as cursor:
+            cursor.execute(PLAYER_STANDINGS, (self.tournamentId,))
+            standings = cursor.fetchall()
+
+        return standings
+
+    def standingsPage(self, after=None, limit=20):
+        with self.cursor() as cursor:
+            if after is None:
+                cursor.execute(TOP_STANDINGS, (self.tournamentId, limit))
+            else:
+                cursor.execute(STANDINGS_PAGE, pageArguments(
+                    self.tournamentId, after, limit))
+            page = cursor.fetchall()
+
+        return page
+
+    def rebuildStandings(self):
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute("DELETE FROM standings WHERE tournament_id = ?",
+                           (self.tournamentId,))
+            cursor.execute(
+                """INSERT INTO standings
+                (player_id, tournament_id, won, tied, played, score)
+                SELECT player_id, tournament_id, won, tied, played, score
+                FROM computed_standings
+                WHERE tournament_id = ?""",
+                (self.tournamentId,)
+            )
+
+    def verifyStandings(self):
+        with self.cursor() as cursor:
+            cursor.execute(
+                """SELECT s.player_id
+                FROM standings AS s
+                LEFT JOIN computed_standings AS c ON s.player_id = c.player_id
+                WHERE s.tournament_id = :tournament
+                AND (c.player_id IS NULL
+                     OR s.won IS NOT c.won
+                     OR s.tied IS NOT c.tied
+                     OR s.played IS NOT c.played
+                     OR s.score IS NOT c.score)
+                UNION
+                SELECT c.player_id
+                FROM computed_standings AS c
+                LEFT JOIN standings AS s ON s.player_id = c.player_id
+                WHERE c.tournament_id = :tournament
+                AND s.player_id IS NULL
+                ORDER BY 1""",
+                {'tournament': self.tournamentId}
+            )
+            drifted = [player_id for (player_id,) in cursor.fetchall()]
+
+        return drifted
+
+    def __insertMatch(self, cursor, player_1, player_2, player_1_result,
+                      player_2_result):
+        if player_1 == player_2:
+            raise matchError(self.tournamentId, player_1, player_2,
+                             True, False)
+        arguments = {'tournament': self.tournamentId,
+                     'player_1': player_1, 'player_2': player_2}
+        cursor.execute(INSERT_MATCH, arguments)
+        if cursor.rowcount != 1:
+            raise self.__rejection(cursor, arguments)
+        game_id = cursor.lastrowid
+
+        outcomes = [(game_id, player_1, player_1_result)]
+        # if it's not a Bye-round we insert the second
+        # player outcome
+        if player_2 != 0:
+            outcomes.append((game_id, player_2, player_2_result))
+        cursor.executemany(
+            "INSERT INTO outcomes (match_id, player, player_outcome) VALUES (?, ?, ?)",  # noqa
+            outcomes
+        )
+
+        return game_id
+
+    def __rejection(self, cursor, arguments):
+        """Returns the ValueError telling why INSERT_MATCH recorded
+        nothing."""
+        cursor.execute(
+            "SELECT COUNT(*) FROM players WHERE tournament_id = :tournament "
+            "AND id IN (:player_1, :player_2)", arguments
+        )
+        registered = cursor.fetchone()[0] == (
+            1 if arguments['player_2'] == 0 else 2)
+        return matchError(arguments['tournament'], arguments['player_1'],
+                          arguments['player_2'], registered, True)
+
+    def reportMatch(self, player_1, player_2, player_1_result,
+                    player_2_result):
+        with self.cursor(commit_on_exit=True) as cursor:
+            game_id = self.__insertMatch(
+                cursor, player_1, player_2, player_1_result, player_2_result
+            )
+        return game_id
+
+    def reportRound(self, results):
+        with self.cursor(commit_on_exit=True) as cursor:
+            game_ids = [self.__insertMatch(cursor, *result)
+                        for result in results]
+        return game_ids
+
+    def playerRatings(self, player_ids=None):
+        query = ("SELECT id, name, rating, rating_deviation FROM players "
+                 "WHERE tournament_id = ?")
+        with self.cursor() as cursor:
+            if player_ids is None:
+                cursor.execute(query + " ORDER BY rating DESC, id",
+                               (self.tournamentId,))
+                return cursor.fetchall()
+
+            # Older SQLite versions take at most 999 parameters.
+            player_ids = list(player_ids)
+            ratings = []
+            for start in range(0, len(player_ids), PARAMETERS_SIZE):
+                chunk = player_ids[start:start + PARAMETERS_SIZE]
+                cursor.execute(
+                    query + " AND id IN (%s)" % ", ".join("?" * len(chunk)),
+                    [self.tournamentId] + chunk
+                )
+                ratings.extend(cursor.fetchall())
+
+        ratings.sort(key=lambda row: (-row[2], row[0]))
+        return ratings
+
+    def updateRatings(self, ratings):
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.executemany(
+                "UPDATE players SET rating = ?, rating_deviation = ? "
+                "WHERE id = ?",
+                [(rating, deviation, player_id)
+                 for player_id, (rating, deviation) in ratings.items()]
+            )
+
+    def matchesHistory(self):
+        with self.cursor() as cursor:
+            cursor.execute(
+                "SELECT player_1, player_2 FROM matches "
+                "WHERE tournament_id = ?", (self.tournamentId,)
+            )
+            history = cursor.fetchall()
+
+        return history
+
+    def stream(self, query, args=(), fetch_size=FETCH_SIZE):
+        """Generate the rows of a query, *fetch_size* at a time."""
+        with self.cursor() as cursor:
+            cursor.arraysize = fetch_size
+            cursor.execute(query, args)
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+
+    def streamStandings(self, fetch_size=FETCH_SIZE):
+        return self.stream(PLAYER_STANDINGS, (self.tournamentId,),
+                           fetch_size)
+
+    def streamMatches(self, fetch_size=FETCH_SIZE):
+        return self.stream(
+            """SELECT
+            m.id,
+            m.time,
+            m.player_1,
+            m.player_2,
+            o1.player_outcome,
+            o2.player_outcome
+            FROM matches AS m
+            LEFT JOIN outcomes AS o1
+            ON o1.match_id = m.id AND o1.player = m.player_1
+            LEFT JOIN outcomes AS o2
+            ON o2.match_id = m.id AND o2.player = m.player_2
+            WHERE m.tournament_id = ?
+            ORDER BY m.id""",
+            (self.tournamentId,),
+            fetch_size
+        )
+
+    def changesSince(self, player_id, match_id):
+        # The three queries run in one read transaction, which keeps
+        # writers out until it ends: the counts only disagree with the
+        # changes when something was deleted. Inside a session, they
+        # run in its transaction.
+        with self.cursor(commit_on_exit=True) as cursor:
+            if not self.__inSession():
+                cursor.execute("BEGIN")
+            cursor.execute(
+                """SELECT
+                m.id,
+                m.player_1,
+                m.player_2,
+                COALESCE(o1.player_outcome, 0),
+                COALESCE(o2.player_outcome, 0)
+                FROM matches AS m
+                LEFT JOIN outcomes AS o1
+                ON o1.match_id = m.id AND o1.player = m.player_1
+                LEFT JOIN outcomes AS o2
+                ON o2.match_id = m.id AND o2.player = m.player_2
+                WHERE m.tournament_id = ? AND m.id > ?
+                ORDER BY m.id""",
+                (self.tournamentId, match_id)
+            )
+            matches = cursor.fetchall()
+            cursor.execute(
+                "SELECT id, name FROM players "
+                "WHERE tournament_id = ? AND id > ? ORDER BY id",
+                (self.tournamentId, player_id)
+            )
+            players = cursor.fetchall()
+            cursor.execute(
+                "SELECT "
+                "(SELECT COUNT(*) FROM players WHERE tournament_id = :t), "
+                "(SELECT COUNT(*) FROM matches WHERE tournament_id = :t)",
+                {'t': self.tournamentId}
+            )
+            counts = cursor.fetchone()
+
+        return players, matches, counts
+
+    def pairingSnapshot(self):
+        # A single statement reads from a single snapshot of the file.
+        with self.cursor() as cursor:
+            cursor.execute(
+                """SELECT
+                players.id,
+                players.name,
+                standings.won,
+                standings.tied,
+                standings.played,
+                met.opponents
+                FROM standings
+                JOIN players ON players.id = standings.player_id
+                LEFT JOIN (
+                    SELECT player, group_concat(opponent) AS opponents
+                    FROM (
+                        SELECT player_1 AS player, player_2 AS opponent
+                        FROM matches WHERE tournament_id = :tournament
+                        UNION ALL
+                        SELECT player_2, player_1
+                        FROM matches
+                        WHERE tournament_id = :tournament AND player_2 <> 0
+                    )
+                    GROUP BY player
+                ) AS met ON met.player = players.id
+                WHERE standings.tournament_id = :tournament
+                ORDER BY
+                standings.won DESC,
+                standings.tied DESC,
+                standings.player_id""",
+                {'tournament': self.tournamentId}
+            )
+            rows = cursor.fetchall()
+
+        standings = []
+        opponents = {}
+        for row in rows:
+            standings.append(row[:5])
+            if row[5]:
+                opponents[row[0]] = set(int(i) for i in row[5].split(','))
+        return standings, opponents
+
+    def drawnPairings(self, options):
+        with self.cursor() as cursor:
+            cursor.execute(DRAWN_PAIRINGS, {'tournament': self.tournamentId,
+                                            'options': options})
+            rows = cursor.fetchall()
+
+        return drawFromRows(rows)
+
+    @contextlib.contextmanager
+    def drawLock(self):
+        # The write lock of a file of its own, next to the database:
+        # callers of every process wait for it, up to DRAW_TIMEOUT,
+        # while results are still written to the database. It covers
+        # the draws of every tournament of the file.
+        if self.database == ':memory:':
+            with self.__drawLock:
+                yield self
+            return
+
+        lock = sqlite3.connect(self.database + '-draws',
+                               timeout=DRAW_TIMEOUT, isolation_level=None,
+                               check_same_thread=False)
+        try:
+            lock.execute("BEGIN IMMEDIATE")
+            yield self
+        finally:
+            # Closing the connection ends its transaction.
+            lock.close()
+
+    def saveDraw(self, key, options, pairings):
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.executemany(
+                "INSERT OR IGNORE INTO draws (tournament_id, players, "
+                "matches, options, position, player_1, name_1, player_2, "
+                "name_2) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                drawRows(self.tournamentId, key, options, pairings)
+            )
+
+    def deleteDraws(self):
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute("DELETE FROM draws WHERE tournament_id = ?",
+                           (self.tournamentId,))
@@ -2,7 +2,70 @@
 #
 # Class for Swiss-system chess tournament drawing.
 
-import math
+import json
+import multiprocessing
+from array import array
+
+from instrumentation import instrumented
+from tiebreaks import TIEBREAKS, computeTiebreaks, rankingKey
+from weightedmatching import maxWeightMatching
+
+
+class InfeasibleRoundError(ValueError):
+
+    """Raised when no legal pairing can be drawn for a round,
+    i.e. every attempt leads to a rematch or to a second Bye-round.
+
+    Attributes:
+      unpaired: list of IDs of the players left out of the draw.
+      diagnostics: dictionary describing the state of the search.
+    """
+
+    def __init__(self, message, unpaired=(), diagnostics=None):
+        ValueError.__init__(self, message)
+        self.unpaired = list(unpaired)
+        self.diagnostics = diagnostics or {}
+
+
+def indexOpponents(history):
+    """Build the opponents index out of a matches history.
+
+    Args:
+      history: a list of tuples (id_1, id_2) of the matches played,
+        id_2 being 0 (or None) for a Bye-round.
+
+    Returns:
+      A dictionary mapping each player ID to the set of IDs
+      of the players he or she has already played against.
+      A Bye-round is recorded as an opponent with ID 0.
+    """
+    opponents = {}
+
+    for (player_1, player_2) in history:
+        if(player_2 == 0 or player_2 is None):
+            opponents.setdefault(player_1, set()).add(0)
+            continue
+        opponents.setdefault(player_1, set()).add(player_2)
+        opponents.setdefault(player_2, set()).add(player_1)
+
+    return opponents
+
+
+def sortByRating(standings, ratings):
+    """Rank the players with the same wins and ties by rating.
+
+    Args:
+      standings: a list of tuples like
+        (id, name, victories, ties, matches).
+      ratings: a dictionary mapping player IDs to ratings. Players
+        without one come last among those with the same score.
+
+    Returns:
+      The sorted list. Players with the same score and rating keep
+      their order.
+    """
+    return sorted(standings, key=lambda row: (
+        -row[2], -row[3], -ratings.get(row[0], float('-inf'))))
 
 
 class Draw():
@@ -10,7 +73,25 @@ class Draw():
     """This class helps us draw pairs for
     a Swiss-system chess tournament."""
 
-    def __init__(self, standings, history):
+    # Default budget of search steps per enrolled player.
+    BUDGET_PER_PLAYER = 1000
+
+    def __init__(self, standings, history=None, budget=None, opponents=None,
+                 ratings=None):
+        """
+        Args:
+          standings: a list of tuples like
+          (id, name, victories, ties, matches).
+          history: a list of tuples (id_1, id_2) of the matches played.
+          budget: maximum number of search steps, see BUDGET_PER_PLAYER.
+          opponents: the opponents index, as built by indexOpponents()
+            or returned by the pairingSnapshot() of the storage backends.
+            When given, history isn't needed.
+          ratings: optional dictionary mapping player IDs to ratings,
+            ranking the players with the same score, see sortByRating().
+        """
+        if ratings:
+            standings = sortByRating(standings, ratings)
         self.standings = []
         self.pairings = []
 
@@ -18,8 +99,8 @@ class Draw():
         # element we have to pair inside the loop.
         self.current_pair = []
 
-        # List containing already drawn players' ID.
-        self.alreadyDrawn = []
+        # Set containing already drawn players' ID.
+        self.alreadyDrawn = set()
 
         self.numberOfPlayers = len(standings)
         self.roundsPlayed = standings[0][4]
@@ -28,11 +109,27 @@ class Draw():
         self.__setTotalRounds(self.numberOfPlayers)
         self.__setStandings(standings)
 
-        # Store matches history inside a list of tuples (Id_1, Id_2).
-        self.history = history
+        # For each player ID, the set of IDs of the opponents
+        # he or she has already faced (0 for a Bye-round).
+        if opponents is None:
+            opponents = indexOpponents(history or ())
+        self.opponents = opponents
         # Store IDs for players who have already had a bye round.
         self.alreadyBye = self.__getPlayersWithByeRound()
 
+        # Maximum amount of work the pairing search is allowed to do,
+        # counted in steps (a player visited, or a pair tried for a swap).
+        if budget is None:
+            budget = self.BUDGET_PER_PLAYER * max(1, self.numberOfPlayers)
+        self.budget = budget
+        self.steps = 0
+        self.passes = 0
+
+        # Counters of the search, see counters().
+        self.backtracks = 0
+        self.swapAttempts = 0
+        self.maxDelta = 0
+
     def __setStandings(self, standings):
         """Create an alternative ranking for later computations.
         Each victory gives 3 points.
@@ -47,38 +144,35 @@ class Draw():
             aggregate_standing = (w * 3) + t
             self.standings.append((i, n, aggregate_standing))
 
-    def __setTotalRounds(self, n_of_players, add=0):
+        # Lookup tables from player ID to standing row and aggregate score.
+        self.playersById = {p[0]: p for p in self.standings}
+        self.scoresById = {p[0]: p[2] for p in self.standings}
+
+    def __setTotalRounds(self, n_of_players):
         """Find the exact number of rounds that must be played
-        throughout the tournament.
+        throughout the tournament: the exponent of the smallest power
+        of two holding every player.
 
         Args:
           n_of_players: number of players enrolled.
-          add: the positive integer to be added to n_of_players in order
-            to make that amount an exact power of two.
         """
         if n_of_players <= 1:
             self.totalRounds = 0
-            return
-
-        rounds = math.log((n_of_players + add), 2)
-
-        if(rounds.is_integer()):
-            self.totalRounds = rounds
         else:
-            self.__setTotalRounds(n_of_players, (add + 1))
+            self.totalRounds = (n_of_players - 1).bit_length()
 
     def __getPlayersWithByeRound(self):
         """Look for players who have already been assigned to the Bye-Round.
 
         Returns:
-          A list of integers containing the IDs of those players.
+          A set of integers containing the IDs of those players.
         """
-        players_with_bye_round = []
+        players_with_bye_round = set()
 
         if(self.numberOfPlayers % 2 != 0):
-            for (player_1, player_2) in self.history:
-                if(player_2 == 0):
-                    players_with_bye_round.append(player_1)
+            for player, opponents in self.opponents.items():
+                if(0 in opponents):
+                    players_with_bye_round.add(player)
 
         return players_with_bye_round
 
@@ -92,7 +186,7 @@ class Draw():
           *args: Player IDs.
         """
         for player in args:
-            self.alreadyDrawn.append(player)
+            self.alreadyDrawn.add(player)
         self.current_pair = []
 
     def __alreadyMatchedCheck(self, id_1, id_2):
@@ -107,12 +201,7 @@ class Draw():
           Boolean
         """
 
-        if((id_1, id_2) in self.history):
-            return True
-        if((id_2, id_1) in self.history):
-            return True
-
-        return False
+        return id_2 in self.opponents.get(id_1, ())
 
     def __getMatchables(self, id_1):
         """Look for players that hasn't been drawn yet and that are
@@ -126,21 +215,67 @@ class Draw():
           A list of integers containing potentially-valid-opponent IDs.
         """
 
-        players_ids = [row[0] for row in self.standings]
-        not_drawn_players_ids = list(
-            set(players_ids) - set(self.alreadyDrawn)
-        )
-
         matchables = []
 
-        for p_id in not_drawn_players_ids:
+        for (p_id, name, score) in self.standings:
+            if(p_id in self.alreadyDrawn):
+                continue
             if(not self.__alreadyMatchedCheck(id_1, p_id) and id_1 != p_id):
                 matchables.append(p_id)
                 break
 
         return matchables
 
-    def __swapWithPreviousPairs(self, player, delta=1):
+    def __spend(self, steps=1):
+        """Charge some steps of work to the search budget.
+
+        Raises:
+          InfeasibleRoundError: if the budget is exhausted.
+        """
+        self.steps += steps
+        if(self.steps > self.budget):
+            raise self.__infeasible(
+                "The pairing search ran out of its budget of %d steps"
+                % self.budget
+            )
+
+    def __infeasible(self, reason):
+        """Build the error raised when the round can't be drawn,
+        describing the state of the search.
+
+        Args:
+          reason: a short description of why the search stopped.
+
+        Returns:
+          An InfeasibleRoundError.
+        """
+        unpaired = [p[0] for p in self.standings
+                    if p[0] not in self.alreadyDrawn]
+
+        # For each player left out of the draw, how many opponents
+        # could still legally be paired with him or her.
+        candidates = {}
+        for p_id in unpaired:
+            candidates[p_id] = len([
+                other for other in unpaired
+                if other != p_id and not self.__alreadyMatchedCheck(p_id, other)  # noqa
+            ])
+
+        diagnostics = {
+            'players': len(self.standings),
+            'drawn': len(self.alreadyDrawn),
+            'pairings': len(self.pairings),
+            'unpaired': unpaired,
+            'candidates': candidates,
+            'alreadyBye': sorted(self.alreadyBye),
+            'passes': self.passes,
+            'steps': self.steps,
+            'budget': self.budget,
+        }
+
+        return InfeasibleRoundError(reason, unpaired, diagnostics)
+
+    def __swapWithPreviousPairs(self, player):
         """This function gets called for tournaments with an odd number of
         enrolled players. If the player who was left out of the draw can't
         be assigned with a Bye-Round (again),
@@ -165,64 +300,75 @@ class Draw():
         If this check fails, we go backwards
         to the previous pair and do the same try.
         If all the loop fails, we increase *delta* by 1 and
-        we try this whole process again, calling this method recursively.
+        we try this whole process again, until *delta* covers
+        the whole ranking.
 
         Args:
           player: the player ID that has to be paired with a physical player.
-          delta: the desired ranking gap for making the new pair.
+
+        Raises:
+          InfeasibleRoundError: if no pair can be swapped, whatever the delta.
         """
 
-        idStanding = {p[0]: p[2] for p in self.standings}
+        idStanding = self.scoresById
 
-        found_swap = False
-        element_to_be_swapped = None
+        # Beyond this gap every pair has already been taken into account.
+        max_delta = max(idStanding.values()) - min(idStanding.values())
 
-        for i, (pair) in enumerate(self.pairings):
+        delta = 1
+        while True:
 
-            if(abs(idStanding[pair[0]] - idStanding[player[0]]) <= delta):
+            self.maxDelta = max(self.maxDelta, delta)
 
-                if(not self.__alreadyMatchedCheck(pair[0], player[0]) and pair[2] not in self.alreadyBye):  # noqa
-                    element_to_be_swapped = (pair[2], pair[3])
-                    element_to_be_kept = (pair[0], pair[1])
-                    self.pairings.pop(i)
-                    self.pairings.append(
-                        element_to_be_kept + (player[0], player[1])
-                    )
-                    self.__reset(player[0])
-                    found_swap = True
-                    break
-
-            if(abs(idStanding[pair[2]] - idStanding[player[0]]) <= delta):
-
-                if(not self.__alreadyMatchedCheck(pair[2], player[0]) and pair[0] not in self.alreadyBye):  # noqa
-                    element_to_be_swapped = (pair[0], pair[1])
-                    element_to_be_kept = (pair[2], pair[3])
-                    self.pairings.pop(i)
-                    self.pairings.append(
-                        (player[0], player[1]) + element_to_be_kept
+            for i, (pair) in enumerate(self.pairings):
+                self.__spend()
+                self.swapAttempts += 1
+
+                if(abs(idStanding[pair[0]] - idStanding[player[0]]) <= delta):
+
+                    if(not self.__alreadyMatchedCheck(pair[0], player[0]) and pair[2] not in self.alreadyBye):  # noqa
+                        element_to_be_swapped = (pair[2], pair[3])
+                        element_to_be_kept = (pair[0], pair[1])
+                        self.pairings.pop(i)
+                        self.pairings.append(
+                            element_to_be_kept + (player[0], player[1])
+                        )
+                        break
+
+                if(abs(idStanding[pair[2]] - idStanding[player[0]]) <= delta):
+
+                    if(not self.__alreadyMatchedCheck(pair[2], player[0]) and pair[0] not in self.alreadyBye):  # noqa
+                        element_to_be_swapped = (pair[0], pair[1])
+                        element_to_be_kept = (pair[2], pair[3])
+                        self.pairings.pop(i)
+                        self.pairings.append(
+                            (player[0], player[1]) + element_to_be_kept
+                        )
+                        break
+            else:
+                # No pair could be swapped with this delta
+                if(delta >= max_delta):
+                    raise self.__infeasible(
+                        "No pair can be swapped with player %s, "
+                        "who has already had the Bye-round" % player[0]
                     )
-                    self.__reset(player[0])
-                    found_swap = True
-                    break
+                delta += 1
+                continue
 
-        # Append the bye round for element_to_be_swapped
-        if(element_to_be_swapped is not None and found_swap):
+            # Append the bye round for element_to_be_swapped
+            self.__reset(player[0])
             self.pairings.append(
                 element_to_be_swapped + (0, None)
             )
-        else:
-            new_delta = delta + 1
-            self.__swapWithPreviousPairs(player, new_delta)
+            return
 
-    def __draw(self):
-        "The method where we actually make the pairings."
-
-        # If we reach the expected number or rounds
-        # to be played, no further pairing gets done.
-        if(self.totalRounds == self.roundsPlayed):
-            return False
+    def __drawPass(self):
+        """Walk the standings once, pairing every player
+        that hasn't been drawn yet."""
 
         for player in self.standings:
+            self.__spend()
+
             # If the player hasn't been already drawn
             if (player[0] not in self.alreadyDrawn):  # noqa
 
@@ -257,18 +403,23 @@ class Draw():
                         # Let's check if also the next elements have
                         # already played with the current player
                         matchables = self.__getMatchables(player[0])
-                        if(len(matchables)):
-                            # If there are still some matchables, no worries
+                        if(len(matchables) or not len(self.pairings)):
+                            # If there are still some matchables, no worries.
+                            # Without a previous pair there is nothing
+                            # to destroy either: wait for the next pass.
                             pass
                         else:
                             # Destroy the previous pair
                             # and mix those players with the current player
+                            self.backtracks += 1
                             previous_pair = self.pairings.pop()
                             self.alreadyDrawn.remove(previous_pair[0])
-                            previous_player = [item for item in self.standings if previous_pair[2] in item]  # noqa
+                            previous_player = self.playersById[
+                                previous_pair[2]
+                            ]
 
                             self.pairings.append(
-                                (previous_player[0][0], previous_player[0][1],
+                                (previous_player[0], previous_player[1],
                                  player[0], player[1])
                             )
                             self.__reset(player[0])
@@ -280,11 +431,56 @@ class Draw():
                         )
                         self.__reset(self.current_pair[0][0], player[0])
 
+    def __draw(self):
+        """The method where we actually make the pairings.
+
+        Passes over the standings are repeated until every player
+        has been drawn. The search is bounded: it stops as soon as a pass
+        leaves the draw exactly as it found it, or when the budget of
+        steps is exhausted.
+
+        Raises:
+          InfeasibleRoundError: if the round can't be drawn.
+        """
+
+        # If we reach the expected number or rounds
+        # to be played, no further pairing gets done.
+        if(self.totalRounds == self.roundsPlayed):
+            return False
+
         # If some player was left out of the draw,
         # we try it again
-        if(len(self.alreadyDrawn) < len(self.standings)):
-            self.__draw()
+        while(len(self.alreadyDrawn) < len(self.standings)):
+            state = (
+                len(self.alreadyDrawn),
+                list(self.pairings),
+                list(self.current_pair)
+            )
+
+            self.passes += 1
+            self.__drawPass()
+
+            if(state == (len(self.alreadyDrawn), self.pairings, self.current_pair)):  # noqa
+                # Another pass would do exactly the same
+                raise self.__infeasible(
+                    "A pass over the standings couldn't pair anybody else"
+                )
 
+    def counters(self):
+        """Returns the counters of the pairing search:
+        passes over the standings, steps charged to the budget,
+        backtracks (previous pairs destroyed), swap attempts
+        and maximum delta reached while swapping."""
+        return {
+            'players': self.numberOfPlayers,
+            'passes': self.passes,
+            'steps': self.steps,
+            'backtracks': self.backtracks,
+            'swapAttempts': self.swapAttempts,
+            'maxDelta': self.maxDelta,
+        }
+
+    @instrumented('Draw.getPairings', counters=lambda draw: draw.counters())
     def getPairings(self):
         """
         Returns:
@@ -293,6 +489,599 @@ class Draw():
             name1: the first player's name
             id2: the second player's unique id
             name2: the second player's name
+
+        Raises:
+          InfeasibleRoundError: if no legal pairing could be found.
         """
         self.__draw()
         return self.pairings
+
+
+class WeightedDraw(Draw):
+
+    """This class draws pairs for a Swiss-system chess tournament
+    by solving a maximum weight matching over the players.
+
+    Each player is a vertex of the graph, and two players are connected
+    unless they have already played against each other. The lower the
+    gap between their aggregate scores, the heavier the edge.
+    With an odd number of players, an extra vertex stands for the
+    Bye-round, connected only to players who haven't had one yet.
+
+    The matching is solved with Edmonds' blossom algorithm, which
+    always finds a complete pairing when one exists and keeps
+    the sum of squared score gaps to a minimum.
+
+    By default each player is only connected to the next WINDOW players
+    in the standings, and the window gets doubled until a complete
+    pairing is found. The dense graph (window=None) costs O(n^3): about
+    a second for 256 players and more than a minute for 1024, so it is
+    only meant for fields of a few hundred players.
+    """
+
+    # Default window of the matching, see __init__().
+    WINDOW = 32
+
+    def __init__(self, standings, history=None, window=WINDOW,
+                 opponents=None, ratings=None):
+        """
+        Args:
+          standings: a list of tuples like
+          (id, name, victories, ties, matches).
+          history: a list of tuples (id_1, id_2) of the matches played.
+          window: each player is only connected to the next *window*
+            players in the standings, which keeps the graph small for
+            large fields. The window gets doubled until a complete
+            pairing is found. With None, every player is connected to
+            everybody.
+          opponents: the opponents index, see Draw.
+          ratings: player ratings ranking equal scores, see Draw.
+        """
+        Draw.__init__(self, standings, history, opponents=opponents,
+                      ratings=ratings)
+        self.window = window
+
+    def __edges(self, window):
+        """Build the weighted edges of the pairing graph.
+
+        Args:
+          window: how many following players in the standings each
+            player is connected to, or None to connect everybody.
+
+        Returns:
+          A list of tuples (i, j, weight), where i and j are positions
+          inside self.standings. Position len(self.standings) stands
+          for the Bye-round.
+        """
+        n = len(self.standings)
+        scores = [p[2] for p in self.standings]
+        max_gap = max(scores) - min(scores)
+
+        # Score gaps come first: rank gaps only break ties
+        # between pairings with the same total score gap.
+        base = (max_gap * max_gap) + 1
+        scale = (n + 1) * (n + 1)
+
+        def weight(i, j, score_gap):
+            return (base - score_gap * score_gap) * scale + (n - abs(i - j))
+
+        edges = []
+        for i in range(n):
+            id_1 = self.standings[i][0]
+            last = n if window is None else min(n, i + 1 + window)
+            for j in range(i + 1, last):
+                id_2 = self.standings[j][0]
+                if id_2 in self.opponents.get(id_1, ()):
+                    continue
+                edges.append((i, j, weight(i, j, abs(scores[i] - scores[j]))))
+
+        if n % 2 != 0:
+            # The Bye-round sits at the bottom of the standings.
+            for i in range(n):
+                if self.standings[i][0] not in self.alreadyBye:
+                    score_gap = scores[i] - min(scores)
+                    edges.append((i, n, weight(i, n, score_gap)))
+
+        return edges
+
+    def __solve(self, window):
+        """Solve the matching for a given window.
+
+        Returns:
+          A list where item i is the position paired with position i,
+          or -1 if the player at position i couldn't be paired.
+        """
+        n = len(self.standings)
+        mate = maxWeightMatching(self.__edges(window), maxcardinality=True)
+        mate = mate + ((n + 1) - len(mate)) * [-1]
+        return mate
+
+    def match(self):
+        """Pair as many players as possible, whatever the number
+        of rounds already played.
+
+        Returns:
+          A tuple (pairings, unpaired): the list of pairs like those of
+          getPairings(), and the list of the IDs of the players
+          who couldn't be paired.
+        """
+        n = len(self.standings)
+        window = self.window
+        while True:
+            mate = self.__solve(window)
+            if all(mate[i] != -1 for i in range(n)):
+                break
+            if window is None or window >= n:
+                break
+            window *= 2
+
+        pairings = []
+        unpaired = []
+        for i in range(n):
+            j = mate[i]
+            player = self.standings[i]
+            if j == -1:
+                unpaired.append(player[0])
+                continue
+            if j < i:
+                continue
+            if j == n:
+                pairings.append((player[0], player[1], 0, None))
+            else:
+                opponent = self.standings[j]
+                pairings.append(
+                    (player[0], player[1], opponent[0], opponent[1])
+                )
+
+        return pairings, unpaired
+
+    @instrumented('WeightedDraw.getPairings',
+                  counters=lambda draw: draw.counters())
+    def getPairings(self):
+        """
+        Returns:
+          A list of tuples, each of which contains (id1, name1, id2, name2)
+            id1: the first player's unique id
+            name1: the first player's name
+            id2: the second player's unique id
+            name2: the second player's name
+        """
+        # If we reach the expected number or rounds
+        # to be played, no further pairing gets done.
+        if(self.totalRounds == self.roundsPlayed):
+            return []
+
+        pairings, unpaired = self.match()
+        if unpaired:
+            raise InfeasibleRoundError(
+                "No valid pairing exists for this round", unpaired,
+                {'players': len(self.standings), 'unpaired': unpaired,
+                 'window': self.window}
+            )
+
+        self.pairings = pairings
+        return self.pairings
+
+
+def _matchSegment(segment):
+    """Pair one segment of the field, inside a worker process.
+
+    Args:
+      segment: a tuple (standings, opponents, window).
+
+    Returns:
+      The tuple (pairings, unpaired) of WeightedDraw.match().
+    """
+    standings, opponents, window = segment
+    return WeightedDraw(standings, opponents=opponents,
+                        window=window).match()
+
+
+class BracketDraw(object):
+
+    """This class draws pairs for large Swiss-system tournaments
+    by splitting the field into score brackets paired in parallel.
+
+    With an odd number of players, the lowest ranked player who hasn't
+    had one yet gets the Bye-round first. The rest of the standings is
+    cut into segments of about *segment* players, preferably where the
+    aggregate score changes, each of them with an even number of
+    players. Segments are paired independently, on a process pool, by
+    the maximum weight matching of WeightedDraw. Players left unpaired
+    in their segment (floaters) are then paired together.
+
+    If the floaters can't be paired, adjacent segments are merged two by
+    two and drawn again, until the whole field makes a single segment,
+    so that a legal round is found whenever one exists: no rematches,
+    and at most one Bye-round.
+    """
+
+    # Default number of players of a segment.
+    SEGMENT_SIZE = 256
+    # Default window of the matching inside each segment,
+    # see WeightedDraw.
+    WINDOW = 16
+
+    def __init__(self, standings, history=None, segment=None,
+                 processes=None, pool=None, window=WINDOW, opponents=None,
+                 ratings=None):
+        """
+        Args:
+          standings: a list of tuples like
+          (id, name, victories, ties, matches).
+          history: a list of tuples (id_1, id_2) of the matches played.
+          segment: the number of players of a segment.
+          processes: size of the process pool, the number of CPUs if
+            None. With 1, segments are paired in the current process.
+          pool: an existing multiprocessing.Pool or concurrent.futures
+            executor to use, so that draws don't start a new pool
+            each time.
+          window: window of the matching inside each segment.
+          opponents: the opponents index, see Draw.
+          ratings: player ratings ranking equal scores, see Draw.
+        """
+        if ratings:
+            standings = sortByRating(standings, ratings)
+        self.standings = list(standings)
+        if opponents is None:
+            opponents = indexOpponents(history or ())
+        self.opponents = opponents
+        self.segmentSize = segment or self.SEGMENT_SIZE
+        self.processes = processes
+        self.pool = pool
+        self.window = window
+        self.pairings = []
+
+        n = len(self.standings)
+        self.totalRounds = (n - 1).bit_length() if n > 1 else 0
+        self.roundsPlayed = self.standings[0][4] if n else 0
+
+        # Counters of the draw, see counters().
+        self.segments = 0
+        self.floaters = 0
+        self.merges = 0
+        self.fallback = False
+
+    @staticmethod
+    def __score(row):
+        return (row[2] * 3) + row[3]
+
+    def __restrict(self, rows):
+        """Returns the opponents index restricted to the given players."""
+        ids = set(row[0] for row in rows)
+        return dict((row[0], self.opponents[row[0]] & ids)
+                    for row in rows if row[0] in self.opponents)
+
+    def __byePlayer(self):
+        """Returns the position of the lowest ranked player who hasn't
+        had a Bye-round yet, or None."""
+        for i in range(len(self.standings) - 1, -1, -1):
+            if 0 not in self.opponents.get(self.standings[i][0], ()):
+                return i
+        return None
+
+    def __segments(self, field):
+        """Cut the field into contiguous segments of even length.
+
+        Args:
+          field: the standings rows, with an even number of players.
+
+        Returns:
+          A list of lists of rows.
+        """
+        size = self.segmentSize
+        segments = []
+        start = 0
+        for i in range(2, len(field), 2):
+            length = i - start
+            boundary = self.__score(field[i - 1]) != self.__score(field[i])
+            if (length >= size and boundary) or length >= 2 * size:
+                segments.append(field[start:i])
+                start = i
+        segments.append(field[start:])
+        return segments
+
+    def __matchSegments(self, segments):
+        """Pair every segment, in parallel when there are several.
+
+        Returns:
+          A list of (pairings, unpaired) tuples, one per segment.
+        """
+        jobs = [(rows, self.__restrict(rows), self.window)
+                for rows in segments]
+
+        if len(jobs) == 1 or self.processes == 1:
+            return [_matchSegment(job) for job in jobs]
+        if self.pool is not None:
+            return list(self.pool.map(_matchSegment, jobs))
+
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            return pool.map(_matchSegment, jobs)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def __pairSegments(self, field, segments):
+        """Pair every segment, then the floaters they left over.
+
+        Returns:
+          A tuple (pairings, unpaired): the pairs found, and the IDs
+          of the floaters that couldn't be paired.
+        """
+        pairings = []
+        unpaired = set()
+        for (segment_pairings, segment_unpaired) in \
+                self.__matchSegments(segments):
+            pairings.extend(segment_pairings)
+            unpaired.update(segment_unpaired)
+
+        if not unpaired:
+            return pairings, []
+
+        self.floaters = len(unpaired)
+        floaters = [row for row in field if row[0] in unpaired]
+        floater_pairings, left = WeightedDraw(
+            floaters, opponents=self.__restrict(floaters)
+        ).match()
+        pairings.extend(floater_pairings)
+        return pairings, left
+
+    def __drawWhole(self):
+        """Draw the whole field with WeightedDraw."""
+        self.fallback = True
+        pairings, unpaired = WeightedDraw(
+            self.standings, opponents=self.opponents, window=self.window
+        ).match()
+        if unpaired:
+            raise InfeasibleRoundError(
+                "No valid pairing exists for this round", unpaired,
+                {'players': len(self.standings), 'unpaired': unpaired}
+            )
+        return pairings
+
+    def counters(self):
+        """Returns the counters of the draw: segments paired,
+        floaters left over by the segments, how many times adjacent
+        segments were merged, and whether the field had to be drawn
+        again."""
+        return {
+            'players': len(self.standings),
+            'segments': self.segments,
+            'floaters': self.floaters,
+            'merges': self.merges,
+            'fallback': self.fallback,
+        }
+
+    @instrumented('BracketDraw.getPairings',
+                  counters=lambda draw: draw.counters())
+    def getPairings(self):
+        """
+        Returns:
+          A list of tuples, each of which contains (id1, name1, id2, name2)
+            id1: the first player's unique id
+            name1: the first player's name
+            id2: the second player's unique id
+            name2: the second player's name
+
+        Raises:
+          InfeasibleRoundError: if no legal pairing could be found.
+        """
+        if(self.totalRounds == self.roundsPlayed):
+            return []
+
+        field = self.standings
+        bye = []
+        if len(field) % 2 != 0:
+            i = self.__byePlayer()
+            if i is None:
+                self.pairings = self.__drawWhole()
+                return self.pairings
+            bye = [(field[i][0], field[i][1], 0, None)]
+            field = field[:i] + field[i + 1:]
+
+        segments = self.__segments(field)
+        while True:
+            self.segments = len(segments)
+            pairings, unpaired = self.__pairSegments(field, segments)
+            if not unpaired:
+                break
+            if len(segments) == 1 and bye:
+                # The round may still exist with another Bye-round.
+                self.pairings = self.__drawWhole()
+                return self.pairings
+            if len(segments) == 1:
+                raise InfeasibleRoundError(
+                    "No valid pairing exists for this round", unpaired,
+                    {'players': len(self.standings), 'unpaired': unpaired}
+                )
+            # Draw again, with each segment merged with the next one.
+            self.fallback = True
+            self.merges += 1
+            segments = [sum(segments[i:i + 2], [])
+                        for i in range(0, len(segments), 2)]
+
+        self.pairings = pairings + bye
+        return self.pairings
+
+
+# Pairing engines that can be selected by name.
+ENGINES = {
+    'greedy': Draw,
+    'weighted': WeightedDraw,
+    'brackets': BracketDraw,
+}
+
+# Options swissPairings() passes to the pairing engines: the weighted
+# matching is drawn over a finite window, never the dense graph.
+ENGINE_OPTIONS = {
+    'weighted': {'window': WeightedDraw.WINDOW},
+}
+
+
+class PairingState(object):
+
+    """What the pairing engines need to know about a tournament,
+    carried from one round to the next.
+
+    Instead of reading the whole history before each round, the state
+    is updated with what changed since the previous round only: newly
+    registered players and newly reported matches. Drawing a round then
+    costs O(players + games of the last round), whatever the length
+    of the history.
+
+    The state can be serialized with dumps(), so that a restarted
+    service can resume from it, see tournament.updatePairingState().
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Forget everything, e.g. after matches or players
+        were deleted."""
+        # Player ID -> [name, won, tied, played]
+        self.players = {}
+        # Player ID -> set of the IDs of his or her past opponents,
+        # 0 standing for a Bye-round.
+        self.opponents = {}
+        # The matches, in the order they were played,
+        # as parallel arrays: needed by the tiebreaks.
+        self.player1 = array('l')
+        self.player2 = array('l')
+        self.result1 = array('d')
+        self.result2 = array('d')
+        self.lastPlayerId = 0
+        self.lastMatchId = 0
+        self.matches = 0
+
+    def addPlayer(self, player_id, name):
+        self.players[player_id] = [name, 0, 0, 0]
+        self.lastPlayerId = max(self.lastPlayerId, player_id)
+
+    def addMatch(self, match_id, player_1, player_2, player_1_result,
+                 player_2_result):
+        """Add a reported match to the state. player_2 is 0
+        for a Bye-round."""
+        for player, result in ((player_1, player_1_result),
+                               (player_2, player_2_result)):
+            record = self.players.get(player)
+            if record is None:
+                continue
+            if result == 1:
+                record[1] += 1
+            elif result == 0.5:
+                record[2] += 1
+            record[3] += 1
+
+        self.opponents.setdefault(player_1, set()).add(player_2)
+        if player_2 != 0:
+            self.opponents.setdefault(player_2, set()).add(player_1)
+
+        self.player1.append(player_1)
+        self.player2.append(player_2)
+        self.result1.append(player_1_result)
+        self.result2.append(player_2_result if player_2 != 0 else 0)
+
+        self.lastMatchId = max(self.lastMatchId, match_id)
+        self.matches += 1
+
+    def apply(self, players, matches, counts):
+        """Apply the changes returned by the changesSince()
+        method of the storage backends.
+
+        Args:
+          players: a list of tuples (id, name) of the new players.
+          matches: a list of tuples (id, player_1, player_2,
+            player_1_result, player_2_result) of the new matches.
+          counts: a tuple (number of players, number of matches)
+            currently stored.
+
+        Returns:
+          False if the state is out of sync with the storage after the
+          changes were applied (some player or match was deleted):
+          it must then be cleared and rebuilt.
+        """
+        for (player_id, name) in players:
+            self.addPlayer(player_id, name)
+        for match in matches:
+            self.addMatch(*match)
+
+        return (len(self.players), self.matches) == tuple(counts)
+
+    def tiebreaks(self):
+        """Returns the tiebreak scores of every player,
+        see tiebreaks.computeTiebreaks()."""
+        return computeTiebreaks(list(self.players), self.player1,
+                                self.player2, self.result1, self.result2)
+
+    def standings(self, order=None):
+        """Returns a list of tuples (id, name, wins, ties, matches),
+        sorted like the playerStandings() of tournament.py.
+
+        Args:
+          order: if given, the tiebreaks (see tiebreaks.TIEBREAKS)
+            ranking players with the same wins and ties.
+        """
+        standings = [(i, r[0], r[1], r[2], r[3])
+                     for i, r in self.players.items()]
+        if order:
+            tiebreaks = self.tiebreaks()
+            standings.sort(key=lambda row: rankingKey(row, tiebreaks, order))
+        else:
+            standings.sort(key=lambda row: (-row[2], -row[3], row[0]))
+        return standings
+
+    def rankedStandings(self, order=TIEBREAKS):
+        """Returns the standings ranked with tiebreaks, as a list of
+        tuples (id, name, wins, ties, matches) followed by the value
+        of each tiebreak of *order*."""
+        tiebreaks = self.tiebreaks()
+        standings = [(i, r[0], r[1], r[2], r[3])
+                     for i, r in self.players.items()]
+        standings.sort(key=lambda row: rankingKey(row, tiebreaks, order))
+        return [row + tuple(tiebreaks[row[0]][name] for name in order)
+                for row in standings]
+
+    def draw(self, engine='greedy', order=None, **options):
+        """Returns the pairing engine for the next round.
+
+        Args:
+          engine: the name of the pairing engine, see ENGINES.
+          order: tiebreaks ordering players with the same wins and ties
+            before the draw, see standings(). Computing them takes
+            a pass over the whole history.
+          **options: passed to the engine constructor.
+        """
+        return ENGINES[engine](self.standings(order),
+                               opponents=self.opponents, **options)
+
+    def dumps(self):
+        """Returns the state serialized as a JSON string."""
+        return json.dumps({
+            'players': [[i] + r for i, r in sorted(self.players.items())],
+            'opponents': [[i, sorted(o)]
+                          for i, o in sorted(self.opponents.items())],
+            'history': [list(self.player1), list(self.player2),
+                        list(self.result1), list(self.result2)],
+            'lastPlayerId': self.lastPlayerId,
+            'lastMatchId': self.lastMatchId,
+            'matches': self.matches,
+        })
+
+    @classmethod
+    def loads(cls, data):
+        """Returns the state serialized by dumps()."""
+        data = json.loads(data)
+        state = cls()
+        state.players = dict((row[0], row[1:]) for row in data['players'])
+        state.opponents = dict((i, set(o)) for i, o in data['opponents'])
+        player1, player2, result1, result2 = data['history']
+        state.player1 = array('l', player1)
+        state.player2 = array('l', player2)
+        state.result1 = array('d', result1)
+        state.result2 = array('d', result2)
+        state.lastPlayerId = data['lastPlayerId']
+        state.lastMatchId = data['lastMatchId']
+        state.matches = data['matches']
+        return state
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+#
+# tiebreaks.py -- tiebreak scores of a Swiss-system tournament
+#
+# Players with the same number of wins and ties are told apart by:
+#
+#   buchholz        -- the sum of the scores of the player's opponents.
+#   medianBuchholz  -- the same, leaving out the best and the worst
+#                      opponent (with at least three opponents).
+#   sonnebornBerger -- the sum of the scores of the opponents the player
+#                      beat, plus half the scores of those he or she tied.
+#   cumulative      -- the sum of the player's running score after each
+#                      of his or her games: early wins weigh more.
+#
+# Scores count 1 for a win and 0.5 for a tie. A Bye-round counts in the
+# player's score, but brings no opponent to the Buchholz scores.
+#
+# Everything is computed with two passes over the matches, on compact
+# arrays indexed by player position: the cost is linear in the number
+# of games played.
+
+from array import array
+
+
+# Tiebreaks in their default order of precedence.
+TIEBREAKS = ('buchholz', 'medianBuchholz', 'sonnebornBerger', 'cumulative')
+
+
+def computeTiebreaks(player_ids, player1, player2, result1, result2):
+    """Compute the tiebreak scores of every player.
+
+    Args:
+      player_ids: the IDs of the players.
+      player1, player2, result1, result2: parallel sequences describing
+        the matches in the order they were played; player2 is 0 for a
+        Bye-round. Players not in player_ids are ignored.
+
+    Returns:
+      A dictionary mapping each player ID to a dictionary with the
+      player's 'score' and each tiebreak of TIEBREAKS.
+    """
+    position = dict((player_id, i) for i, player_id in enumerate(player_ids))
+    n = len(position)
+
+    score = array('d', [0.0]) * n
+    cumulative = array('d', [0.0]) * n
+
+    # First pass: scores, running scores, and the positions of the
+    # players of each game (-1 for a Bye-round or an unknown player).
+    first = array('l', [-1]) * len(player1)
+    second = array('l', [-1]) * len(player1)
+    for k in range(len(player1)):
+        i = position.get(player1[k], -1)
+        j = position.get(player2[k], -1)
+        first[k] = i
+        second[k] = j
+        if i >= 0:
+            score[i] += result1[k]
+            cumulative[i] += score[i]
+        if j >= 0:
+            score[j] += result2[k]
+            cumulative[j] += score[j]
+
+    buchholz = array('d', [0.0]) * n
+    sonneborn_berger = array('d', [0.0]) * n
+    best = array('d', [0.0]) * n
+    worst = array('d', [0.0]) * n
+    opponents = array('l', [0]) * n
+
+    def meet(i, j, result):
+        """Account for the game of player i against player j."""
+        opponent_score = score[j]
+        buchholz[i] += opponent_score
+        sonneborn_berger[i] += result * opponent_score
+        if opponents[i] == 0 or opponent_score > best[i]:
+            best[i] = opponent_score
+        if opponents[i] == 0 or opponent_score < worst[i]:
+            worst[i] = opponent_score
+        opponents[i] += 1
+
+    # Second pass: opponents' final scores.
+    for k in range(len(player1)):
+        i = first[k]
+        j = second[k]
+        if i < 0 or j < 0:
+            continue
+        meet(i, j, result1[k])
+        meet(j, i, result2[k])
+
+    tiebreaks = {}
+    for player_id, i in position.items():
+        median = buchholz[i]
+        if opponents[i] >= 3:
+            median -= best[i] + worst[i]
+        tiebreaks[player_id] = {
+            'score': score[i],
+            'buchholz': buchholz[i],
+            'medianBuchholz': median,
+            'sonnebornBerger': sonneborn_berger[i],
+            'cumulative': cumulative[i],
+        }
+
+    return tiebreaks
+
+
+def rankingKey(row, tiebreaks, order=TIEBREAKS):
+    """Sort key ranking a standings row by wins, ties, then tiebreaks.
+
+    Args:
+      row: a tuple (id, name, wins, ties, matches).
+      tiebreaks: the dictionary returned by computeTiebreaks().
+      order: the tiebreaks to use, by precedence.
+    """
+    values = tiebreaks.get(row[0], {})
+    return ((-row[2], -row[3]) +
+            tuple(-values.get(name, 0) for name in order) +
+            (row[0],))
@@ -2,50 +2,219 @@
 #
 # tournament.py -- implementation of a Swiss-system tournament
 #
+# Every function delegates the storage to the backend configured
+# through the storage package (PostgreSQL by default).
+#
+# A database can host many tournaments: functions apply to the
+# default one, or to the one selected by a Tournament with-block.
+#
+
+import threading
+from array import array
+
+from cache import cached, invalidate, invalidates
+from cache import configureCache, MemoryStore, FileStore  # noqa
+from instrumentation import instrumented
+from leaderboard import Leaderboard
+from ratings import configureRatings, getRatingSystem, computeRatings  # noqa
+from storage import configureBackend, getBackend, closeBackend  # noqa
+from storage import FETCH_SIZE, DEFAULT_TOURNAMENT
+from swisspairings import ENGINES, ENGINE_OPTIONS, PairingState
+from tiebreaks import TIEBREAKS
+
+
+DSN = "dbname=tournament"
+
+_local = threading.local()
+
+_executor = None
+
+
+def configurePool(minconn=1, maxconn=10, dsn=DSN):
+    """Use the PostgreSQL backend, drawing connections from a pool.
+    Any previously configured backend is closed.
+
+    Args:
+      minconn: number of connections opened straight away.
+      maxconn: maximum number of connections kept by the pool.
+      dsn: the libpq connection string.
+
+    Returns:
+      The new pool.
+    """
+    backend = configureBackend(
+        'postgres', database=dsn, minconn=minconn, maxconn=maxconn
+    )
+    return backend.getPool()
+
+
+def getPool():
+    """Returns the connection pool of the PostgreSQL backend."""
+    return getBackend().getPool()
+
+
+def closePool():
+    """Close every connection held by the configured backend."""
+    closeBackend()
+
+
+def configureExecutor(executor):
+    """Select the pool pairing the segments of the 'brackets' engine.
+
+    Without one, each draw of the 'brackets' engine starts and stops
+    its own process pool.
+
+    Args:
+      executor: a multiprocessing.Pool or a concurrent.futures
+        executor, kept by the caller and reused by every draw, or None.
+    """
+    global _executor
+    _executor = executor
+
+
+class Session(object):
+
+    """Run several operations inside one transaction
+    of the configured backend.
+
+    Every function of this module called inside the with-block takes
+    part in the same transaction. It is committed when the block exits
+    normally and rolled back if an exception is raised.
+
+    Example:
+
+        with Session():
+            registerPlayer("Joe")
+            registerPlayer("Susan")
+    """
+
+    def __init__(self):
+        self.__session = _backend().session()
+
+    def __enter__(self):
+        return self.__session.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            return self.__session.__exit__(exc_type, exc_value, traceback)
+        finally:
+            # Reads cached while the transaction was open may hold
+            # uncommitted or rolled back data.
+            invalidate()
+
+
+class Tournament(object):
+
+    """Apply every function of this module called inside the with-block,
+    in the current thread, to another tournament than the default one.
+
+    Example:
+
+        tournament_id = createTournament("Spring open")
+        with Tournament(tournament_id):
+            registerPlayer("Joe")
+            pairings = swissPairings()
+    """
+
+    def __init__(self, tournament_id):
+        self.tournamentId = tournament_id
+        self.__previous = None
+
+    def __enter__(self):
+        self.__previous = currentTournament()
+        _local.tournament = self.tournamentId
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.tournament = self.__previous
+        return False
 
-import psycopg2
-from swisspairings import Draw
+
+def currentTournament():
+    """Returns the ID of the tournament the functions of this module
+    apply to in the current thread."""
+    return getattr(_local, 'tournament', DEFAULT_TOURNAMENT)
+
+
+def _backend():
+    """Returns the configured backend, working on the current tournament."""
+    return getBackend().forTournament(currentTournament())
+
+
+def _cached(key=None):
+    """cache.cached(), telling the results of each tournament apart."""
+    return cached(key, scope=currentTournament)
 
 
 def connect():
-    """Connect to the PostgreSQL database.
+    """Get a connection from the PostgreSQL backend pool, or the one held
+    by the Session open in the current thread.
     Returns a database connection and a cursor."""
-    connection = psycopg2.connect("dbname=tournament")
-    cursor = connection.cursor()
-    return [connection, cursor]
+    return getBackend().connect()
 
 
 def closeConnection(connection, cursor):
-    """Close connect to the PostgreSQL database."""
-    cursor.close()
-    connection.close()
+    """Close the cursor and give the connection back to the pool."""
+    getBackend().closeConnection(connection, cursor)
+
+
+@instrumented()
+@invalidates
+def createTournament(name):
+    """Adds a tournament to the database. With PostgreSQL, its matches
+    and outcomes get partitions of their own.
+
+    Args:
+      name: the name of the tournament.
+
+    Returns:
+      The ID assigned to the tournament, see Tournament.
+    """
+    return getBackend().createTournament(name)
+
+
+@instrumented()
+def listTournaments():
+    """Returns a list of tuples (id, name) of the tournaments."""
+    return getBackend().listTournaments()
 
 
+@instrumented()
+@invalidates
+def dropTournament(tournament_id):
+    """Throw a finished tournament away, with its players and matches.
+    With PostgreSQL, its partitions are dropped instead of deleting
+    their rows one by one.
+
+    Args:
+      tournament_id: the ID returned by createTournament().
+    """
+    getBackend().dropTournament(tournament_id)
+
+
+@instrumented()
+@invalidates
 def deleteMatches():
     """Remove all the match records from the database."""
-    connection, cursor = connect()
-    cursor.execute("DELETE FROM matches")
-    connection.commit()
-    closeConnection(connection, cursor)
+    _backend().deleteMatches()
 
 
+@instrumented()
+@invalidates
 def deletePlayers():
     """Remove all the player records from the database."""
-    connection, cursor = connect()
-    cursor.execute("DELETE FROM players")
-    connection.commit()
-    closeConnection(connection, cursor)
+    _backend().deletePlayers()
 
 
+@instrumented()
+@_cached()
 def countPlayers():
     """Returns the number (long type) of players currently registered."""
-    connection, cursor = connect()
-    cursor.execute("SELECT COUNT(*) FROM players AS count")
-    count = cursor.fetchone()[0]
-    closeConnection(connection, cursor)
-    return count
+    return _backend().countPlayers()
 
 
+@instrumented()
+@invalidates
 def registerPlayer(name):
     """Adds a player to the tournament database.
 
@@ -54,22 +223,53 @@ def registerPlayer(name):
 
     Args:
       name: the player's full name (need not be unique).
+
+    Returns:
+      The ID assigned to the player.
+    """
+    return _backend().registerPlayer(name)
+
+
+def _playerRow(player):
+    """Normalize one entry passed to registerPlayers().
+
+    Returns:
+      A tuple (name, registration_date).
+    """
+    if isinstance(player, (tuple, list)):
+        if len(player) != 2:
+            raise ValueError("Invalid player: %r" % (player,))
+        return tuple(player)
+    return (player, None)
+
+
+@instrumented()
+@invalidates
+def registerPlayers(players):
+    """Adds many players to the tournament database in one transaction.
+    With PostgreSQL the names are streamed through COPY.
+
+    Args:
+      players: an iterable of names, or of tuples
+        (name, registration_date) to set the registration date too.
+
+    Returns:
+      The list of IDs assigned to the players, in the same order.
     """
-    connection, cursor = connect()
-    cursor.execute("INSERT INTO players (name) VALUES (%s)", (name,))
-    connection.commit()
-    closeConnection(connection, cursor)
+    return _backend().registerPlayers(
+        _playerRow(player) for player in players
+    )
 
 
+@instrumented()
+@_cached()
 def getPlayerID(name):
     """Returns the player's ID given by the name."""
-    connection, cursor = connect()
-    cursor.execute("SELECT id FROM players WHERE name = %s", (name,))
-    player_id = cursor.fetchone()
-    closeConnection(connection, cursor)
-    return player_id
+    return _backend().getPlayerID(name)
 
 
+@instrumented()
+@_cached()
 def playerStandings():
     """Returns a list of the players and their win records, sorted by wins.
 
@@ -84,34 +284,51 @@ def playerStandings():
         ties: the number of matches the player has tied
         matches: the number of matches the player has played
     """
-    connection, cursor = connect()
-    cursor.execute(
-        """SELECT
-        players.id,
-        players.name,
-        victories.won,
-        ties.tied,
-        games_played.played
-        FROM players
-        LEFT JOIN(
-            SELECT * FROM games_won
-            ) AS victories ON players.id = victories.player_id
-        LEFT JOIN(
-            SELECT * FROM games_tied
-            ) AS ties ON players.id = ties.player_id
-        LEFT JOIN(
-            SELECT * FROM games_played
-            ) AS games_played ON players.id = games_played.player_id
-        ORDER BY
-        victories.won DESC,
-        ties.tied DESC;"""
-    )
-    standings = cursor.fetchall()
-    closeConnection(connection, cursor)
+    return _backend().playerStandings()
+
+
+@instrumented()
+@_cached()
+def standingsPage(after=None, limit=20):
+    """Returns a page of playerStandings(), e.g. the top 20 for a display
+    board, reading only the rows of the page.
+
+    Pages are found by key rather than by offset: with the last row of
+    the previous page, the database walks its ranking index from that
+    player on, whatever the size of the field.
+
+    Args:
+      after: the last row of the previous page, None for the first page.
+      limit: the number of rows of the page.
+
+    Returns:
+      A list of tuples (id, name, wins, ties, matches).
+    """
+    return _backend().standingsPage(after, limit)
+
 
-    return standings
+@instrumented()
+@invalidates
+def rebuildStandings():
+    """Recompute the standings table from scratch out of the outcomes.
+    To be used for recovery, when verifyStandings() finds some drift."""
+    _backend().rebuildStandings()
 
 
+@instrumented()
+def verifyStandings():
+    """Compare the incrementally maintained standings table
+    with the standings computed from the outcomes.
+
+    Returns:
+      A list of IDs of the players whose stored standings are wrong.
+      An empty list means the standings table is consistent.
+    """
+    return _backend().verifyStandings()
+
+
+@instrumented()
+@invalidates
 def reportMatch(player_1, player_2=0, player_1_result=1, player_2_result=0):
     """Records the outcome of a single match between two players.
     Default values are used for Bye rounds,
@@ -122,32 +339,136 @@ def reportMatch(player_1, player_2=0, player_1_result=1, player_2_result=0):
       player_2:  the id number of the second player
       player_1_result: player_1 outcome
       player_2_result: player_2 outcome
+
+    Returns:
+      The ID of the recorded match.
+
+    Raises:
+      ValueError: if a player is on both sides of the match, isn't
+        registered, or if the players have already met, see
+        report_match() in tournament.sql.
     """
-    connection, cursor = connect()
-    cursor.execute(
-        "INSERT INTO matches (player_1, player_2) VALUES (%s, %s)",
-        (player_1, player_2,)
-    )
-    cursor.execute('SELECT LASTVAL()')
-    game_id = cursor.fetchone()
+    row = (player_1, player_2, player_1_result, player_2_result)
+    if getRatingSystem() is None or player_2 == 0:
+        # Nothing to rate: a single statement, without a transaction
+        # around it.
+        return _backend().reportMatch(*row)
+
+    with Session():
+        game_id = _backend().reportMatch(*row)
+        _rateRound([row])
+
+    return game_id
 
-    cursor.execute(
-        "INSERT INTO outcomes ( match_id, player, player_outcome) VALUES (%s, %s, %s)",  # noqa
-        (game_id, player_1, player_1_result,)
-    )
 
-    # if it's not a Bye-round we insert the second
-    # player outcome
-    if player_2 != 0:
-        cursor.execute(
-            "INSERT INTO outcomes ( match_id, player, player_outcome) VALUES (%s, %s, %s)",  # noqa
-            (game_id, player_2, player_2_result,)
-        )
+def _rateRound(rows):
+    """Update the ratings of the players of a round with the configured
+    rating system, see ratings.py. Call it inside the Session recording
+    the round, so that both are committed together.
+
+    Args:
+      rows: a list of tuples (player_1, player_2, player_1_result,
+        player_2_result), each player appearing at most once.
+    """
+    system = getRatingSystem()
+    rows = [row for row in rows if row[1] != 0]
+    if system is None or not rows:
+        return
+
+    backend = _backend()
+    player_ids = [player for row in rows for player in row[:2]]
+    current = dict((player_id, (rating, deviation))
+                   for (player_id, name, rating, deviation)
+                   in backend.playerRatings(player_ids))
+    player1, player2, result1, result2 = zip(*rows)
+    backend.updateRatings(computeRatings(
+        list(current), player1, player2, result1, result2, system, current
+    ))
+
+
+def _roundResult(result):
+    """Normalize one entry of a round passed to reportRound().
+
+    Args:
+      result: a tuple with the same arguments taken by reportMatch(),
+        i.e. (player_1, player_2, player_1_result, player_2_result).
+        Trailing items can be left out and get reportMatch() defaults,
+        so (player_1,) records a Bye round.
+
+    Returns:
+      A tuple (player_1, player_2, player_1_result, player_2_result).
+    """
+    defaults = (None, 0, 1, 0)
+    result = tuple(result)
+    if not 1 <= len(result) <= len(defaults):
+        raise ValueError("Invalid round result: %r" % (result,))
+    player_1, player_2, result_1, result_2 = result + defaults[len(result):]
 
-    connection.commit()
-    closeConnection(connection, cursor)
+    if player_2 is None:
+        player_2 = 0
+    for outcome in (result_1, result_2):
+        if outcome not in (0, 0.5, 1):
+            raise ValueError("Invalid outcome %r for match %r" % (outcome, result))  # noqa
 
+    return (player_1, player_2, result_1, result_2)
 
+
+@instrumented()
+@invalidates
+def reportRound(results):
+    """Records every result of a round in one transaction.
+
+    With PostgreSQL, matches and outcomes are written with a single
+    set-based statement. Either the whole round is recorded or nothing is.
+
+    Args:
+      results: an iterable of tuples, each of which contains the arguments
+        of reportMatch(), (player_1, player_2, player_1_result,
+        player_2_result). Bye rounds can be passed as (player_1,).
+
+    Returns:
+      A list with the id of each recorded match, in the same order
+      as results.
+    """
+    rows = _roundRows(results)
+    if not rows:
+        return []
+
+    with Session():
+        game_ids = _backend().reportRound(rows)
+        _rateRound(rows)
+
+    return game_ids
+
+
+def _roundRows(results):
+    """Validate the results of a round passed to reportRound():
+    each entry goes through _roundResult(), and no player
+    can appear twice.
+
+    Returns:
+      A list of tuples (player_1, player_2, player_1_result,
+      player_2_result).
+    """
+    rows = []
+    seen = set()
+    for result in results:
+        player_1, player_2, result_1, result_2 = _roundResult(result)
+        for player in (player_1, player_2):
+            if player == 0:
+                continue
+            if player in seen:
+                raise ValueError(
+                    "Player %s appears more than once in the round" % player
+                )
+            seen.add(player)
+        rows.append((player_1, player_2, result_1, result_2))
+
+    return rows
+
+
+@instrumented()
+@_cached()
 def matchesHistory():
     """Helper function used inside swissPairings().
     Get the matches that have already been played.
@@ -157,15 +478,181 @@ def matchesHistory():
       id1: the first player's unique id
       id2: the second player's unique id"""
 
-    connection, cursor = connect()
-    cursor.execute("SELECT player_1, player_2 FROM matches")
-    history = cursor.fetchall()
-    closeConnection(connection, cursor)
+    return _backend().matchesHistory()
 
-    return history
 
+@instrumented()
+@_cached()
+def playerRatings():
+    """Returns the ratings of the players, highest first.
 
-def swissPairings():
+    Ratings are updated by reportMatch() and reportRound() once a
+    system is selected through configureRatings(), see ratings.py.
+
+    Returns:
+      A list of tuples, each of which contains
+      (id, name, rating, deviation):
+        deviation: the Glicko rating deviation, 350 with Elo.
+    """
+    return _backend().playerRatings()
+
+
+@instrumented()
+@invalidates
+def rebuildRatings(system=None, fetch_size=None):
+    """Recompute every rating out of the whole matches history, e.g.
+    after changing the rating system. The history is streamed once
+    into compact arrays and rated round by round in memory.
+
+    Args:
+      system: the rating system, see ratings.configureRatings().
+        The configured one (or Elo) if None.
+      fetch_size: rows fetched from the database at a time.
+    """
+    backend = _backend()
+    player1 = array('l')
+    player2 = array('l')
+    result1 = array('d')
+    result2 = array('d')
+
+    with Session():
+        player_ids = [row[0] for row in backend.playerRatings()]
+        for (match_id, time, player_1, player_2, result_1, result_2) in \
+                backend.streamMatches(fetch_size or FETCH_SIZE):
+            player1.append(player_1)
+            player2.append(player_2)
+            result1.append(result_1 or 0)
+            result2.append(result_2 or 0)
+
+        backend.updateRatings(computeRatings(
+            player_ids, player1, player2, result1, result2, system
+        ))
+        # Draws ranking players by rating are stale.
+        backend.deleteDraws()
+
+
+def streamStandings(fetch_size=None):
+    """Generate the rows of playerStandings() one by one, without
+    holding them all in memory. With PostgreSQL they are read through
+    a server-side cursor.
+
+    Args:
+      fetch_size: rows fetched from the database at a time.
+    """
+    return _backend().streamStandings(fetch_size or FETCH_SIZE)
+
+
+def streamMatches(fetch_size=None):
+    """Generate every match played, with its outcomes, one by one.
+
+    Args:
+      fetch_size: rows fetched from the database at a time.
+
+    Returns:
+      A generator of tuples (id, time, player_1, player_2,
+      player_1_result, player_2_result). For a Bye round player_2 is 0
+      and player_2_result is None.
+    """
+    return _backend().streamMatches(fetch_size or FETCH_SIZE)
+
+
+@instrumented()
+@_cached()
+def pairingSnapshot():
+    """Helper function used inside swissPairings().
+    Read the standings and the opponents of each player
+    at once, from one consistent snapshot of the database.
+
+    Returns:
+      A tuple (standings, opponents):
+        standings: the list returned by playerStandings().
+        opponents: a dictionary mapping each player's id to the set of
+          ids of the players he or she has already faced,
+          0 standing for a Bye round.
+    """
+    return _backend().pairingSnapshot()
+
+
+@instrumented()
+def updatePairingState(state=None, attempts=3):
+    """Bring a PairingState up to date with the database, reading only
+    the players and matches added since its previous update.
+    If something was deleted meanwhile, the state is rebuilt.
+
+    Args:
+      state: a swisspairings.PairingState, e.g. restored with
+        PairingState.loads() after a restart. A new one if None.
+      attempts: how many times the state is rebuilt when players or
+        matches keep being deleted while it is read.
+
+    Returns:
+      The updated state.
+    """
+    if state is None:
+        state = PairingState()
+    return _catchUp(state, attempts, "pairing state")
+
+
+@instrumented()
+def updateLeaderboard(board=None, attempts=3):
+    """Bring a leaderboard.Leaderboard up to date with the database,
+    reading only the players and matches added since its previous
+    update, see updatePairingState(). Display boards keep one
+    for the whole tournament, then ask it for the top players or the
+    rank of a player in O(log n).
+
+    Args:
+      board: the Leaderboard to update. A new one if None.
+      attempts: how many times the board is rebuilt when players or
+        matches keep being deleted while it is read.
+
+    Returns:
+      The updated board.
+    """
+    if board is None:
+        board = Leaderboard()
+    return _catchUp(board, attempts, "leaderboard")
+
+
+def _catchUp(state, attempts, what):
+    """Apply the changes of the database to a PairingState or a
+    Leaderboard, rebuilding it when something was deleted."""
+    backend = _backend()
+    for attempt in range(attempts):
+        changes = backend.changesSince(state.lastPlayerId, state.lastMatchId)
+        if state.apply(*changes):
+            return state
+        state.clear()
+
+    raise RuntimeError(
+        "The %s couldn't catch up with the database" % what)
+
+
+@instrumented()
+@_cached(key=lambda order=TIEBREAKS, state=None: tuple(order))
+def rankedStandings(order=TIEBREAKS, state=None):
+    """Returns the standings with tiebreaks: players with the same wins
+    and ties are ranked by the tiebreaks of *order*, in turn.
+
+    Args:
+      order: the tiebreaks to compute, by precedence, among
+        'buchholz', 'medianBuchholz', 'sonnebornBerger' and 'cumulative'
+        (see tiebreaks.py).
+      state: a swisspairings.PairingState kept for the whole tournament,
+        to only read the last reported results.
+
+    Returns:
+      A list of tuples (id, name, wins, ties, matches, ...) followed by
+      the value of each tiebreak of *order*.
+    """
+    return updatePairingState(state).rankedStandings(order)
+
+
+@instrumented()
+@_cached(key=lambda engine='greedy', state=None, tiebreaks=None,
+        ratings=False: (engine, tuple(tiebreaks or ()), ratings))
+def swissPairings(engine='greedy', state=None, tiebreaks=None,
+                  ratings=False):
     """Returns a list of pairs of players for the next round of a match.
 
     Assuming that there are an even number of players registered, each player
@@ -173,6 +660,24 @@ def swissPairings():
     player with an equal or nearly-equal win record, that is, a player adjacent
     to him or her in the standings.
 
+    Args:
+      engine: the name of the pairing engine, one of swisspairings.ENGINES:
+        'greedy' (the default) or 'weighted' for maximum weight matching.
+      state: a swisspairings.PairingState kept for the whole tournament.
+        When given, it is updated with the last reported results only,
+        instead of reading the whole history again.
+      tiebreaks: if given, the tiebreaks ordering players with the same
+        wins and ties before the draw, e.g. tiebreaks.TIEBREAKS.
+      ratings: if True, players with the same wins and ties are ranked
+        by rating before the draw, ahead of any tiebreak.
+
+    The round is drawn once: the first caller draws it and stores the
+    pairings, holding a lock on the draws of the tournament (an advisory
+    lock with PostgreSQL), while concurrent callers wait for the lock,
+    then read the stored pairings. Every caller asking for the same
+    round with the same options gets the same draw, until a result is
+    reported or a player registered.
+
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
         id1: the first player's unique id
@@ -180,6 +685,43 @@ def swissPairings():
         id2: the second player's unique id
         name2: the second player's name
     """
-    sp_handler = Draw(playerStandings(), matchesHistory())
+    backend = _backend()
+    options = drawOptions(engine, tiebreaks, ratings)
+    key, pairings = backend.drawnPairings(options)
+    if pairings is not None:
+        return pairings
+
+    with backend.drawLock():
+        # Another caller may have drawn the round while we were waiting.
+        key, pairings = backend.drawnPairings(options)
+        if pairings is None:
+            pairings = _drawPairings(engine, state, tiebreaks, ratings)
+            backend.saveDraw(key, options, pairings)
+
+    return pairings
+
+
+def drawOptions(engine='greedy', tiebreaks=None, ratings=False):
+    """Returns the string telling the draws made with different options
+    of swissPairings() apart."""
+    return '%s;%s;%s' % (engine, ','.join(tiebreaks or ()),
+                         'ratings' if ratings else '')
+
+
+def _drawPairings(engine, state, tiebreaks, ratings):
+    """Run the pairing engine, see swissPairings()."""
+    options = dict(ENGINE_OPTIONS.get(engine, {}))
+    if engine == 'brackets' and _executor is not None:
+        options['pool'] = _executor
+    if ratings:
+        options['ratings'] = dict((row[0], row[2]) for row in playerRatings())
+
+    if state is not None or tiebreaks:
+        sp_handler = updatePairingState(state).draw(engine, tiebreaks,
+                                                    **options)
+    else:
+        standings, opponents = pairingSnapshot()
+        sp_handler = ENGINES[engine](standings, opponents=opponents,
+                                     **options)
 
     return sp_handler.getPairings()
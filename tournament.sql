@@ -9,67 +9,339 @@
 DROP VIEW IF EXISTS games_won;
 DROP VIEW IF EXISTS games_tied;
 DROP VIEW IF EXISTS games_played;
+DROP VIEW IF EXISTS computed_standings;
+DROP TABLE IF EXISTS standings;
 DROP TABLE IF EXISTS players;
 DROP TABLE IF EXISTS outcomes;
 DROP TABLE IF EXISTS matches;
+DROP TABLE IF EXISTS draws;
+DROP TABLE IF EXISTS tournaments;
+DROP FUNCTION IF EXISTS standings_add_players();
+DROP FUNCTION IF EXISTS standings_apply_outcomes();
+DROP FUNCTION IF EXISTS rebuild_standings();
+DROP FUNCTION IF EXISTS rebuild_standings(INTEGER);
+DROP FUNCTION IF EXISTS pairing_snapshot();
+DROP FUNCTION IF EXISTS pairing_snapshot(INTEGER);
+DROP FUNCTION IF EXISTS create_tournament(TEXT);
+DROP FUNCTION IF EXISTS create_tournament_partitions(INTEGER);
+DROP FUNCTION IF EXISTS drop_tournament(INTEGER);
+DROP FUNCTION IF EXISTS report_match(INTEGER, INTEGER, INTEGER, REAL, REAL);
+
+
+-- Every player, match and outcome belongs to a tournament. Matches and
+-- outcomes are partitioned by tournament: queries about one tournament
+-- only read its partitions, and a finished tournament is dropped along
+-- with them instead of being deleted row by row.
+CREATE TABLE tournaments (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
 
 
 CREATE TABLE players ( 
     id SERIAL,
+    tournament_id INTEGER NOT NULL DEFAULT 1
+        REFERENCES tournaments(id) ON DELETE CASCADE,
     name TEXT NOT NULL,
     registration_date DATE DEFAULT CURRENT_DATE,
-    PRIMARY KEY (id, name)
+    -- Kept up to date as rounds are reported, see ratings.py
+    rating DOUBLE PRECISION NOT NULL DEFAULT 1500,
+    rating_deviation DOUBLE PRECISION NOT NULL DEFAULT 350,
+    PRIMARY KEY (id, name),
+    UNIQUE (id)
     );
 
+CREATE INDEX players_tournament ON players (tournament_id, id);
+CREATE INDEX players_rating ON players (tournament_id, rating DESC, id);
+
 
 CREATE TABLE matches ( 
-    id SERIAL PRIMARY KEY,
+    tournament_id INTEGER NOT NULL DEFAULT 1,
+    id SERIAL,
     time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     player_1 INTEGER,
     -- If player_2 has id = 0, means that it's been a skipped round
-    player_2 INTEGER DEFAULT 0
-    );
+    player_2 INTEGER DEFAULT 0,
+    PRIMARY KEY (tournament_id, id)
+    ) PARTITION BY LIST (tournament_id);
+
+CREATE INDEX matches_players ON matches (player_1, player_2);
 
 
 CREATE TABLE outcomes ( 
-    match_id INTEGER REFERENCES matches(id) ON DELETE CASCADE,
+    tournament_id INTEGER NOT NULL DEFAULT 1,
+    match_id INTEGER,
     player INTEGER NOT NULL,
     -- Won: 1 point
     -- Lost: 0 point
     -- Tied: 0.5 point
     player_outcome REAL,
-    PRIMARY KEY (match_id, player),
+    PRIMARY KEY (tournament_id, match_id, player),
+    FOREIGN KEY (tournament_id, match_id)
+        REFERENCES matches (tournament_id, id) ON DELETE CASCADE,
     CHECK (player_outcome = 0 OR player_outcome = 1 OR player_outcome = 0.5)
+    ) PARTITION BY LIST (tournament_id);
+
+CREATE INDEX outcomes_player ON outcomes (player);
+
+
+-- Create the partitions of a tournament.
+CREATE FUNCTION create_tournament_partitions(tournament INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    EXECUTE format('CREATE TABLE matches_%s PARTITION OF matches '
+                   'FOR VALUES IN (%s)', tournament, tournament);
+    EXECUTE format('CREATE TABLE outcomes_%s PARTITION OF outcomes '
+                   'FOR VALUES IN (%s)', tournament, tournament);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Register a new tournament, returning its id.
+CREATE FUNCTION create_tournament(tournament_name TEXT)
+RETURNS INTEGER AS $$
+DECLARE
+    tournament INTEGER;
+BEGIN
+    INSERT INTO tournaments (name) VALUES (tournament_name)
+    RETURNING id INTO tournament;
+    PERFORM create_tournament_partitions(tournament);
+    RETURN tournament;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Throw a tournament away: its partitions are dropped, and its players
+-- (with their standings) deleted with the tournament row.
+CREATE FUNCTION drop_tournament(tournament INTEGER) RETURNS VOID AS $$
+BEGIN
+    EXECUTE format('DROP TABLE IF EXISTS outcomes_%s', tournament);
+    -- The foreign key of outcomes still depends on the partition of
+    -- matches until it is detached.
+    IF to_regclass(format('matches_%s', tournament)) IS NOT NULL THEN
+        EXECUTE format('ALTER TABLE matches DETACH PARTITION matches_%s',
+                       tournament);
+        EXECUTE format('DROP TABLE matches_%s', tournament);
+    END IF;
+    DELETE FROM tournaments WHERE id = tournament;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- The default tournament, id 1, used when no other one is selected.
+INSERT INTO tournaments (name) VALUES ('Default tournament');
+SELECT create_tournament_partitions(1);
+
+
+-- Per-player standings, kept up to date by the triggers below
+-- every time players or outcomes are inserted or deleted.
+-- Reading the standings is then a single scan over this table,
+-- no matter how long the matches history is.
+CREATE TABLE standings (
+    player_id INTEGER PRIMARY KEY REFERENCES players(id) ON DELETE CASCADE,
+    tournament_id INTEGER NOT NULL,
+    won INTEGER NOT NULL DEFAULT 0,
+    tied INTEGER NOT NULL DEFAULT 0,
+    played INTEGER NOT NULL DEFAULT 0,
+    -- Sum of the player outcomes
+    score REAL NOT NULL DEFAULT 0
     );
 
+CREATE INDEX standings_ranking
+    ON standings (tournament_id, won DESC, tied DESC, player_id);
+
+
+-- Standings computed from scratch out of the outcomes table.
+-- Only used to rebuild or verify the standings table.
+CREATE VIEW computed_standings AS
+    SELECT
+    p.id AS player_id,
+    p.tournament_id,
+    count(o.player) FILTER (WHERE o.player_outcome = 1)::INTEGER AS won,
+    count(o.player) FILTER (WHERE o.player_outcome = 0.5)::INTEGER AS tied,
+    count(o.player)::INTEGER AS played,
+    COALESCE(sum(o.player_outcome), 0)::REAL AS score
+    FROM players AS p
+    LEFT JOIN outcomes AS o
+    ON o.tournament_id = p.tournament_id AND o.player = p.id
+    GROUP BY p.id, p.tournament_id;
+
+
+CREATE FUNCTION standings_add_players() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO standings (player_id, tournament_id)
+    SELECT id, tournament_id FROM new_players;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- TG_ARGV[0] is 1 when outcomes are inserted and -1 when they are deleted.
+CREATE FUNCTION standings_apply_outcomes() RETURNS TRIGGER AS $$
+DECLARE
+    direction INTEGER := TG_ARGV[0]::INTEGER;
+BEGIN
+    UPDATE standings AS s SET
+    won = s.won + direction * d.won,
+    tied = s.tied + direction * d.tied,
+    played = s.played + direction * d.played,
+    score = s.score + direction * d.score
+    FROM (
+        SELECT
+        player,
+        count(*) FILTER (WHERE player_outcome = 1) AS won,
+        count(*) FILTER (WHERE player_outcome = 0.5) AS tied,
+        count(*) AS played,
+        sum(player_outcome) AS score
+        FROM changed_outcomes GROUP BY player
+        ) AS d
+    WHERE s.player_id = d.player;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE TRIGGER players_standings
+    AFTER INSERT ON players
+    REFERENCING NEW TABLE AS new_players
+    FOR EACH STATEMENT EXECUTE PROCEDURE standings_add_players();
 
-CREATE VIEW games_won AS
-    SELECT 
-    p.id AS player_id,  
-    COALESCE(w.amount, 0) AS won
-    FROM  players AS p 
-    LEFT JOIN (
-        SELECT player, count(*)::INTEGER as amount FROM outcomes WHERE player_outcome = '1' GROUP BY player 
-        ) as w ON p.id = w.player;
+CREATE TRIGGER outcomes_inserted_standings
+    AFTER INSERT ON outcomes
+    REFERENCING NEW TABLE AS changed_outcomes
+    FOR EACH STATEMENT EXECUTE PROCEDURE standings_apply_outcomes('1');
 
+CREATE TRIGGER outcomes_deleted_standings
+    AFTER DELETE ON outcomes
+    REFERENCING OLD TABLE AS changed_outcomes
+    FOR EACH STATEMENT EXECUTE PROCEDURE standings_apply_outcomes('-1');
 
-CREATE VIEW games_tied AS
-    SELECT 
-    p.id AS player_id,  
-    COALESCE(t.amount, 0) AS tied
-    FROM  players AS p 
-    LEFT JOIN (
-        SELECT player, count(*)::INTEGER as amount FROM outcomes WHERE player_outcome = '0.5' GROUP BY player 
-        ) as t ON p.id = t.player;
 
+-- Record the result of one match in a single call, returning the id of
+-- the match: the players must be registered in the tournament and must
+-- not have met already (nor had a Bye-round already, when second_player
+-- is 0). Their rows are locked first, so that two reports of the same
+-- match can't both get through. The standings follow through the
+-- triggers above. Rejected results raise invalid_parameter_value.
+CREATE FUNCTION report_match(tournament INTEGER, first_player INTEGER,
+                             second_player INTEGER, first_outcome REAL,
+                             second_outcome REAL)
+RETURNS INTEGER AS $$
+DECLARE
+    registered INTEGER;
+    game INTEGER;
+BEGIN
+    IF first_player = second_player THEN
+        RAISE EXCEPTION 'Player % is on both sides of the match', first_player
+        USING ERRCODE = 'invalid_parameter_value';
+    END IF;
 
-CREATE VIEW games_played AS
-    SELECT 
-    p.id AS player_id,  
-    COALESCE(g.amount, 0) AS played
-    FROM  players AS p 
-    LEFT JOIN (
-        SELECT player, count(*)::INTEGER as amount FROM outcomes GROUP BY player 
-        ) as g ON p.id = g.player;                          
+    PERFORM 1 FROM players
+    WHERE tournament_id = tournament
+    AND id IN (first_player, second_player)
+    ORDER BY id
+    FOR NO KEY UPDATE;
+    GET DIAGNOSTICS registered = ROW_COUNT;
+    IF registered = 0 OR (second_player <> 0 AND registered < 2) THEN
+        RAISE EXCEPTION 'Players % and % aren''t both registered in '
+                        'tournament %', first_player, second_player, tournament
+        USING ERRCODE = 'invalid_parameter_value';
+    END IF;
 
+    IF EXISTS (
+        SELECT 1 FROM matches
+        WHERE tournament_id = tournament
+        AND ((player_1 = first_player AND player_2 = second_player)
+        OR (player_1 = second_player AND player_2 = first_player))
+    ) THEN
+        IF second_player = 0 THEN
+            RAISE EXCEPTION 'Player % already had a Bye-round', first_player
+            USING ERRCODE = 'invalid_parameter_value';
+        END IF;
+        RAISE EXCEPTION 'Players % and % have already met',
+                        first_player, second_player
+        USING ERRCODE = 'invalid_parameter_value';
+    END IF;
 
+    INSERT INTO matches (tournament_id, player_1, player_2)
+    VALUES (tournament, first_player, second_player)
+    RETURNING id INTO game;
+
+    INSERT INTO outcomes (tournament_id, match_id, player, player_outcome)
+    SELECT tournament, game, first_player, first_outcome
+    UNION ALL
+    SELECT tournament, game, second_player, second_outcome
+    WHERE second_player <> 0;
+
+    RETURN game;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Recovery routine: throw away the standings of a tournament
+-- and compute them again from the outcomes.
+CREATE FUNCTION rebuild_standings(tournament INTEGER) RETURNS VOID AS $$
+    DELETE FROM standings WHERE tournament_id = tournament;
+    INSERT INTO standings
+    (player_id, tournament_id, won, tied, played, score)
+    SELECT player_id, tournament_id, won, tied, played, score
+    FROM computed_standings
+    WHERE tournament_id = tournament;
+$$ LANGUAGE sql;
+
+
+-- Everything the pairing engines need, read in a single statement
+-- and therefore from one consistent snapshot: the standings of a
+-- tournament, and for each player the IDs of the opponents he or she
+-- has already faced, with 0 standing for a Bye-round.
+CREATE FUNCTION pairing_snapshot(tournament INTEGER)
+RETURNS TABLE (id INTEGER, name TEXT, won INTEGER, tied INTEGER,
+               played INTEGER, opponents INTEGER[]) AS $$
+    WITH met AS (
+        SELECT player, array_agg(opponent) AS opponents
+        FROM (
+            SELECT player_1 AS player, player_2 AS opponent FROM matches
+            WHERE tournament_id = tournament
+            UNION ALL
+            SELECT player_2, player_1 FROM matches
+            WHERE tournament_id = tournament AND player_2 <> 0
+            ) AS edges
+        GROUP BY player
+        )
+    SELECT
+    players.id,
+    players.name,
+    standings.won,
+    standings.tied,
+    standings.played,
+    COALESCE(met.opponents, '{}')
+    FROM standings
+    JOIN players ON players.id = standings.player_id
+    LEFT JOIN met ON met.player = players.id
+    WHERE standings.tournament_id = tournament
+    ORDER BY
+    standings.won DESC,
+    standings.tied DESC,
+    standings.player_id;
+$$ LANGUAGE sql STABLE;
+
+
+-- Pairings drawn by swissPairings(), so that every caller asking for
+-- the same round gets the same draw. A draw is identified by the
+-- number of players and matches of the tournament when it was made,
+-- and by the options of the pairing engine.
+CREATE TABLE draws (
+    tournament_id INTEGER NOT NULL
+        REFERENCES tournaments(id) ON DELETE CASCADE,
+    players INTEGER NOT NULL,
+    matches INTEGER NOT NULL,
+    options TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    player_1 INTEGER NOT NULL,
+    name_1 TEXT NOT NULL,
+    -- 0 for a Bye-round
+    player_2 INTEGER NOT NULL DEFAULT 0,
+    name_2 TEXT,
+    PRIMARY KEY (tournament_id, players, matches, options, position)
+    );
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+#
+# tournament_async.py -- asyncio counterpart of tournament.py
+#
+# Every function is a coroutine, so an async web service can register
+# players, report results and draw rounds without ever blocking its
+# event loop:
+#
+#   postgres -- asynchronous psycopg2 connections drawn from a pool
+#               (storage/aiopostgres.py).
+#   sqlite, memory -- the synchronous backends of the storage package,
+#               called on a thread pool.
+#
+# The pairing search is CPU bound: it runs on an executor as well,
+# see configureExecutor().
+#
+# Coroutines apply to the default tournament, or to the one selected by
+# a Tournament with-block: the selection follows each asyncio task.
+#
+# Requires Python 3.7 or later.
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import os
+
+from ratings import computeRatings, getRatingSystem
+from storage import DEFAULT_BACKEND, DEFAULT_TOURNAMENT, createBackend
+from swisspairings import ENGINES, ENGINE_OPTIONS, PairingState
+from tournament import _roundRows, drawOptions
+
+
+_backend = None
+_executor = None
+_tournament = contextvars.ContextVar('tournament',
+                                     default=DEFAULT_TOURNAMENT)
+
+
+class ThreadedBackend(object):
+
+    """Run the methods of a synchronous storage backend on an executor,
+    e.g. storage.memory.MemoryBackend as an in-process stand-in for
+    PostgreSQL. Every method becomes a coroutine."""
+
+    def __init__(self, backend, executor=None):
+        """
+        Args:
+          backend: a storage.Backend.
+          executor: a concurrent.futures executor, the default executor
+            of the event loop if None.
+        """
+        self.backend = backend
+        self.executor = executor
+        # Locks of drawLock() and transaction(), by tournament, shared
+        # with the views returned by forTournament().
+        self.drawLocks = {}
+        self.transactionLocks = {}
+
+    def forTournament(self, tournament_id):
+        """Returns a ThreadedBackend working on another tournament,
+        see storage.Backend.forTournament()."""
+        backend = self.backend.forTournament(tournament_id)
+        if backend is self.backend:
+            return self
+        view = ThreadedBackend(backend, self.executor)
+        view.drawLocks = self.drawLocks
+        view.transactionLocks = self.transactionLocks
+        return view
+
+    @contextlib.asynccontextmanager
+    async def drawLock(self):
+        """Keep the other tasks of the event loop from drawing the
+        pairings of the tournament until the with-block ends. Sessions
+        of the synchronous backend belong to a thread, so the lock only
+        covers this process."""
+        tournament_id = self.backend.tournamentId
+        lock = self.drawLocks.setdefault(tournament_id, asyncio.Lock())
+        async with lock:
+            yield self
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """Keep the other tasks of the event loop out of transaction()
+        until the with-block ends, so that what they read and write
+        doesn't interleave. As with drawLock(), this only covers this
+        process."""
+        tournament_id = self.backend.tournamentId
+        lock = self.transactionLocks.setdefault(tournament_id,
+                                                asyncio.Lock())
+        async with lock:
+            yield self
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+
+        async def call(*args):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, functools.partial(method, *args)
+            )
+
+        return call
+
+
+class Tournament(object):
+
+    """Apply every coroutine of this module awaited inside the
+    with-block, in the current task, to another tournament than the
+    default one, see tournament.Tournament."""
+
+    def __init__(self, tournament_id):
+        self.tournamentId = tournament_id
+        self.__token = None
+
+    def __enter__(self):
+        self.__token = _tournament.set(self.tournamentId)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _tournament.reset(self.__token)
+        return False
+
+
+def currentTournament():
+    """Returns the ID of the tournament the coroutines of this module
+    apply to in the current task."""
+    return _tournament.get()
+
+
+def configureBackend(name=None, **options):
+    """Select the backend used by the coroutines of this module.
+    Any previously configured backend is left to be closed by the caller,
+    see closeBackend().
+
+    Args:
+      name: a key of storage.BACKENDS. When None, the TOURNAMENT_BACKEND
+        environment variable is used, as in tournament.py.
+      **options: passed to the backend constructor. With PostgreSQL,
+        *database* is the DSN and *maxconn* the size of the pool.
+
+    Returns:
+      The new backend.
+    """
+    global _backend
+
+    if name is None:
+        name = os.environ.get('TOURNAMENT_BACKEND', DEFAULT_BACKEND)
+    if not options and os.environ.get('TOURNAMENT_DATABASE'):
+        options['database'] = os.environ['TOURNAMENT_DATABASE']
+
+    if name == 'postgres':
+        from storage.aiopostgres import AsyncPostgresBackend
+        _backend = AsyncPostgresBackend(**options)
+    else:
+        _backend = ThreadedBackend(createBackend(name, **options))
+
+    return _backend
+
+
+def getBackend():
+    """Returns the configured backend, working on the current tournament,
+    configuring one from the environment if needed."""
+    if _backend is None:
+        configureBackend()
+    return _backend.forTournament(_tournament.get())
+
+
+async def closeBackend():
+    """Close the configured backend, if any."""
+    global _backend
+    if _backend is not None:
+        backend, _backend = _backend, None
+        await backend.close()
+
+
+def configureExecutor(executor):
+    """Select the executor running the pairing search.
+
+    The default executor of the event loop is a thread pool: the search
+    doesn't block the loop, but still competes with it for the GIL.
+    A concurrent.futures.ProcessPoolExecutor avoids that.
+
+    Args:
+      executor: a concurrent.futures executor, or None for the default
+        executor of the event loop.
+    """
+    global _executor
+    _executor = executor
+
+
+async def createTournament(name):
+    """Adds a tournament to the database and returns its ID,
+    see tournament.createTournament()."""
+    return await getBackend().createTournament(name)
+
+
+async def listTournaments():
+    """Returns a list of tuples (id, name) of the tournaments."""
+    return await getBackend().listTournaments()
+
+
+async def dropTournament(tournament_id):
+    """Throw a tournament away, with its players and matches,
+    see tournament.dropTournament()."""
+    await getBackend().dropTournament(tournament_id)
+
+
+async def deleteMatches():
+    """Remove all the match records from the database."""
+    await getBackend().deleteMatches()
+
+
+async def deletePlayers():
+    """Remove all the player records from the database."""
+    await getBackend().deletePlayers()
+
+
+async def countPlayers():
+    """Returns the number of players currently registered."""
+    return await getBackend().countPlayers()
+
+
+async def registerPlayer(name):
+    """Adds a player to the tournament and returns his or her ID."""
+    return await getBackend().registerPlayer(name)
+
+
+async def getPlayerID(name):
+    """Returns the player's ID given by the name."""
+    return await getBackend().getPlayerID(name)
+
+
+async def playerStandings():
+    """Returns a list of tuples (id, name, wins, ties, matches),
+    see tournament.playerStandings()."""
+    return await getBackend().playerStandings()
+
+
+async def standingsPage(after=None, limit=20):
+    """Returns a page of the standings, reading only the rows of the
+    page, see tournament.standingsPage()."""
+    return await getBackend().standingsPage(after, limit)
+
+
+async def reportMatch(player_1, player_2=0, player_1_result=1,
+                      player_2_result=0):
+    """Records the outcome of a single match, see tournament.reportMatch().
+
+    Returns:
+      The ID of the recorded match.
+    """
+    game_id = await getBackend().reportMatch(
+        player_1, player_2, player_1_result, player_2_result
+    )
+    await _rateRound([(player_1, player_2, player_1_result, player_2_result)])
+    return game_id
+
+
+async def _rateRound(rows):
+    """Update the ratings of the players of a round,
+    see tournament._rateRound(). The ratings are read and written back
+    in a transaction of their own, after the round:
+    tournament.rebuildRatings() brings them back in line if it fails."""
+    system = getRatingSystem()
+    rows = [row for row in rows if row[1] != 0]
+    if system is None or not rows:
+        return
+
+    player_ids = [player for row in rows for player in row[:2]]
+    player1, player2, result1, result2 = zip(*rows)
+    async with getBackend().transaction() as backend:
+        current = dict((player_id, (rating, deviation))
+                       for (player_id, name, rating, deviation)
+                       in await backend.playerRatings(player_ids))
+        await backend.updateRatings(computeRatings(
+            list(current), player1, player2, result1, result2, system,
+            current
+        ))
+
+
+async def reportRound(results):
+    """Records every result of a round at once,
+    see tournament.reportRound().
+
+    Returns:
+      A list with the id of each recorded match, in the same order
+      as results.
+    """
+    rows = _roundRows(results)
+    if not rows:
+        return []
+
+    game_ids = await getBackend().reportRound(rows)
+    await _rateRound(rows)
+    return game_ids
+
+
+async def playerRatings():
+    """Returns a list of tuples (id, name, rating, deviation),
+    highest rating first, see tournament.playerRatings()."""
+    return await getBackend().playerRatings()
+
+
+async def matchesHistory():
+    """Returns a list of tuples (id1, id2) of the matches played."""
+    return await getBackend().matchesHistory()
+
+
+async def pairingSnapshot():
+    """Returns a tuple (standings, opponents) read from one consistent
+    snapshot, see tournament.pairingSnapshot()."""
+    return await getBackend().pairingSnapshot()
+
+
+async def updatePairingState(state=None, attempts=3):
+    """Bring a PairingState up to date with the database,
+    see tournament.updatePairingState().
+
+    Returns:
+      The updated state.
+    """
+    if state is None:
+        state = PairingState()
+
+    return await _updateState(getBackend(), state, attempts)
+
+
+async def _updateState(backend, state, attempts=3):
+    """Bring a PairingState up to date with a backend,
+    see updatePairingState()."""
+    for attempt in range(attempts):
+        changes = await backend.changesSince(
+            state.lastPlayerId, state.lastMatchId
+        )
+        if state.apply(*changes):
+            return state
+        state.clear()
+
+    raise RuntimeError(
+        "The pairing state couldn't catch up with the database")
+
+
+def _drawPairings(engine, standings, opponents):
+    """Run the pairing search, on the executor."""
+    return ENGINES[engine](standings, opponents=opponents,
+                           **ENGINE_OPTIONS.get(engine, {})).getPairings()
+
+
+async def swissPairings(engine='greedy', state=None):
+    """Returns a list of pairs of players for the next round,
+    see tournament.swissPairings(): the round is drawn once, and
+    concurrent callers wait for the draw, then read it.
+
+    The pairing search runs on the executor selected with
+    configureExecutor(), so that it never blocks the event loop.
+    """
+    backend = getBackend()
+    options = drawOptions(engine)
+    key, pairings = await backend.drawnPairings(options)
+    if pairings is not None:
+        return pairings
+
+    # Queries made while the lock is held go through the backend
+    # yielded by drawLock(), see AsyncPostgresBackend.drawLock().
+    async with backend.drawLock() as locked:
+        key, pairings = await locked.drawnPairings(options)
+        if pairings is None:
+            pairings = await _searchPairings(locked, engine, state)
+            await locked.saveDraw(key, options, pairings)
+
+    return pairings
+
+
+async def _searchPairings(backend, engine, state):
+    """Read the standings and history from a backend, then run the
+    pairing search on the executor."""
+    if state is not None:
+        await _updateState(backend, state)
+        standings, opponents = state.standings(), state.opponents
+    else:
+        standings, opponents = await backend.pairingSnapshot()
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, _drawPairings, engine, standings, opponents
+    )
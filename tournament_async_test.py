@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+#
+# Test cases for tournament_async.py
+#
+# Uses the backend selected by TOURNAMENT_BACKEND, like tournament_test.py:
+# TOURNAMENT_BACKEND=memory runs them without any database.
+
+import asyncio
+
+from ratings import Elo, configureRatings, computeRatings
+from swisspairings import PairingState
+from tournament_async import *
+
+
+async def testConcurrentRegister():
+    await deleteMatches()
+    await deletePlayers()
+    player_ids = await asyncio.gather(*[
+        registerPlayer("Player %d" % i) for i in range(32)
+    ])
+    if len(set(player_ids)) != 32:
+        raise ValueError("Each registered player should get his own ID.")
+    c = await countPlayers()
+    if c != 32:
+        raise ValueError(
+            "After registering 32 players concurrently, countPlayers() "
+            "should be 32, got %r." % c)
+    print("1. Players can be registered concurrently.")
+
+
+async def testConcurrentReports():
+    await deleteMatches()
+    await deletePlayers()
+    for i in range(9):
+        await registerPlayer("Player %d" % i)
+    pairings = await swissPairings()
+    # Every scorer terminal reports its own board at the same time.
+    game_ids = await asyncio.gather(*[
+        reportMatch(id1, id2 or 0, 1, 0)
+        for (id1, name1, id2, name2) in pairings
+    ])
+    if len(set(game_ids)) != 5:
+        raise ValueError("Each reported match should get its own ID.")
+    for (i, n, w, t, m) in await playerStandings():
+        if m != 1:
+            raise ValueError("Each player should have one match recorded.")
+    print("2. Results can be reported concurrently.")
+
+
+async def testReportRound():
+    await deleteMatches()
+    await deletePlayers()
+    for i in range(4):
+        await registerPlayer("Player %d" % i)
+    [id1, id2, id3, id4] = [row[0] for row in await playerStandings()]
+    try:
+        await reportRound([(id1, id2, 1, 0), (id2, id3, 0.5, 0.5)])
+    except ValueError:
+        pass
+    else:
+        raise ValueError(
+            "reportRound() should reject a player playing twice in a round.")
+    system = configureRatings('elo')
+    try:
+        game_ids = await reportRound([(id1, id2, 1, 0), (id3, id4, 0.5, 0.5)])
+    finally:
+        configureRatings(system)
+    if len(game_ids) != 2 or len(await matchesHistory()) != 2:
+        raise ValueError("reportRound() should record the whole round.")
+    ratings = dict((row[0], row[2]) for row in await playerRatings())
+    if not ratings[id1] > ratings[id3] == ratings[id4] > ratings[id2]:
+        raise ValueError("reportRound() should update the ratings.")
+    print("3. A whole round can be reported at once.")
+
+
+async def testWholeTournament():
+    await deleteMatches()
+    await deletePlayers()
+    for i in range(16):
+        await registerPlayer("Player %d" % i)
+    state = PairingState()
+    rounds = 0
+    while True:
+        pairings = await swissPairings('weighted', state)
+        if not pairings:
+            break
+        await reportRound([(id1, id2 or 0, 1, 0)
+                           for (id1, name1, id2, name2) in pairings])
+        rounds += 1
+    if rounds != 4:
+        raise ValueError("A tournament of 16 players should last 4 rounds.")
+    history = [frozenset(match) for match in await matchesHistory()]
+    if len(history) != len(set(history)):
+        raise ValueError("Players should never re-match.")
+    if state.matches != len(history):
+        raise ValueError("The pairing state should follow every round.")
+    print("4. A whole tournament can be played without blocking the loop.")
+
+
+async def registerIn(tournament_id, count):
+    with Tournament(tournament_id):
+        await asyncio.gather(*[
+            registerPlayer("Player %d" % i) for i in range(count)
+        ])
+        return await countPlayers()
+
+
+async def testTournaments():
+    await deletePlayers()
+    first = await createTournament("First")
+    second = await createTournament("Second")
+    # Each task keeps its own tournament while they run concurrently.
+    counts = await asyncio.gather(registerIn(first, 3),
+                                  registerIn(second, 5))
+    if counts != [3, 5] or await countPlayers() != 0:
+        raise ValueError("Tournaments should not share players.")
+    await dropTournament(first)
+    await dropTournament(second)
+    if first in dict(await listTournaments()):
+        raise ValueError("dropTournament() should remove the tournament.")
+    print("5. Concurrent tasks can work on different tournaments.")
+
+
+async def testSingleFlightPairings():
+    await deleteMatches()
+    await deletePlayers()
+    for i in range(10):
+        await registerPlayer("Player %d" % i)
+    draws = await asyncio.gather(*[swissPairings() for i in range(8)])
+    if any(draw != draws[0] for draw in draws):
+        raise ValueError("Concurrent callers should get the same draw.")
+    await reportRound([(p1, p2, 1, 0) for (p1, n1, p2, n2) in draws[0]])
+    # More callers than the 10 connections of the default PostgreSQL
+    # pool: those waiting for the lock must not starve its holder.
+    draws = await asyncio.wait_for(
+        asyncio.gather(*[swissPairings() for i in range(25)]), 60
+    )
+    if any(draw != draws[0] for draw in draws):
+        raise ValueError("Concurrent callers should get the same draw.")
+    if await swissPairings() != draws[0]:
+        raise ValueError("The draw should be stored for later callers.")
+    await reportRound([(p1, p2, 1, 0) for (p1, n1, p2, n2) in draws[0]])
+    if await swissPairings() == draws[0]:
+        raise ValueError("Reported results should lead to a new draw.")
+    print("6. Each round is drawn once for concurrent callers.")
+
+
+async def testDuplicateReports():
+    await deleteMatches()
+    await deletePlayers()
+    id1 = await registerPlayer("Player 1")
+    id2 = await registerPlayer("Player 2")
+    # Two scorers enter the same board at the same time.
+    results = await asyncio.gather(*[
+        reportMatch(id1, id2, 1, 0) for i in range(4)
+    ], return_exceptions=True)
+    rejected = [r for r in results if isinstance(r, ValueError)]
+    if len(rejected) != 3 or len(await matchesHistory()) != 1:
+        raise ValueError("A match should only be recorded once.")
+    print("7. Duplicate reports are rejected.")
+
+
+async def testConcurrentRatings():
+    await deleteMatches()
+    await deletePlayers()
+    player_ids = [await registerPlayer("Player %d" % i) for i in range(11)]
+    leader, opponents = player_ids[0], player_ids[1:]
+    # The leader's games are reported at the same time: each update of
+    # the leader's rating must build on the previous one.
+    configureRatings(Elo())
+    try:
+        await asyncio.gather(*[
+            reportMatch(leader, opponent, 1, 0) for opponent in opponents
+        ])
+    finally:
+        configureRatings(None)
+    expected = computeRatings(player_ids, [leader] * 10, opponents,
+                              [1] * 10, [0] * 10, Elo())
+    ratings = dict((row[0], row[2]) for row in await playerRatings())
+    if abs(ratings[leader] - expected[leader][0]) > 1e-6:
+        raise ValueError("Concurrent reports shouldn't lose rating updates.")
+    print("8. Concurrent reports update the ratings one after the other.")
+
+
+async def main():
+    try:
+        await testConcurrentRegister()
+        await testConcurrentReports()
+        await testReportRound()
+        await testWholeTournament()
+        await testTournaments()
+        await testSingleFlightPairings()
+        await testDuplicateReports()
+        await testConcurrentRatings()
+    finally:
+        await closeBackend()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
+    print("\n")
+    print("Success!  All tests pass!")
@@ -4,14 +4,31 @@
 
 import random
 import math
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
 from tournament import *
+from swisspairings import Draw, WeightedDraw, BracketDraw
+from swisspairings import InfeasibleRoundError
+from swisspairings import PairingState
+from simulation import simulate, EloResults
+import instrumentation
+from export import exportMatches, exportStandings, openOutput
+import pair
+from ratings import Elo, Glicko, computeRatings
+from leaderboard import Leaderboard
+from storage.journal import JournalBackend, replay
 
 
 class TournamentSimulation():
 
     """Helper class to set up and simulate a Swiss System chess tournament."""
 
-    def __init__(self, players_list):
+    def __init__(self, players_list, engine='greedy'):
+        self.engine = engine
         self.possibleOutcomes = [
             [1, 0],
             [0.5, 0.5],
@@ -25,7 +42,7 @@ class TournamentSimulation():
 
     def execute(self):
 
-        pairings = swissPairings()
+        pairings = swissPairings(self.engine)
 
         if len(pairings):
             for pair in pairings:
@@ -251,6 +268,741 @@ def testEvenPlayersTournament():
             "Number of rounds to be played must be equal or greater than log2(n_of_players)")  # noqa
 
 
+def testSession():
+    deleteMatches()
+    deletePlayers()
+    with Session():
+        registerPlayer("Twilight Sparkle")
+        registerPlayer("Fluttershy")
+    if countPlayers() != 2:
+        raise ValueError(
+            "Players registered inside a Session should be committed.")
+    try:
+        with Session():
+            registerPlayer("Applejack")
+            raise RuntimeError("Abort the session")
+    except RuntimeError:
+        pass
+    if countPlayers() != 2:
+        raise ValueError(
+            "A Session that fails should roll back all of its operations.")
+    [id1, id2] = [row[0] for row in playerStandings()]
+    reportMatch(id1, id2)
+    try:
+        with Session():
+            deleteMatches()
+            reportMatch(id2, id1)
+            raise RuntimeError("Abort the session")
+    except RuntimeError:
+        pass
+    if matchesHistory() != [(id1, id2)] or playerStandings()[0][0] != id1:
+        raise ValueError("A Session that fails should roll back a delete.")
+    print "13. A Session commits or rolls back all of its operations at once."
+
+
+def testReportRound():
+    deleteMatches()
+    deletePlayers()
+    registerPlayer("Bruno Walton")
+    registerPlayer("Boots O'Neal")
+    registerPlayer("Cathy Burton")
+    registerPlayer("Diane Grant")
+    registerPlayer("Lucky Luke")
+    standings = playerStandings()
+    [id1, id2, id3, id4, id5] = [row[0] for row in standings]
+    try:
+        reportRound([(id1, id2, 1, 0), (id2, id3, 0.5, 0.5)])
+    except ValueError:
+        pass
+    else:
+        raise ValueError(
+            "reportRound() should reject a player playing twice in a round.")
+    if len(matchesHistory()) != 0:
+        raise ValueError("A rejected round should not record any match.")
+    game_ids = reportRound([(id1, id2, 1, 0), (id3, id4, 0.5, 0.5), (id5,)])
+    if len(game_ids) != 3:
+        raise ValueError("reportRound() should return one id per match.")
+    for (i, n, w, t, m) in playerStandings():
+        if m != 1:
+            raise ValueError("Each player should have one match recorded.")
+        if i in (id1, id5) and w != 1:
+            raise ValueError("Winners and byes should have one win recorded.")
+        if i in (id3, id4) and t != 1:
+            raise ValueError("Each tied player should have one tie recorded.")
+    print "14. A whole round can be reported at once."
+
+
+def testStandingsConsistency():
+    deleteMatches()
+    deletePlayers()
+    registerPlayer("Melpomene Murray")
+    registerPlayer("Randy Schwartz")
+    registerPlayer("Lucky Luke")
+    [id1, id2, id3] = [row[0] for row in playerStandings()]
+    reportMatch(id1, id2, 0.5, 0.5)
+    reportMatch(id3)
+    if verifyStandings():
+        raise ValueError(
+            "The standings table should match the recorded outcomes.")
+    rebuildStandings()
+    standings = playerStandings()
+    if standings[0][0] != id3 or standings[0][2] != 1:
+        raise ValueError("Rebuilding should keep the player with a bye first.")
+    deleteMatches()
+    if verifyStandings():
+        raise ValueError("Deleting matches should update the standings table.")
+    print "15. The standings table stays consistent with the outcomes."
+
+
+def testWeightedPairingsTournament():
+    # 9 players
+    players = [
+        "Giancarlo Soverini",
+        "Leonardo Sarallo",
+        "Nicolo Micheletti",
+        "Ugo Pecchioli",
+        "Marco Van Basten",
+        "Michele Pratesi",
+        "Mario Suarez",
+        "Superman",
+        "Donald Trump"
+    ]
+
+    simulation = TournamentSimulation(players, engine='weighted')
+    simulation.execute()
+    standings = playerStandings()
+    match_history = matchesHistory()
+
+    matches = [frozenset(match) for match in match_history]
+    if len(matches) != len(set(matches)):
+        raise ValueError("Some players have either re-matched or have more than one Bye-round")  # noqa
+    if standings[0][4] < math.log((countPlayers()), 2):
+        raise ValueError(
+            "Number of rounds to be played must be equal or greater than log2(n_of_players)")  # noqa
+
+    # Each player has already met the next WINDOW players in the
+    # standings, so the window has to grow to find the round.
+    window = WeightedDraw.WINDOW
+    standings = [(i, "Player %d" % i, 0, 0, 1) for i in range(80)]
+    history = [(i, j) for i in range(80)
+               for j in range(i + 1, min(80, i + 1 + window))]
+    draw = WeightedDraw(standings, history)
+    if draw.window != window or len(draw.getPairings()) != 40:
+        raise ValueError(
+            "WeightedDraw should widen its default window when needed.")
+
+    print "16. The weighted pairing engine plays a whole tournament without rematches"  # noqa
+
+
+def testInfeasibleRound():
+    # Player 1 has already played against everybody else
+    standings = [
+        (1, "Bruno Walton", 3, 0, 3),
+        (2, "Boots O'Neal", 1, 0, 3),
+        (3, "Cathy Burton", 1, 0, 3),
+        (4, "Diane Grant", 1, 0, 3)
+    ]
+    history = [(1, 2), (1, 3), (1, 4), (2, 3), (3, 4), (2, 4)]
+    for engine in (Draw, WeightedDraw, BracketDraw):
+        try:
+            engine(standings, history).getPairings()
+        except InfeasibleRoundError as e:
+            if 1 not in e.unpaired:
+                raise ValueError(
+                    "The error should report the players left out.")
+        else:
+            raise ValueError(
+                "Drawing an impossible round should raise an error.")
+    print "17. Drawing an impossible round raises InfeasibleRoundError."
+
+
+def testSimulation():
+    statistics = None
+    for statistics in simulate(20, 9, engine='weighted', model=EloResults(),
+                               processes=1):
+        pass
+    summary = statistics.summary()
+    if summary['tournaments'] != 20:
+        raise ValueError("Every simulated tournament should be counted.")
+    if summary['rematches'] != 0:
+        raise ValueError("Simulated tournaments should have no rematches.")
+    if min(int(rounds) for rounds in summary['rounds']) < math.log(9, 2):
+        raise ValueError(
+            "Simulated tournaments should play at least log2(n_of_players) rounds.")  # noqa
+    print "18. Tournaments can be simulated in memory."
+
+
+def testInstrumentation():
+    deleteMatches()
+    deletePlayers()
+    for i in range(6):
+        registerPlayer("Player %d" % i)
+    stats = instrumentation.addHook(instrumentation.Stats())
+    try:
+        swissPairings()
+    finally:
+        instrumentation.removeHook(stats)
+    summary = stats.summary()
+    if summary['swissPairings']['calls'] != 1:
+        raise ValueError("swissPairings() should send one event per call.")
+    if summary['pairingSnapshot']['calls'] != 1:
+        raise ValueError("Nested calls should send their own events.")
+    if summary['Draw.getPairings']['passes'] < 1:
+        raise ValueError("Draw events should carry the search counters.")
+    countPlayers()
+    if stats.summary() != summary:
+        raise ValueError("Removed hooks should not receive events.")
+    print "19. Instrumentation hooks receive timings and counters."
+
+
+def testPairingSnapshot():
+    deleteMatches()
+    deletePlayers()
+    for i in range(5):
+        registerPlayer("Player %d" % i)
+    [id1, id2, id3, id4, id5] = [row[0] for row in playerStandings()]
+    reportRound([(id1, id2, 1, 0), (id3, id4, 0.5, 0.5), (id5,)])
+    reportMatch(id1, id3, 0, 1)
+    standings, opponents = pairingSnapshot()
+    if standings != [tuple(row) for row in playerStandings()]:
+        raise ValueError("The snapshot should hold the current standings.")
+    expected = {id1: set([id2, id3]), id2: set([id1]), id3: set([id4, id1]),
+                id4: set([id3]), id5: set([0])}
+    if opponents != expected:
+        raise ValueError(
+            "The snapshot should hold each player's opponents and byes.")
+    print "20. Standings and opponents are read from one snapshot."
+
+
+def testPairingState():
+    deleteMatches()
+    deletePlayers()
+    for i in range(7):
+        registerPlayer("Player %d" % i)
+    state = PairingState()
+    for round_number in range(2):
+        pairings = swissPairings('weighted', state)
+        reportRound([(id1, id2 or 0, 1, 0)
+                     for (id1, name1, id2, name2) in pairings])
+    state = PairingState.loads(state.dumps())
+    updatePairingState(state)
+    if (state.standings(), state.opponents) != pairingSnapshot():
+        raise ValueError(
+            "The pairing state should match the stored standings and history.")  # noqa
+    deleteMatches()
+    updatePairingState(state)
+    if state.matches != 0 or state.opponents:
+        raise ValueError("Deleted matches should be dropped from the state.")
+    print "21. The pairing state can be carried across rounds and restarts."
+
+
+def testCache():
+    deleteMatches()
+    deletePlayers()
+    for i in range(4):
+        registerPlayer("Player %d" % i)
+    directory = tempfile.mkdtemp()
+    try:
+        configureCache(FileStore(directory, maxsize=3))
+        standings = playerStandings()
+        pairings = swissPairings()
+        [id1, id2, id3, id4] = [row[0] for row in standings]
+        # Written behind the cache's back: reads are still served
+        # from the cache.
+        getBackend().reportMatch(id1, id2, 1, 0)
+        if playerStandings() != standings or swissPairings() != pairings:
+            raise ValueError("Reads should be served from the cache.")
+        # Another process sharing the cache directory reports a match.
+        FileStore(directory).bump()
+        if playerStandings() == standings:
+            raise ValueError("A new revision should invalidate the cache.")
+        reportMatch(id3, id4, 1, 0)
+        for (i, n, w, t, m) in playerStandings():
+            if m != 1:
+                raise ValueError("reportMatch() should invalidate the cache.")
+        for i in range(5):
+            getPlayerID("Player %d" % i)
+        entries = [name for name in os.listdir(directory)
+                   if name.endswith('.entry')]
+        if len(entries) > 3:
+            raise ValueError("The cache should evict entries beyond maxsize.")
+    finally:
+        configureCache(None)
+        shutil.rmtree(directory)
+    print "22. Reads are cached until the next write."
+
+
+def testTiebreaks():
+    deleteMatches()
+    deletePlayers()
+    for name in ["Anna", "Bert", "Carl", "Dora"]:
+        registerPlayer(name)
+    [id1, id2, id3, id4] = [getPlayerID(name)[0]
+                            for name in ["Anna", "Bert", "Carl", "Dora"]]
+    reportRound([(id1, id2, 1, 0), (id3, id4, 0.5, 0.5)])
+    reportRound([(id1, id4, 1, 0), (id2, id3, 1, 0)])
+    standings = rankedStandings()
+    if [row[0] for row in standings] != [id1, id2, id4, id3]:
+        raise ValueError(
+            "Tied players should be ranked by their Buchholz score.")
+    expected = {
+        id1: (1.5, 1.5, 1.5, 3),
+        id2: (2.5, 2.5, 0.5, 1),
+        id3: (1.5, 1.5, 0.25, 1),
+        id4: (2.5, 2.5, 0.25, 1),
+    }
+    for row in standings:
+        if tuple(row[5:]) != expected[row[0]]:
+            raise ValueError(
+                "Buchholz, median-Buchholz, Sonneborn-Berger and cumulative "
+                "scores should be %r, got %r." % (expected[row[0]], row[5:]))
+    print "23. Tiebreaks rank players with the same wins and ties."
+
+
+def testStreamingExport():
+    deleteMatches()
+    deletePlayers()
+    for i in range(5):
+        registerPlayer("Player %d" % i)
+    [id1, id2, id3, id4, id5] = [row[0] for row in playerStandings()]
+    reportRound([(id1, id2, 1, 0), (id3, id4, 0.5, 0.5), (id5,)])
+    if list(streamStandings(fetch_size=2)) != list(playerStandings()):
+        raise ValueError("streamStandings() should generate the standings.")
+    matches = list(streamMatches(fetch_size=2))
+    if [(row[2], row[3], row[4], row[5]) for row in matches] != [
+            (id1, id2, 1, 0), (id3, id4, 0.5, 0.5), (id5, 0, 1, None)]:
+        raise ValueError("streamMatches() should join the outcomes in.")
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'matches.jsonl')
+        with open(path, 'w') as output:
+            exportMatches(output, 'jsonl', fetch_size=2)
+        with open(path) as exported:
+            records = [json.loads(line) for line in exported]
+        if [record['player_1_result'] for record in records] != [1, 0.5, 1]:
+            raise ValueError("Every match should be exported.")
+        path = os.path.join(directory, 'standings.csv')
+        with openOutput(path) as output:
+            if exportStandings(output) != 5:
+                raise ValueError("Every player should be exported.")
+        with open(path, 'rb') as exported:
+            lines = exported.read().split(b'\r\n')
+        if len(lines) != 7 or b'\r' in b''.join(lines):
+            raise ValueError("CSV rows should end with a single CRLF.")
+    finally:
+        shutil.rmtree(directory)
+    print "24. History and standings can be streamed and exported."
+
+
+def testRegisterPlayers():
+    deleteMatches()
+    deletePlayers()
+    names = ["Player %d" % i for i in range(50)]
+    player_ids = registerPlayers(
+        names[:25] + [(name, "2015-06-01") for name in names[25:]]
+    )
+    if countPlayers() != 50:
+        raise ValueError("registerPlayers() should register every player.")
+    if player_ids != [getPlayerID(name)[0] for name in names]:
+        raise ValueError("IDs should be returned in the order of the names.")
+    try:
+        registerPlayers(["Late Player", ("Broken", "entry", "here")])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("registerPlayers() should reject invalid entries.")
+    if countPlayers() != 50:
+        raise ValueError("A rejected batch should not register anybody.")
+    print "25. Many players can be registered at once."
+
+
+def testBracketPairings():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Player %d" % i for i in range(41)])
+    rounds = 0
+    pool = multiprocessing.Pool(2)
+    while True:
+        standings, opponents = pairingSnapshot()
+        draw = BracketDraw(standings, opponents=opponents, segment=8,
+                           pool=pool)
+        pairings = draw.getPairings()
+        if not pairings:
+            break
+        if rounds == 0 and draw.counters()['segments'] < 2:
+            raise ValueError("The field should be split into segments.")
+        paired = [player_id for (id1, name1, id2, name2) in pairings
+                  for player_id in (id1, id2) if player_id]
+        if len(paired) != 41 or len(set(paired)) != 41:
+            raise ValueError("Each player should be paired exactly once.")
+        reportRound([(id1, id2 or 0) + random.choice([(1, 0), (0.5, 0.5),
+                                                      (0, 1)])
+                     if id2 else (id1, 0, 1, 0)
+                     for (id1, name1, id2, name2) in pairings])
+        rounds += 1
+    pool.terminate()
+    pool.join()
+    if rounds != 6:
+        raise ValueError("A tournament of 41 players should last 6 rounds.")
+    matches = [frozenset(match) for match in matchesHistory()]
+    if len(matches) != len(set(matches)):
+        raise ValueError("Some players have either re-matched or have more than one Bye-round")  # noqa
+
+    # The last segment can't be paired on its own: 5 and 6 have already
+    # met, so it gets merged with the previous one.
+    standings = [(i, "Player %d" % i, 0, 0, 1) for i in range(1, 7)]
+    draw = BracketDraw(standings, [(5, 6)], segment=2, processes=1)
+    pairings = draw.getPairings()
+    if draw.counters()['merges'] != 1 or len(pairings) != 3 or \
+            set([5, 6]) in [set([id1, id2])
+                            for (id1, name1, id2, name2) in pairings]:
+        raise ValueError("Adjacent segments should be merged when needed.")
+    print "26. Score brackets can be paired in parallel without rematches."
+
+
+def testOfflinePairing():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Player %d" % i for i in range(7)])
+    for i in range(2):
+        reportRound([(id1, id2 or 0, 1, 0)
+                     for (id1, name1, id2, name2) in swissPairings()])
+    directory = tempfile.mkdtemp()
+    try:
+        standings_path = os.path.join(directory, 'standings.csv')
+        with open(standings_path, 'w') as output:
+            exportStandings(output)
+        history_path = os.path.join(directory, 'matches.jsonl')
+        with open(history_path, 'w') as output:
+            exportMatches(output, 'jsonl')
+
+        with open(standings_path) as source:
+            standings = pair.readStandings(pair.readRows(source, 'csv'))
+        if [row[0] for row in standings] != [row[0] for row in
+                                             playerStandings()]:
+            raise ValueError("The standings should be read in rank order.")
+        with open(history_path) as source:
+            pairings = pair.drawRound(
+                standings, pair.readHistory(pair.readRows(source, 'jsonl')),
+                'weighted')
+    finally:
+        shutil.rmtree(directory)
+
+    played = set(frozenset(match) for match in matchesHistory())
+    paired = [player_id for (id1, name1, id2, name2) in pairings
+              for player_id in (id1, id2) if player_id]
+    if len(paired) != 7 or len(set(paired)) != 7:
+        raise ValueError("Each player should be paired exactly once.")
+    if any(frozenset((id1, id2 or 0)) in played
+           for (id1, name1, id2, name2) in pairings):
+        raise ValueError("Offline pairings should not allow rematches.")
+    print "27. Rounds can be drawn offline out of exported files."
+
+
+def testRatings():
+    deleteMatches()
+    deletePlayers()
+    [id1, id2, id3, id4] = registerPlayers(["Player %d" % i for i in range(4)])
+    reportMatch(id1, id2, 1, 0)
+    if any(row[2] != 1500 for row in playerRatings()):
+        raise ValueError("Ratings should be off by default.")
+    deleteMatches()
+
+    system = configureRatings('elo')
+    try:
+        reportRound([(id1, id2, 1, 0), (id3, id4, 0.5, 0.5)])
+        reportMatch(id1, id3, 1, 0)
+        reportMatch(id2, id4, 0, 1)
+    finally:
+        configureRatings(system)
+    ratings = playerRatings()
+    if [row[0] for row in ratings] != [id1, id4, id3, id2]:
+        raise ValueError("Ratings should follow the reported results.")
+    if abs(sum(row[2] for row in ratings) - 4 * 1500) > 1e-6:
+        raise ValueError("Elo should only move points between players.")
+    # Within a round, ratings move against the ratings before the round.
+    expected = computeRatings([id1, id2, id3, id4],
+                              [id1, id3, id1, id2], [id2, id4, id3, id4],
+                              [1, 0.5, 1, 0], [0, 0.5, 0, 1], Elo())
+    for (player_id, name, rating, deviation) in ratings:
+        if abs(rating - expected[player_id][0]) > 1e-6:
+            raise ValueError("Reported and recomputed ratings should match.")
+
+    rebuildRatings(Glicko())
+    ratings = playerRatings()
+    if [row[0] for row in ratings] != [id1, id4, id3, id2]:
+        raise ValueError("rebuildRatings() should rate the whole history.")
+    if not all(row[3] < 350 for row in ratings):
+        raise ValueError("Glicko deviations should shrink with each game.")
+
+    rebuildRatings()
+    standings, opponents = pairingSnapshot()
+    rated = dict((row[0], row[2]) for row in playerRatings())
+    pairings = swissPairings(ratings=True)
+    if not (Draw(standings, opponents=opponents, ratings=rated)
+            .getPairings() == pairings):
+        raise ValueError("swissPairings() should rank equal scores by rating.")
+    deleteMatches()
+    if any(row[2] != 1500 for row in playerRatings()):
+        raise ValueError("deleteMatches() should reset the ratings.")
+    print "28. Ratings are updated as results are reported."
+
+
+def testTournaments():
+    deleteMatches()
+    deletePlayers()
+    [id1, id2] = registerPlayers(["Default 1", "Default 2"])
+    reportMatch(id1, id2, 1, 0)
+    spring = createTournament("Spring open")
+    autumn = createTournament("Autumn open")
+    names = dict(listTournaments())
+    if names.get(spring) != "Spring open" or autumn not in names:
+        raise ValueError("listTournaments() should list the new tournaments.")
+    configureCache(MemoryStore())
+    try:
+        with Tournament(spring):
+            for i in range(4):
+                registerPlayer("Spring %d" % i)
+            if countPlayers() != 4:
+                raise ValueError("Players should be counted per tournament.")
+            pairings = swissPairings()
+            reportRound([(p1, p2, 1, 0) for (p1, n1, p2, n2) in pairings])
+            if len(matchesHistory()) != 2:
+                raise ValueError("Matches should be kept per tournament.")
+        with Tournament(autumn):
+            registerPlayer("Autumn")
+            if countPlayers() != 1 or playerStandings()[0][4] != 0:
+                raise ValueError("Tournaments should not share players.")
+        if countPlayers() != 2 or len(matchesHistory()) != 1:
+            raise ValueError("The default tournament should be unaffected.")
+    finally:
+        configureCache(None)
+    dropTournament(spring)
+    dropTournament(autumn)
+    if spring in dict(listTournaments()):
+        raise ValueError("dropTournament() should remove the tournament.")
+    if countPlayers() != 2:
+        raise ValueError("dropTournament() should leave others untouched.")
+    print "29. Tournaments are kept apart."
+
+
+def testSingleFlightPairings():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Player %d" % i for i in range(16)])
+    results = []
+    errors = []
+
+    def draw():
+        try:
+            results.append(swissPairings())
+        except Exception as e:
+            errors.append(e)
+
+    stats = instrumentation.addHook(instrumentation.Stats())
+    try:
+        threads = [threading.Thread(target=draw) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        instrumentation.removeHook(stats)
+    if errors:
+        raise errors[0]
+    if len(results) != 8 or any(r != results[0] for r in results):
+        raise ValueError("Concurrent callers should get the same draw.")
+    if stats.summary()['Draw.getPairings']['calls'] != 1:
+        raise ValueError("A round should be drawn only once.")
+    weighted = swissPairings('weighted')
+    if (getBackend().drawnPairings(drawOptions('weighted'))[1] != weighted or
+            getBackend().drawnPairings(drawOptions())[1] != results[0]):
+        raise ValueError("Draws with other options should be stored apart.")
+    reportRound([(p1, p2, 1, 0) for (p1, n1, p2, n2) in results[0]])
+    pairings = swissPairings()
+    if pairings == results[0]:
+        raise ValueError("Reported results should lead to a new draw.")
+    # Results can be reported while another round is being drawn.
+    reporter = threading.Thread(target=reportMatch, args=pairings[0][::2])
+    with getBackend().drawLock():
+        reporter.start()
+        reporter.join(10)
+    if reporter.is_alive() or len(matchesHistory()) != 9:
+        raise ValueError("Drawing a round shouldn't block the results.")
+    print "30. Each round is drawn once for concurrent callers."
+
+
+def testLeaderboard():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Player %d" % i for i in range(11)])
+    board = updateLeaderboard(Leaderboard(seed=1))
+    for i in range(3):
+        results = []
+        for k, (id1, n1, id2, n2) in enumerate(swissPairings()):
+            if id2 and k % 3 == 0:
+                results.append((id1, id2, 0.5, 0.5))
+            else:
+                results.append((id1, id2, 1, 0))
+        reportRound(results)
+        updateLeaderboard(board)
+        standings = playerStandings()
+        if board.topK(len(standings) + 1) != standings:
+            raise ValueError("The leaderboard should follow the standings.")
+        for rank, row in enumerate(standings, 1):
+            if board.rankOf(row[0]) != rank or board.player(rank) != row:
+                raise ValueError("Ranks should match the standings.")
+    if board.topK(3) != standings[:3] or board.page(standings[3], 4) != \
+            standings[4:8]:
+        raise ValueError("Leaderboard pages should follow the standings.")
+    pages = []
+    page = standingsPage(None, 4)
+    while page:
+        pages.extend(page)
+        page = standingsPage(page[-1], 4)
+    if pages != standings:
+        raise ValueError("Standings pages should follow the standings.")
+    deletePlayers()
+    if len(updateLeaderboard(board)) != 0:
+        raise ValueError("The leaderboard should be rebuilt after deletes.")
+    print "31. The leaderboard ranks players as results are reported."
+
+
+def testJournal():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'tournament.journal')
+    try:
+        backend = JournalBackend(path)
+        ids = backend.registerPlayers([("Player %d" % i, None)
+                                       for i in range(5)])
+        backend.reportRound([(ids[0], ids[1], 1, 0),
+                             (ids[2], ids[3], 0.5, 0.5), (ids[4], 0, 1, 0)])
+        try:
+            with backend.session():
+                backend.reportMatch(ids[0], ids[2], 1, 0)
+                raise ValueError("Rolled back")
+        except ValueError:
+            pass
+        backend.updateRatings({ids[0]: (1600.0, 300.0)})
+        spring = backend.createTournament("Spring")
+        backend.forTournament(spring).registerPlayer("Spring player")
+        backend.dropTournament(backend.createTournament("Dropped"))
+        snapshot = backend.pairingSnapshot()
+        ratings = backend.playerRatings()
+        backend.close()
+
+        backend = JournalBackend(path)
+        if backend.pairingSnapshot() != snapshot or \
+                backend.playerRatings() != ratings:
+            raise ValueError("Replaying the journal should restore "
+                             "the standings, history and ratings.")
+        if [t for (t, name) in backend.listTournaments()] != [1, spring] \
+                or backend.forTournament(spring).countPlayers() != 1:
+            raise ValueError("Replaying the journal should restore "
+                             "the tournaments.")
+        if replay(path)[0].pairingSnapshot() != snapshot:
+            raise ValueError("A journal should be a replay source.")
+
+        backend.deletePlayers()
+        ids = backend.registerPlayers([("Player %d" % i, None)
+                                       for i in range(4)])
+        backend.reportMatch(ids[0], ids[1], 1, 0)
+        snapshot = backend.pairingSnapshot()
+        size = os.path.getsize(path)
+        if backend.compact() >= size:
+            raise ValueError("Compaction should leave out deleted records.")
+        player_id = backend.registerPlayer("Late player")
+        backend.close()
+
+        # A record torn by a crash is cut off.
+        with open(path, 'ab') as journal:
+            journal.write(b'M\0\0\0')
+        backend = JournalBackend(path)
+        if backend.pairingSnapshot()[1] != snapshot[1] or \
+                backend.getPlayerID("Late player") != (player_id,):
+            raise ValueError("A compacted journal should replay the same.")
+        if backend.registerPlayer("Next player") != player_id + 1:
+            raise ValueError("IDs should keep growing after a replay.")
+        backend.close()
+
+        # Through tournament.py, players come from a generator.
+        previous = getBackend()
+        configureBackend('journal', database=path)
+        try:
+            deleteMatches()
+            deletePlayers()
+            ids = registerPlayers(["Player %d" % i for i in range(4)])
+            reportMatch(ids[0], ids[1], 1, 0)
+            standings = playerStandings()
+        finally:
+            configureBackend(previous)
+        backend = JournalBackend(path)
+        if backend.playerStandings() != standings:
+            raise ValueError("Players registered together should be "
+                             "journaled.")
+        backend.close()
+    finally:
+        shutil.rmtree(directory)
+    print "32. Writes are journaled, replayed and compacted."
+
+
+def testServerSideReport():
+    deleteMatches()
+    deletePlayers()
+    [id1, id2, id3] = registerPlayers(["Player %d" % i for i in range(3)])
+    other = createTournament("Other tournament")
+    with Tournament(other):
+        outsider = registerPlayer("Outsider")
+    # The PostgreSQL backend records and checks results on the server.
+    server = type(getBackend()).__module__ == 'storage.postgres'
+
+    system = configureRatings(None)
+    stats = instrumentation.addHook(instrumentation.Stats())
+    try:
+        reportMatch(id1, id2, 1, 0)
+        reportMatch(id3)
+    finally:
+        instrumentation.removeHook(stats)
+        configureRatings(system)
+    if server and stats.summary()['reportMatch']['statements'] != 2:
+        raise ValueError("Unrated results should take one statement each.")
+
+    for result in [(id2, id1, 1, 0), (id3, 0, 1, 0), (id1, id1, 1, 0),
+                   (id1, outsider, 1, 0), (id3 + 1000, id3, 1, 0)]:
+        try:
+            reportMatch(*result)
+        except ValueError:
+            continue
+        raise ValueError("Result %r should be rejected." % (result,))
+    if [row[4] for row in playerStandings()] != [1, 1, 1]:
+        raise ValueError("Rejected results should leave no trace.")
+    dropTournament(other)
+    print "33. Rematches and results of unregistered players are rejected."
+
+
+def testLargeField():
+    # 10001 players after one round: ranks aren't a power of two.
+    n = 10001
+    standings = [(i, "Player %d" % i, 1 if i % 2 else 0, 0, 1)
+                 for i in range(1, n + 1)]
+    standings.sort(key=lambda row: -row[2])
+    opponents = {n: set([0])}
+    for i in range(1, n, 2):
+        opponents[i] = set([i + 1])
+        opponents[i + 1] = set([i])
+    draw = Draw(standings, opponents=opponents)
+    if draw.totalRounds != 14:
+        raise ValueError("10001 players should need 14 rounds.")
+    pairings = draw.getPairings()
+    paired = [player for (id1, name1, id2, name2) in pairings
+              for player in (id1, id2) if player]
+    if len(paired) != n or len(set(paired)) != n:
+        raise ValueError("Each player should be paired exactly once.")
+    if any(id2 in opponents.get(id1, ()) for (id1, n1, id2, n2) in pairings):
+        raise ValueError("A large field should be paired without rematches.")
+    print "34. Fields of any size can be drawn."
+
+
 if __name__ == '__main__':
     testDeleteMatches()
     testDelete()
@@ -262,5 +1014,27 @@ if __name__ == '__main__':
     testPairings()
     testOddPlayersTournament()
     testEvenPlayersTournament()
+    testSession()
+    testReportRound()
+    testStandingsConsistency()
+    testWeightedPairingsTournament()
+    testInfeasibleRound()
+    testSimulation()
+    testInstrumentation()
+    testPairingSnapshot()
+    testPairingState()
+    testCache()
+    testTiebreaks()
+    testStreamingExport()
+    testRegisterPlayers()
+    testBracketPairings()
+    testOfflinePairing()
+    testRatings()
+    testTournaments()
+    testSingleFlightPairings()
+    testLeaderboard()
+    testJournal()
+    testServerSideReport()
+    testLargeField()
     print "\n"
     print "Success!  All tests pass!"
@@ -0,0 +1,492 @@
+#!/usr/bin/env python
+#
+# Maximum weight matching in general graphs.
+#
+# Implementation of Edmonds' blossom algorithm with the primal-dual
+# method, as described by Galil in "Efficient algorithms for finding
+# maximum matching in graphs" (ACM Computing Surveys, 1986).
+# It runs in O(n^3) time, where n is the number of vertices.
+
+
+def maxWeightMatching(edges, maxcardinality=False):
+    """Compute a maximum-weighted matching in a general undirected graph.
+
+    Vertices are identified by consecutive, non-negative integers.
+    Integer weights are handled with exact arithmetic.
+
+    Args:
+      edges: a list of tuples (i, j, weight) describing the edges.
+      maxcardinality: if True, only maximum-cardinality matchings are
+        considered, and the heaviest one among them is returned.
+
+    Returns:
+      A list "mate" such that mate[i] == j if vertex i is matched
+      to vertex j, and mate[i] == -1 if vertex i is not matched.
+    """
+    if not edges:
+        return []
+
+    nedge = len(edges)
+    nvertex = 0
+    for (i, j, weight) in edges:
+        if i < 0 or j < 0 or i == j:
+            raise ValueError("Invalid edge (%r, %r)" % (i, j))
+        nvertex = max(nvertex, i + 1, j + 1)
+
+    maxweight = max(0, max(weight for (i, j, weight) in edges))
+
+    # If p is an edge endpoint, endpoint[p] is the vertex
+    # to which endpoint p is attached.
+    endpoint = [edges[p // 2][p % 2] for p in range(2 * nedge)]
+
+    # neighbend[v] is the list of remote endpoints of the edges
+    # attached to vertex v.
+    neighbend = [[] for i in range(nvertex)]
+    for k, (i, j, weight) in enumerate(edges):
+        neighbend[i].append(2 * k + 1)
+        neighbend[j].append(2 * k)
+
+    # mate[v] is the remote endpoint of the matched edge of vertex v,
+    # or -1 if v is single.
+    mate = nvertex * [-1]
+
+    # label[b] is 0 for an unlabeled top-level blossom or vertex,
+    # 1 for an S-blossom or S-vertex and 2 for a T-blossom or T-vertex.
+    label = (2 * nvertex) * [0]
+
+    # labelend[b] is the remote endpoint of the edge through which
+    # blossom b obtained its label, or -1.
+    labelend = (2 * nvertex) * [-1]
+
+    # inblossom[v] is the top-level blossom to which vertex v belongs.
+    inblossom = list(range(nvertex))
+
+    # Blossoms are numbered from nvertex to 2 * nvertex - 1.
+    blossomparent = (2 * nvertex) * [-1]
+    blossomchilds = (2 * nvertex) * [None]
+    blossombase = list(range(nvertex)) + nvertex * [-1]
+    blossomendps = (2 * nvertex) * [None]
+
+    # bestedge[b] is the least-slack edge to a different S-blossom.
+    bestedge = (2 * nvertex) * [-1]
+    blossombestedges = (2 * nvertex) * [None]
+
+    unusedblossoms = list(range(nvertex, 2 * nvertex))
+
+    # Dual variables: vertices start at maxweight, blossoms at zero.
+    dualvar = nvertex * [maxweight] + nvertex * [0]
+
+    # allowedge[k] is True if edge k has zero slack.
+    allowedge = nedge * [False]
+
+    # Queue of newly discovered S-vertices.
+    queue = []
+
+    def slack(k):
+        """Returns 2 * slack of edge k (does not work inside blossoms)."""
+        (i, j, weight) = edges[k]
+        return dualvar[i] + dualvar[j] - 2 * weight
+
+    def blossomLeaves(b):
+        """Generate the leaf vertices of a blossom."""
+        if b < nvertex:
+            yield b
+        else:
+            for t in blossomchilds[b]:
+                if t < nvertex:
+                    yield t
+                else:
+                    for v in blossomLeaves(t):
+                        yield v
+
+    def assignLabel(w, t, p):
+        """Assign label t to the top-level blossom containing vertex w,
+        coming through endpoint p."""
+        b = inblossom[w]
+        label[w] = label[b] = t
+        labelend[w] = labelend[b] = p
+        bestedge[w] = bestedge[b] = -1
+        if t == 1:
+            # b became an S-blossom: scan its vertices.
+            queue.extend(blossomLeaves(b))
+        elif t == 2:
+            # b became a T-blossom: label its mate as S.
+            base = blossombase[b]
+            assignLabel(endpoint[mate[base]], 1, mate[base] ^ 1)
+
+    def scanBlossom(v, w):
+        """Trace back from vertices v and w to discover either a new
+        blossom or an augmenting path.
+
+        Returns:
+          The base vertex of the new blossom, or -1.
+        """
+        path = []
+        base = -1
+        while v != -1 or w != -1:
+            b = inblossom[v]
+            if label[b] & 4:
+                base = blossombase[b]
+                break
+            path.append(b)
+            label[b] = 5
+            if labelend[b] == -1:
+                # The base of blossom b is single: stop tracing this path.
+                v = -1
+            else:
+                v = endpoint[labelend[b]]
+                b = inblossom[v]
+                v = endpoint[labelend[b]]
+            # Swap v and w so that we alternate between both paths.
+            if w != -1:
+                v, w = w, v
+        for b in path:
+            label[b] = 1
+        return base
+
+    def addBlossom(base, k):
+        """Construct a new blossom with the given base,
+        containing edge k which connects a pair of S-vertices."""
+        (v, w, weight) = edges[k]
+        bb = inblossom[base]
+        bv = inblossom[v]
+        bw = inblossom[w]
+        b = unusedblossoms.pop()
+        blossombase[b] = base
+        blossomparent[b] = -1
+        blossomparent[bb] = b
+        blossomchilds[b] = path = []
+        blossomendps[b] = endps = []
+
+        # Trace back from v to base.
+        while bv != bb:
+            blossomparent[bv] = b
+            path.append(bv)
+            endps.append(labelend[bv])
+            v = endpoint[labelend[bv]]
+            bv = inblossom[v]
+        path.append(bb)
+        path.reverse()
+        endps.reverse()
+        endps.append(2 * k)
+
+        # Trace back from w to base.
+        while bw != bb:
+            blossomparent[bw] = b
+            path.append(bw)
+            endps.append(labelend[bw] ^ 1)
+            w = endpoint[labelend[bw]]
+            bw = inblossom[w]
+
+        # The new blossom is an S-blossom.
+        label[b] = 1
+        labelend[b] = labelend[bb]
+        dualvar[b] = 0
+
+        # Relabel vertices: former T-vertices become S-vertices.
+        for v in blossomLeaves(b):
+            if label[inblossom[v]] == 2:
+                queue.append(v)
+            inblossom[v] = b
+
+        # Compute the least-slack edges to neighbouring S-blossoms.
+        bestedgeto = (2 * nvertex) * [-1]
+        for bv in path:
+            if blossombestedges[bv] is None:
+                nblists = [[p // 2 for p in neighbend[v]]
+                           for v in blossomLeaves(bv)]
+            else:
+                nblists = [blossombestedges[bv]]
+            for nblist in nblists:
+                for k in nblist:
+                    (i, j, weight) = edges[k]
+                    if inblossom[j] == b:
+                        i, j = j, i
+                    bj = inblossom[j]
+                    if (bj != b and label[bj] == 1 and
+                            (bestedgeto[bj] == -1 or
+                             slack(k) < slack(bestedgeto[bj]))):
+                        bestedgeto[bj] = k
+            blossombestedges[bv] = None
+            bestedge[bv] = -1
+        blossombestedges[b] = [k for k in bestedgeto if k != -1]
+        bestedge[b] = -1
+        for k in blossombestedges[b]:
+            if bestedge[b] == -1 or slack(k) < slack(bestedge[b]):
+                bestedge[b] = k
+
+    def expandBlossom(b, endstage):
+        """Expand the given top-level blossom."""
+        # Promote the sub-blossoms to top-level.
+        for s in blossomchilds[b]:
+            blossomparent[s] = -1
+            if s < nvertex:
+                inblossom[s] = s
+            elif endstage and dualvar[s] == 0:
+                expandBlossom(s, endstage)
+            else:
+                for v in blossomLeaves(s):
+                    inblossom[v] = s
+
+        # If we expand a T-blossom during a stage,
+        # its sub-blossoms must be relabeled.
+        if (not endstage) and label[b] == 2:
+            entrychild = inblossom[endpoint[labelend[b] ^ 1]]
+            j = blossomchilds[b].index(entrychild)
+            if j & 1:
+                j -= len(blossomchilds[b])
+                jstep = 1
+                endptrick = 0
+            else:
+                jstep = -1
+                endptrick = 1
+            p = labelend[b]
+            while j != 0:
+                # Relabel the T-sub-blossom.
+                label[endpoint[p ^ 1]] = 0
+                label[endpoint[
+                    blossomendps[b][j - endptrick] ^ endptrick ^ 1]] = 0
+                assignLabel(endpoint[p ^ 1], 2, p)
+                # Step to the next S-sub-blossom.
+                allowedge[blossomendps[b][j - endptrick] // 2] = True
+                j += jstep
+                p = blossomendps[b][j - endptrick] ^ endptrick
+                # Step to the next T-sub-blossom.
+                allowedge[p // 2] = True
+                j += jstep
+            # Relabel the base T-sub-blossom without
+            # labeling its mate as S.
+            bv = blossomchilds[b][j]
+            label[endpoint[p ^ 1]] = label[bv] = 2
+            labelend[endpoint[p ^ 1]] = labelend[bv] = p
+            bestedge[bv] = -1
+            # Continue along the blossom until we get back to entrychild.
+            j += jstep
+            while blossomchilds[b][j] != entrychild:
+                bv = blossomchilds[b][j]
+                if label[bv] == 1:
+                    j += jstep
+                    continue
+                for v in blossomLeaves(bv):
+                    if label[v] != 0:
+                        break
+                if label[v] != 0:
+                    label[v] = 0
+                    label[endpoint[mate[blossombase[bv]]]] = 0
+                    assignLabel(v, 2, labelend[v])
+                j += jstep
+
+        # Recycle the blossom number.
+        label[b] = labelend[b] = -1
+        blossomchilds[b] = blossomendps[b] = None
+        blossombase[b] = -1
+        blossombestedges[b] = None
+        bestedge[b] = -1
+        unusedblossoms.append(b)
+
+    def augmentBlossom(b, v):
+        """Swap matched/unmatched edges over an alternating path
+        through blossom b between vertex v and the base vertex."""
+        t = v
+        while blossomparent[t] != b:
+            t = blossomparent[t]
+        if t >= nvertex:
+            augmentBlossom(t, v)
+        i = j = blossomchilds[b].index(t)
+        if i & 1:
+            j -= len(blossomchilds[b])
+            jstep = 1
+            endptrick = 0
+        else:
+            jstep = -1
+            endptrick = 1
+        while j != 0:
+            j += jstep
+            t = blossomchilds[b][j]
+            p = blossomendps[b][j - endptrick] ^ endptrick
+            if t >= nvertex:
+                augmentBlossom(t, endpoint[p])
+            j += jstep
+            t = blossomchilds[b][j]
+            if t >= nvertex:
+                augmentBlossom(t, endpoint[p ^ 1])
+            mate[endpoint[p]] = p ^ 1
+            mate[endpoint[p ^ 1]] = p
+        # Rotate the list of sub-blossoms to put the new base in front.
+        blossomchilds[b] = blossomchilds[b][i:] + blossomchilds[b][:i]
+        blossomendps[b] = blossomendps[b][i:] + blossomendps[b][:i]
+        blossombase[b] = blossombase[blossomchilds[b][0]]
+
+    def augmentMatching(k):
+        """Swap matched/unmatched edges over an alternating path
+        between two single vertices, going through edge k."""
+        (v, w, weight) = edges[k]
+        for (s, p) in ((v, 2 * k + 1), (w, 2 * k)):
+            while True:
+                bs = inblossom[s]
+                if bs >= nvertex:
+                    augmentBlossom(bs, s)
+                mate[s] = p
+                if labelend[bs] == -1:
+                    # Reached a single vertex.
+                    break
+                t = endpoint[labelend[bs]]
+                bt = inblossom[t]
+                s = endpoint[labelend[bt]]
+                j = endpoint[labelend[bt] ^ 1]
+                if bt >= nvertex:
+                    augmentBlossom(bt, j)
+                mate[j] = labelend[bt]
+                p = labelend[bt] ^ 1
+
+    # Each iteration of this loop is a stage:
+    # a stage finds an augmenting path and uses it to improve the matching.
+    for stage in range(nvertex):
+
+        label[:] = (2 * nvertex) * [0]
+        bestedge[:] = (2 * nvertex) * [-1]
+        blossombestedges[nvertex:] = nvertex * [None]
+        allowedge[:] = nedge * [False]
+        queue[:] = []
+
+        # Label single blossoms/vertices with S and put them in the queue.
+        for v in range(nvertex):
+            if mate[v] == -1 and label[inblossom[v]] == 0:
+                assignLabel(v, 1, -1)
+
+        augmented = False
+        while True:
+
+            # Grow the alternating forest.
+            while queue and not augmented:
+                v = queue.pop()
+                for p in neighbend[v]:
+                    k = p // 2
+                    w = endpoint[p]
+                    if inblossom[v] == inblossom[w]:
+                        continue
+                    if not allowedge[k]:
+                        kslack = slack(k)
+                        if kslack <= 0:
+                            allowedge[k] = True
+                    if allowedge[k]:
+                        if label[inblossom[w]] == 0:
+                            # w is free: label it T and its mate S.
+                            assignLabel(w, 2, p ^ 1)
+                        elif label[inblossom[w]] == 1:
+                            # w is an S-vertex: either a new blossom
+                            # or an augmenting path.
+                            base = scanBlossom(v, w)
+                            if base >= 0:
+                                addBlossom(base, k)
+                            else:
+                                augmentMatching(k)
+                                augmented = True
+                                break
+                        elif label[w] == 0:
+                            # w is inside a T-blossom but not yet reached.
+                            label[w] = 2
+                            labelend[w] = p ^ 1
+                    elif label[inblossom[w]] == 1:
+                        b = inblossom[v]
+                        if bestedge[b] == -1 or kslack < slack(bestedge[b]):
+                            bestedge[b] = k
+                    elif label[w] == 0:
+                        if bestedge[w] == -1 or kslack < slack(bestedge[w]):
+                            bestedge[w] = k
+
+            if augmented:
+                break
+
+            # No augmenting path yet: compute the dual variables update.
+            deltatype = -1
+            delta = deltaedge = deltablossom = None
+
+            # Delta 1: the minimum vertex dual.
+            if not maxcardinality:
+                deltatype = 1
+                delta = min(dualvar[:nvertex])
+
+            # Delta 2: the minimum slack between an S-vertex
+            # and a free vertex.
+            for v in range(nvertex):
+                if label[inblossom[v]] == 0 and bestedge[v] != -1:
+                    d = slack(bestedge[v])
+                    if deltatype == -1 or d < delta:
+                        delta = d
+                        deltatype = 2
+                        deltaedge = bestedge[v]
+
+            # Delta 3: half the minimum slack between two S-blossoms.
+            for b in range(2 * nvertex):
+                if (blossomparent[b] == -1 and label[b] == 1 and
+                        bestedge[b] != -1):
+                    kslack = slack(bestedge[b])
+                    if isinstance(kslack, float):
+                        d = kslack / 2.0
+                    else:
+                        d = kslack // 2
+                    if deltatype == -1 or d < delta:
+                        delta = d
+                        deltatype = 3
+                        deltaedge = bestedge[b]
+
+            # Delta 4: the minimum dual of a T-blossom.
+            for b in range(nvertex, 2 * nvertex):
+                if (blossombase[b] >= 0 and blossomparent[b] == -1 and
+                        label[b] == 2 and
+                        (deltatype == -1 or dualvar[b] < delta)):
+                    delta = dualvar[b]
+                    deltatype = 4
+                    deltablossom = b
+
+            if deltatype == -1:
+                # No further improvement is possible: this only happens
+                # when looking for a maximum-cardinality matching.
+                deltatype = 1
+                delta = max(0, min(dualvar[:nvertex]))
+
+            # Update the dual variables.
+            for v in range(nvertex):
+                if label[inblossom[v]] == 1:
+                    dualvar[v] -= delta
+                elif label[inblossom[v]] == 2:
+                    dualvar[v] += delta
+            for b in range(nvertex, 2 * nvertex):
+                if blossombase[b] >= 0 and blossomparent[b] == -1:
+                    if label[b] == 1:
+                        dualvar[b] += delta
+                    elif label[b] == 2:
+                        dualvar[b] -= delta
+
+            if deltatype == 1:
+                # The optimum has been reached.
+                break
+            elif deltatype == 2:
+                allowedge[deltaedge] = True
+                (i, j, weight) = edges[deltaedge]
+                if label[inblossom[i]] == 0:
+                    i, j = j, i
+                queue.append(i)
+            elif deltatype == 3:
+                allowedge[deltaedge] = True
+                (i, j, weight) = edges[deltaedge]
+                queue.append(i)
+            elif deltatype == 4:
+                expandBlossom(deltablossom, False)
+
+        if not augmented:
+            break
+
+        # End of stage: expand all S-blossoms with zero dual.
+        for b in range(nvertex, 2 * nvertex):
+            if (blossomparent[b] == -1 and blossombase[b] >= 0 and
+                    label[b] == 1 and dualvar[b] == 0):
+                expandBlossom(b, True)
+
+    # Transform mate[] such that mate[v] is the vertex to which v is paired.
+    for v in range(nvertex):
+        if mate[v] >= 0:
+            mate[v] = endpoint[mate[v]]
+
+    return mate